@@ -1,15 +1,74 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack, asynccontextmanager
 from typing import List, Dict, Any, Optional
-from fastapi import FastAPI, UploadFile, File, Form
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 
+from qa_agent import metrics, resources
 from qa_agent.knowledge_base import KnowledgeBase
+from qa_agent.projects import DEFAULT_PROJECT, InvalidProjectId, ProjectBusy, ProjectPool, validate_project_id
 from qa_agent.llm import LLMProvider
-from qa_agent.agent import generate_test_cases
-from qa_agent.script_generator import generate_selenium_script
+from qa_agent.snapshot import SnapshotError
+from qa_agent.agent import generate_test_cases, generate_test_plan, iter_test_plan, stream_test_cases
+from qa_agent.script_generator import (
+    build_scripts_zip,
+    generate_selenium_scripts,
+    iter_selenium_scripts,
+    scripts_report,
+    stream_selenium_script,
+    synthesize_selenium_script,
+)
+
+from backend.jobs import ConcurrencyLimiter, JobManager, QueueFull
+
+
+# One KnowledgeBase per project, opened on first use and kept in a bounded LRU pool
+projects = ProjectPool()
+
+
+@asynccontextmanager
+async def project_kb(project_id: str):
+    """Lease a project's KnowledgeBase for the duration of a request."""
+    # Opening a project imports chromadb and loads its store; keep it off the event loop
+    kb = await asyncio.to_thread(projects.acquire, project_id)
+    try:
+        yield kb
+    finally:
+        await asyncio.to_thread(projects.release, project_id)
 
 
-app = FastAPI(title="Autonomous QA Agent Backend")
+def _load_startup_snapshot():
+    # Seed a fresh node from a snapshot instead of re-embedding the corpus
+    path = os.getenv("KB_SNAPSHOT")
+    if path and projects.get(DEFAULT_PROJECT).store.collection.count() == 0:
+        projects.import_snapshot(DEFAULT_PROJECT, path)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await asyncio.to_thread(_load_startup_snapshot)
+    if os.getenv("BACKEND_WARMUP", "1") == "1":
+        # Load the store and embedding model in the background; the server accepts requests meanwhile
+        threading.Thread(
+            target=lambda: (projects.get(DEFAULT_PROJECT), resources.warm_up(background=False)),
+            name="qa-warm-up",
+            daemon=True,
+        ).start()
+    yield
+    projects.close()
+
+
+app = FastAPI(title="Autonomous QA Agent Backend", lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -18,9 +77,70 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-kb = KnowledgeBase()
 llm = LLMProvider()
 
+# Heavy, synchronous work (parsing, embedding, Chroma, Ollama) never runs on
+# the event loop: it goes to bounded thread pools, gated per endpoint.
+GENERATE_CONCURRENCY = int(os.getenv("BACKEND_GENERATE_CONCURRENCY", "4"))
+BUILD_CONCURRENCY = int(os.getenv("BACKEND_BUILD_CONCURRENCY", "1"))
+MAX_WAITING = int(os.getenv("BACKEND_MAX_WAITING", "64"))
+
+executors = {
+    "build": ThreadPoolExecutor(max_workers=BUILD_CONCURRENCY, thread_name_prefix="build"),
+    "generate": ThreadPoolExecutor(max_workers=GENERATE_CONCURRENCY, thread_name_prefix="generate"),
+}
+limiters = {
+    "build_kb": ConcurrencyLimiter("build_kb", BUILD_CONCURRENCY, MAX_WAITING),
+    "generate_test_cases": ConcurrencyLimiter("generate_test_cases", GENERATE_CONCURRENCY, MAX_WAITING),
+    "generate_selenium_script": ConcurrencyLimiter("generate_selenium_script", GENERATE_CONCURRENCY, MAX_WAITING),
+}
+jobs = JobManager(
+    workers={"build_kb": 1, "generate": int(os.getenv("BACKEND_JOB_WORKERS", "2"))},
+    max_pending=int(os.getenv("BACKEND_MAX_PENDING_JOBS", "64")),
+)
+
+
+async def run_blocking(kind: str, fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executors[kind], lambda: fn(*args, **kwargs))
+
+
+_DONE = object()
+
+
+async def iterate_blocking(kind: str, gen):
+    """Drive a blocking generator from the event loop, one step per executor call."""
+    loop = asyncio.get_running_loop()
+    while True:
+        item = await loop.run_in_executor(executors[kind], next, gen, _DONE)
+        if item is _DONE:
+            return
+        yield item
+
+
+def _sse(event: Dict[str, Any]) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+@app.exception_handler(QueueFull)
+async def queue_full_handler(request: Request, exc: QueueFull):
+    return JSONResponse(status_code=429, content={"status": "error", "message": str(exc)})
+
+
+@app.exception_handler(InvalidProjectId)
+async def invalid_project_handler(request: Request, exc: InvalidProjectId):
+    return JSONResponse(status_code=400, content={"status": "error", "message": str(exc)})
+
+
+@app.exception_handler(SnapshotError)
+async def snapshot_error_handler(request: Request, exc: SnapshotError):
+    return JSONResponse(status_code=400, content={"status": "error", "message": str(exc)})
+
+
+@app.exception_handler(ProjectBusy)
+async def project_busy_handler(request: Request, exc: ProjectBusy):
+    return JSONResponse(status_code=409, content={"status": "error", "message": str(exc)})
+
 
 class DocItem(BaseModel):
     filename: str
@@ -30,47 +150,435 @@ class DocItem(BaseModel):
 class BuildKBRequest(BaseModel):
     documents: List[DocItem]
     html_document: Optional[DocItem] = None
+    project_id: str = DEFAULT_PROJECT
 
 
-@app.post("/build_kb")
-async def build_kb(req: BuildKBRequest):
+def _build_docs(req: BuildKBRequest):
     docs = [{"filename": d.filename, "content": d.content.encode("utf-8") } for d in req.documents]
     html_doc = None
     if req.html_document:
         html_doc = {"filename": req.html_document.filename, "content": req.html_document.content.encode("utf-8")}
-    kb.build(docs, html_document=html_doc)
-    return {"status": "ok", "message": "Knowledge Base Built"}
+    return docs, html_doc
+
+
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or None
+
+
+def _spool_uploads_sync(files: List[UploadFile], html: Optional[UploadFile]):
+    spool_dir = tempfile.mkdtemp(prefix="qa-upload-", dir=UPLOAD_SPOOL_DIR)
+
+    def spool(i: int, f: UploadFile) -> Dict[str, Any]:
+        path = os.path.join(spool_dir, f"{i}-{os.path.basename(f.filename or 'upload')}")
+        f.file.seek(0)
+        with open(path, "wb") as out:
+            shutil.copyfileobj(f.file, out, 1 << 20)
+        return {"filename": f.filename, "path": path}
+
+    try:
+        docs = [spool(i, f) for i, f in enumerate(files)]
+        html_doc = spool(len(files), html) if html is not None else None
+    except BaseException:
+        shutil.rmtree(spool_dir, ignore_errors=True)
+        raise
+    return docs, html_doc, spool_dir
+
+
+async def _spool_uploads(files: List[UploadFile], html: Optional[UploadFile]):
+    """Copy uploads to a spool dir in 1 MiB blocks; documents are then built from paths."""
+    return await asyncio.to_thread(_spool_uploads_sync, files, html)
+
+
+def _build_spooled(project_id: str, docs, html_doc, spool_dir: str, progress=None):
+    try:
+        with projects.lease(project_id) as kb:
+            return kb.build(docs, html_document=html_doc, progress=progress)
+    finally:
+        shutil.rmtree(spool_dir, ignore_errors=True)
+
+
+@app.post("/build_kb")
+async def build_kb(req: BuildKBRequest):
+    docs, html_doc = _build_docs(req)
+    async with project_kb(req.project_id) as kb, limiters["build_kb"]:
+        stats = await run_blocking("build", kb.build, docs, html_document=html_doc)
+    return {"status": "ok", "message": "Knowledge Base Built", "project_id": req.project_id, "stats": stats}
 
 
 @app.post("/build_kb/upload")
-async def build_kb_upload(files: List[UploadFile] = File(default=[]), html: UploadFile | None = File(default=None)):
-    docs = []
-    for f in files:
-        content = await f.read()
-        docs.append({"filename": f.filename, "content": content})
-    html_doc = None
-    if html is not None:
-        html_doc = {"filename": html.filename, "content": await html.read()}
-    kb.build(docs, html_document=html_doc)
-    return {"status": "ok", "message": "Knowledge Base Built"}
+async def build_kb_upload(
+    files: List[UploadFile] = File(default=[]),
+    html: UploadFile | None = File(default=None),
+    project_id: str = Form(default=DEFAULT_PROJECT),
+):
+    validate_project_id(project_id)
+    docs, html_doc, spool_dir = await _spool_uploads(files, html)
+    try:
+        async with limiters["build_kb"]:
+            stats = await run_blocking("build", _build_spooled, project_id, docs, html_doc, spool_dir)
+    finally:
+        shutil.rmtree(spool_dir, ignore_errors=True)
+    return {"status": "ok", "message": "Knowledge Base Built", "project_id": project_id, "stats": stats}
 
 
 class TestCaseRequest(BaseModel):
     query: str
+    project_id: str = DEFAULT_PROJECT
 
 
 @app.post("/generate_test_cases")
 async def api_generate_test_cases(req: TestCaseRequest):
-    out = generate_test_cases(req.query, kb, llm)
+    async with project_kb(req.project_id) as kb, limiters["generate_test_cases"]:
+        out = await run_blocking("generate", generate_test_cases, req.query, kb, llm)
     return {"status": "ok", "data": out}
 
 
+class TestPlanRequest(BaseModel):
+    query: str
+    concurrency: Optional[int] = None
+    max_features: Optional[int] = None
+    project_id: str = DEFAULT_PROJECT
+
+
+@app.post("/generate_test_plan")
+async def api_generate_test_plan(req: TestPlanRequest):
+    """Planner mode: one sub-query per KB feature, generated concurrently and merged into a JSON plan."""
+    async with project_kb(req.project_id) as kb, limiters["generate_test_cases"]:
+        plan = await run_blocking(
+            "generate", generate_test_plan, req.query, kb, llm,
+            concurrency=req.concurrency, max_features=req.max_features,
+        )
+    return {"status": "ok", "plan": plan}
+
+
 class SeleniumScriptRequest(BaseModel):
     test_case: Dict[str, Any]
+    project_id: str = DEFAULT_PROJECT
 
 
 @app.post("/generate_selenium_script")
 async def api_generate_selenium_script(req: SeleniumScriptRequest):
-    html_text = kb.get_html() or ""
-    code = generate_selenium_script(req.test_case, html_text, kb, llm)
-    return {"status": "ok", "code": code}
\ No newline at end of file
+    async with project_kb(req.project_id) as kb, limiters["generate_selenium_script"]:
+        html_text = kb.get_html() or ""
+        result = await run_blocking("generate", synthesize_selenium_script, req.test_case, html_text, kb, llm)
+    return {"status": "ok", **result}
+
+
+class BulkSeleniumScriptRequest(BaseModel):
+    test_cases: List[Dict[str, Any]]
+    concurrency: Optional[int] = None
+    project_id: str = DEFAULT_PROJECT
+
+
+@app.post("/generate_selenium_scripts/zip")
+async def api_generate_selenium_scripts_zip(req: BulkSeleniumScriptRequest):
+    """Generate scripts for a whole test plan; returns a zip with report.json."""
+    async with project_kb(req.project_id) as kb, limiters["generate_selenium_script"]:
+        html_text = kb.get_html() or ""
+        results = await run_blocking(
+            "generate", generate_selenium_scripts, req.test_cases, html_text, kb, llm, concurrency=req.concurrency
+        )
+    return Response(
+        content=build_scripts_zip(results),
+        media_type="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="selenium_scripts.zip"'},
+    )
+
+
+@app.post("/generate_selenium_scripts/stream")
+async def api_stream_selenium_scripts(req: BulkSeleniumScriptRequest):
+    """SSE: one "script" event per case as it finishes, then a "result" event with the report."""
+
+    def events(kb: KnowledgeBase):
+        results = []
+        html_text = kb.get_html() or ""
+        for r in iter_selenium_scripts(req.test_cases, html_text, kb, llm, concurrency=req.concurrency):
+            results.append(r)
+            yield {"type": "script", **r}
+        yield {"type": "result", "report": scripts_report(results)}
+
+    return await _stream_events("generate", "generate_selenium_script", req.project_id, events)
+
+
+# --- Streaming variants: tokens as they are generated, then the structured result
+
+async def _stream_events(kind: str, limiter: str, project_id: str, make_gen):
+    # Lease and slot are taken before the 200 starts, so a bad project or a full
+    # queue gets its 400/429; both are released once the response has finished
+    validate_project_id(project_id)
+    held = AsyncExitStack()
+    try:
+        kb = await held.enter_async_context(project_kb(project_id))
+        await held.enter_async_context(limiters[limiter])
+    except BaseException:
+        await held.aclose()
+        raise
+
+    async def events():
+        try:
+            async for event in iterate_blocking(kind, make_gen(kb)):
+                yield _sse(event)
+        except Exception as e:
+            # Headers are already sent; report it in-band like the WebSocket does
+            yield _sse({"type": "error", "message": str(e)})
+    return StreamingResponse(events(), media_type="text/event-stream", background=BackgroundTask(held.aclose))
+
+
+@app.post("/generate_test_cases/stream")
+async def api_stream_test_cases(req: TestCaseRequest):
+    return await _stream_events(
+        "generate", "generate_test_cases", req.project_id,
+        lambda kb: stream_test_cases(req.query, kb, llm),
+    )
+
+
+@app.post("/generate_test_plan/stream")
+async def api_stream_test_plan(req: TestPlanRequest):
+    """SSE: a "feature" event as each feature finishes, then a "result" event with the merged plan."""
+    return await _stream_events(
+        "generate", "generate_test_cases", req.project_id,
+        lambda kb: iter_test_plan(req.query, kb, llm, concurrency=req.concurrency, max_features=req.max_features),
+    )
+
+
+@app.post("/generate_selenium_script/stream")
+async def api_stream_selenium_script(req: SeleniumScriptRequest):
+    return await _stream_events(
+        "generate", "generate_selenium_script", req.project_id,
+        lambda kb: stream_selenium_script(req.test_case, kb.get_html() or "", kb, llm),
+    )
+
+
+@app.websocket("/ws/generate")
+async def ws_generate(websocket: WebSocket):
+    """
+    Each client message is {"kind": "test_cases", "query": ...} or
+    {"kind": "selenium_script", "test_case": {...}}, with an optional
+    "project_id"; the server replies with token events followed by a result
+    event.
+    """
+    await websocket.accept()
+    try:
+        while True:
+            msg = await websocket.receive_json()
+            kind = msg.get("kind")
+            if kind not in ("selenium_script", "test_cases"):
+                await websocket.send_json({"type": "error", "message": "kind must be test_cases or selenium_script"})
+                continue
+            limiter = "generate_selenium_script" if kind == "selenium_script" else "generate_test_cases"
+            try:
+                async with project_kb(msg.get("project_id") or DEFAULT_PROJECT) as kb, limiters[limiter]:
+                    if kind == "selenium_script":
+                        gen = stream_selenium_script(msg.get("test_case") or {}, kb.get_html() or "", kb, llm)
+                    else:
+                        gen = stream_test_cases(msg.get("query", ""), kb, llm)
+                    async for event in iterate_blocking("generate", gen):
+                        await websocket.send_json(event)
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                await websocket.send_json({"type": "error", "message": str(e)})
+    except WebSocketDisconnect:
+        return
+
+
+# --- Job API: submit -> job id -> poll (GET /jobs/{id}) or stream (GET /jobs/{id}/events)
+
+def _submit_build(project_id: str, docs, html_doc):
+    def run(job):
+        with projects.lease(project_id) as kb:
+            return kb.build(docs, html_document=html_doc, progress=job.set_progress)
+
+    return jobs.submit("build_kb", run)
+
+
+@app.post("/jobs/build_kb")
+async def submit_build_kb(req: BuildKBRequest):
+    validate_project_id(req.project_id)
+    docs, html_doc = _build_docs(req)
+    job = _submit_build(req.project_id, docs, html_doc)
+    return {"status": "ok", "job_id": job.id}
+
+
+@app.post("/jobs/build_kb/upload")
+async def submit_build_kb_upload(
+    files: List[UploadFile] = File(default=[]),
+    html: UploadFile | None = File(default=None),
+    project_id: str = Form(default=DEFAULT_PROJECT),
+):
+    validate_project_id(project_id)
+    docs, html_doc, spool_dir = await _spool_uploads(files, html)
+    try:
+        job = jobs.submit(
+            "build_kb", lambda job: _build_spooled(project_id, docs, html_doc, spool_dir, progress=job.set_progress)
+        )
+    except BaseException:
+        shutil.rmtree(spool_dir, ignore_errors=True)
+        raise
+    return {"status": "ok", "job_id": job.id}
+
+
+class BulkTestCaseRequest(BaseModel):
+    queries: List[str]
+    project_id: str = DEFAULT_PROJECT
+
+
+@app.post("/jobs/generate_test_cases")
+async def submit_generate_test_cases(req: BulkTestCaseRequest):
+    validate_project_id(req.project_id)
+
+    def run(job):
+        results = []
+        with projects.lease(req.project_id) as kb:
+            for i, q in enumerate(req.queries):
+                results.append({"query": q, "data": generate_test_cases(q, kb, llm)})
+                job.set_progress({"done": i + 1, "total": len(req.queries)})
+        return results
+
+    job = jobs.submit("generate", run)
+    return {"status": "ok", "job_id": job.id}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return {"status": "ok", "job": job.to_dict()}
+
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+
+    async def events():
+        seen = -1
+        while True:
+            revision, state = job.snapshot()
+            finished = state["status"] in ("done", "failed")
+            # The final state always goes out, whatever was sent before
+            if finished or revision != seen:
+                seen = revision
+                yield f"data: {json.dumps(state, default=str)}\n\n"
+            if finished:
+                return
+            await asyncio.sleep(0.25)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+# --- Projects: each has its own collection, manifest, caches and HTML/selector state
+
+@app.get("/projects")
+async def list_projects():
+    return {"status": "ok", "projects": projects.project_ids(), "pool": projects.stats()}
+
+
+@app.post("/projects/{project_id}/compact")
+async def compact_project(project_id: str):
+    if not projects.exists(project_id):
+        raise HTTPException(status_code=404, detail="Unknown project")
+    async with limiters["build_kb"]:
+        stats = await run_blocking("build", projects.compact, project_id)
+    return {"status": "ok", "project_id": project_id, "stats": stats}
+
+
+@app.get("/projects/{project_id}/snapshot")
+async def export_project_snapshot(project_id: str):
+    """Download the project's knowledge base as a snapshot zip."""
+    if not projects.exists(project_id):
+        raise HTTPException(status_code=404, detail="Unknown project")
+    work = tempfile.mkdtemp(prefix="qa-snapshot-", dir=UPLOAD_SPOOL_DIR)
+    path = os.path.join(work, f"{project_id}.zip")
+    try:
+        async with limiters["build_kb"]:
+            await run_blocking("build", projects.export_snapshot, project_id, path)
+    except BaseException:
+        shutil.rmtree(work, ignore_errors=True)
+        raise
+    return FileResponse(
+        path,
+        media_type="application/zip",
+        filename=f"{project_id}-snapshot.zip",
+        background=BackgroundTask(shutil.rmtree, work, ignore_errors=True),
+    )
+
+
+def _import_spooled_snapshot(project_id: str, upload: UploadFile, verify: bool):
+    docs, _, spool_dir = _spool_uploads_sync([upload], None)
+    try:
+        return projects.import_snapshot(project_id, docs[0]["path"], verify=verify)
+    finally:
+        shutil.rmtree(spool_dir, ignore_errors=True)
+
+
+@app.post("/projects/{project_id}/snapshot")
+async def import_project_snapshot(project_id: str, file: UploadFile = File(...), verify: bool = Form(True)):
+    """Replace the project's knowledge base with an uploaded snapshot; nothing is re-embedded."""
+    validate_project_id(project_id)
+    async with limiters["build_kb"]:
+        stats = await run_blocking("build", _import_spooled_snapshot, project_id, file, verify)
+    return {"status": "ok", "project_id": project_id, "stats": stats}
+
+
+@app.delete("/projects/{project_id}")
+async def delete_project(project_id: str):
+    if not projects.exists(project_id):
+        raise HTTPException(status_code=404, detail="Unknown project")
+    async with limiters["build_kb"]:
+        await run_blocking("build", projects.delete, project_id)
+    return {"status": "ok", "project_id": project_id, "message": "Project deleted"}
+
+
+@app.get("/stats/queues")
+async def queue_stats():
+    return {
+        "status": "ok",
+        "endpoints": {name: lim.stats() for name, lim in limiters.items()},
+        "jobs": jobs.stats(),
+        "projects": projects.stats(),
+        "llm": llm.scheduler.stats(),
+    }
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus text format: per-stage timings, LLM/cache counters and current queue gauges."""
+    gauges = [
+        "# TYPE qa_endpoint_in_flight gauge",
+        *(f'qa_endpoint_in_flight{{endpoint="{name}"}} {lim.in_flight}' for name, lim in limiters.items()),
+        "# TYPE qa_endpoint_waiting gauge",
+        *(f'qa_endpoint_waiting{{endpoint="{name}"}} {lim.waiting}' for name, lim in limiters.items()),
+        "# TYPE qa_jobs gauge",
+        *(f'qa_jobs{{status="{status}"}} {n}' for status, n in jobs.stats().items() if status != "max_pending"),
+    ]
+    sched = llm.scheduler.stats()
+    gauges += [
+        "# TYPE qa_llm_active gauge",
+        f'qa_llm_active{{model="{sched["model"]}"}} {sched["active"]}',
+        "# TYPE qa_llm_queued gauge",
+        *(f'qa_llm_queued{{model="{sched["model"]}",priority="{p}"}} {n}' for p, n in sched["queued"].items()),
+    ]
+    # Only projects that are already open: scraping must not be what loads a store
+    open_projects = projects.open_projects()
+    pool = projects.stats()
+    gauges += [
+        "# TYPE qa_projects_open gauge",
+        f"qa_projects_open {len(open_projects)}",
+        "# TYPE qa_project_footprint_bytes gauge",
+        *(f'qa_project_footprint_bytes{{project="{p}"}} {n}' for p, n in pool["footprint_bytes"].items()),
+    ]
+    if open_projects:
+        gauges += [
+            "# TYPE qa_embedding_cache_entries gauge",
+            f"qa_embedding_cache_entries {next(iter(open_projects.values())).store.embedding_cache.stats()['entries']}",
+            "# TYPE qa_response_cache_entries gauge",
+            *(f'qa_response_cache_entries{{project="{p}"}} {kb.response_cache.stats()["entries"]}' for p, kb in open_projects.items()),
+            "# TYPE qa_kb_version gauge",
+            *(f'qa_kb_version{{project="{p}"}} {kb.version}' for p, kb in open_projects.items()),
+        ]
+    return PlainTextResponse(
+        metrics.render_prometheus() + "\n".join(gauges) + "\n",
+        media_type="text/plain; version=0.0.4",
+    )
@@ -0,0 +1,165 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+import asyncio
+import threading
+import time
+import uuid
+
+
+class QueueFull(Exception):
+    pass
+
+
+class ConcurrencyLimiter:
+    """
+    Per-endpoint concurrency cap with queue-depth accounting.
+
+    At most ``limit`` requests run at once; up to ``max_waiting`` more wait,
+    anything beyond that is rejected with QueueFull.
+    """
+
+    def __init__(self, name: str, limit: int, max_waiting: int = 64):
+        self.name = name
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.in_flight = 0
+        self.waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        self._sem: Optional[asyncio.Semaphore] = None
+
+    async def __aenter__(self):
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.limit)
+        if self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise QueueFull(f"{self.name}: too many queued requests")
+        self.waiting += 1
+        try:
+            await self._sem.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        self.in_flight -= 1
+        self.completed += 1
+        self._sem.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+
+class Job:
+    def __init__(self, kind: str):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = "queued"
+        self.progress: Dict[str, Any] = {}
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        # Bumped on every change so stream consumers can detect updates
+        self.revision = 0
+        # Fields and revision change together, so a reader never sees a new status at an old revision
+        self._lock = threading.Lock()
+
+    def update(self, **fields: Any):
+        with self._lock:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self.revision += 1
+
+    def set_progress(self, progress: Dict[str, Any]):
+        self.update(progress=dict(progress))
+
+    def snapshot(self, include_result: bool = True) -> Tuple[int, Dict[str, Any]]:
+        """(revision, to_dict()) read consistently."""
+        with self._lock:
+            return self.revision, self._to_dict(include_result)
+
+    def to_dict(self, include_result: bool = True) -> Dict[str, Any]:
+        return self.snapshot(include_result)[1]
+
+    def _to_dict(self, include_result: bool) -> Dict[str, Any]:
+        out = {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": self.progress,
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+        if include_result and self.status == "done":
+            out["result"] = self.result
+        return out
+
+
+class JobManager:
+    """Runs submitted jobs on bounded thread pools, one pool per job kind."""
+
+    def __init__(self, workers: Dict[str, int], max_pending: int = 64, max_finished: int = 256):
+        self.max_pending = max_pending
+        self.max_finished = max_finished
+        self._executors = {
+            kind: ThreadPoolExecutor(max_workers=n, thread_name_prefix=f"job-{kind}")
+            for kind, n in workers.items()
+        }
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _pending(self) -> int:
+        return sum(1 for j in self._jobs.values() if j.status in ("queued", "running"))
+
+    def submit(self, kind: str, fn: Callable[[Job], Any]) -> Job:
+        """fn receives the Job (for progress reporting) and returns its result."""
+        with self._lock:
+            if self._pending() >= self.max_pending:
+                raise QueueFull("job queue is full")
+            job = Job(kind)
+            self._jobs[job.id] = job
+            self._trim_locked()
+
+        def run():
+            job.update(status="running", started=time.time())
+            try:
+                result = fn(job)
+            except Exception as e:
+                job.update(status="failed", error=str(e), finished=time.time())
+            else:
+                job.update(status="done", result=result, finished=time.time())
+
+        self._executors[kind].submit(run)
+        return job
+
+    def _trim_locked(self):
+        finished = [k for k, j in self._jobs.items() if j.status in ("done", "failed")]
+        for k in finished[: max(0, len(finished) - self.max_finished)]:
+            self._jobs.pop(k, None)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def stats(self) -> Dict[str, Any]:
+        by_status: Dict[str, int] = {}
+        for j in list(self._jobs.values()):
+            by_status[j.status] = by_status.get(j.status, 0) + 1
+        return {
+            "queued": by_status.get("queued", 0),
+            "running": by_status.get("running", 0),
+            "done": by_status.get("done", 0),
+            "failed": by_status.get("failed", 0),
+            "max_pending": self.max_pending,
+        }
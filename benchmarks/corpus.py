@@ -0,0 +1,156 @@
+"""Deterministic synthetic corpus (MD/TXT/JSON/HTML/PDF) for benchmarks."""
+from typing import List, Dict, Any, Optional
+import argparse
+import json
+import os
+import random
+
+
+FEATURES = [
+    "Discount Codes", "Shipping Costs", "Cart and Pricing", "Validation Rules", "Payment",
+    "Order History", "Gift Cards", "Loyalty Points", "Tax Calculation", "Returns",
+]
+WORDS = (
+    "the cart total must update when a user applies a valid code and shipping method "
+    "changes error messages appear inline near the field payment succeeds only if the "
+    "form is valid subtotal discount express standard email address name required"
+).split()
+
+
+def _sentence(rng: random.Random, n: int = 14) -> str:
+    words = [rng.choice(WORDS) for _ in range(n)]
+    return " ".join(words).capitalize() + "."
+
+
+def _paragraph(rng: random.Random, sentences: int = 4) -> str:
+    return " ".join(_sentence(rng) for _ in range(sentences))
+
+
+def make_markdown(rng: random.Random, size: int) -> str:
+    out = ["# Product Specifications"]
+    while sum(len(x) for x in out) < size:
+        feature = rng.choice(FEATURES)
+        code = f"SAVE{rng.randint(5, 50)}"
+        out.append(f"\n## {feature}\n- The code `{code}` applies to {feature.lower()}.\n{_paragraph(rng)}")
+    return "\n".join(out)
+
+
+def make_text(rng: random.Random, size: int) -> str:
+    out = ["UI/UX Guidelines"]
+    while sum(len(x) for x in out) < size:
+        out.append(_paragraph(rng))
+    return "\n\n".join(out)
+
+
+def make_json(rng: random.Random, size: int) -> str:
+    endpoints: Dict[str, Any] = {}
+    while len(json.dumps(endpoints)) < size:
+        name = f"POST /{rng.choice(FEATURES).lower().replace(' ', '_')}_{len(endpoints)}"
+        endpoints[name] = {
+            "code": "string",
+            "amount": "number",
+            "items": [{"id": "number", "qty": "number"}],
+            "description": _sentence(rng),
+        }
+    return json.dumps(endpoints, indent=2)
+
+
+def make_html(rng: random.Random, size: int) -> str:
+    body = []
+    i = 0
+    while sum(len(x) for x in body) < size:
+        i += 1
+        body.append(
+            f'<section id="section_{i}"><h2>{rng.choice(FEATURES)}</h2>'
+            f'<label for="field_{i}">Field {i}</label><input type="text" id="field_{i}" name="field_{i}" />'
+            f'<button id="action_{i}" class="btn">Apply {i}</button><p>{_paragraph(rng, 2)}</p>'
+            f'<div id="field_{i}_error" class="error"></div></section>'
+        )
+    return f"<!DOCTYPE html><html><head><title>Checkout</title></head><body>{''.join(body)}</body></html>"
+
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_pdf(rng: random.Random, size: int, lines_per_page: int = 40) -> bytes:
+    """Minimal multi-page text PDF written by hand (no PDF library needed)."""
+    lines = []
+    while sum(len(x) for x in lines) < size:
+        lines.append(_sentence(rng, 10))
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[""]]
+    objects: List[bytes] = []
+    n_pages = len(pages)
+    # 1: catalog, 2: pages, 3: font, then (page, content) pairs
+    kids = " ".join(f"{4 + 2 * i} 0 R" for i in range(n_pages))
+    objects.append(b"<< /Type /Catalog /Pages 2 0 R >>")
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {n_pages} >>".encode())
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    for i, page_lines in enumerate(pages):
+        content_id = 5 + 2 * i
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>".encode()
+        )
+        stream = "BT /F1 9 Tf 40 760 Td 11 TL " + " ".join(f"({_pdf_escape(ln)}) '" for ln in page_lines) + " ET"
+        data = stream.encode("latin-1")
+        objects.append(b"<< /Length " + str(len(data)).encode() + b" >>\nstream\n" + data + b"\nendstream")
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for num, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{num} 0 obj\n".encode() + obj + b"\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for off in offsets:
+        out += f"{off:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(out)
+
+
+GENERATORS = {
+    "md": lambda rng, size: make_markdown(rng, size).encode("utf-8"),
+    "txt": lambda rng, size: make_text(rng, size).encode("utf-8"),
+    "json": lambda rng, size: make_json(rng, size).encode("utf-8"),
+    "pdf": make_pdf,
+}
+
+
+def generate_corpus(
+    n_docs: int = 20,
+    doc_size: int = 8_000,
+    kinds: Optional[List[str]] = None,
+    html_size: int = 20_000,
+    seed: int = 0,
+) -> Dict[str, Any]:
+    """Return {"documents": [{filename, content}], "html_document": {filename, content}}."""
+    rng = random.Random(seed)
+    kinds = kinds or ["md", "txt", "json", "pdf"]
+    documents = []
+    for i in range(n_docs):
+        ext = kinds[i % len(kinds)]
+        documents.append({"filename": f"doc_{i:04d}.{ext}", "content": GENERATORS[ext](rng, doc_size)})
+    html = {"filename": "checkout.html", "content": make_html(rng, html_size).encode("utf-8")}
+    return {"documents": documents, "html_document": html}
+
+
+def write_corpus(corpus: Dict[str, Any], out_dir: str):
+    os.makedirs(out_dir, exist_ok=True)
+    for doc in corpus["documents"] + [corpus["html_document"]]:
+        with open(os.path.join(out_dir, doc["filename"]), "wb") as f:
+            f.write(doc["content"])
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Write a synthetic benchmark corpus to disk")
+    ap.add_argument("out_dir")
+    ap.add_argument("--docs", type=int, default=20)
+    ap.add_argument("--doc-size", type=int, default=8_000)
+    ap.add_argument("--kinds", default="md,txt,json,pdf")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+    write_corpus(generate_corpus(args.docs, args.doc_size, args.kinds.split(","), seed=args.seed), args.out_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Local stand-in for the Ollama /api/generate endpoint.
+
+Streams newline-delimited JSON like Ollama, with a configurable delay before
+the first token (prompt evaluation) and a configurable token rate.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+import argparse
+import json
+import threading
+import time
+
+
+SAMPLE_TABLE = (
+    "| Test_ID | Feature | Test_Scenario | Expected_Result | Grounded_In |\n"
+    "|---------|---------|---------------|-----------------|-------------|\n"
+    "| TC-001 | Discount Code | Apply valid code SAVE15 | Total reduced by 15% | product_specs.md |\n"
+    "| TC-002 | Discount Code | Apply invalid code ABC | Error message shown | product_specs.md |\n"
+)
+SAMPLE_SCRIPT = (
+    "```python\n"
+    "from selenium import webdriver\n"
+    "from selenium.webdriver.common.by import By\n"
+    "driver = webdriver.Chrome()\n"
+    "driver.find_element(By.ID, \"discount_code\").send_keys(\"SAVE15\")\n"
+    "driver.find_element(By.ID, \"apply_coupon\").click()\n"
+    "driver.quit()\n"
+    "```\n"
+)
+
+
+class _QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients dropping keep-alive connections at exit is expected
+        pass
+
+
+class MockOllamaServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, first_token_latency: float = 0.2,
+                 tokens_per_s: float = 50.0, response_tokens: int = 120):
+        self.first_token_latency = first_token_latency
+        self.tokens_per_s = tokens_per_s
+        self.response_tokens = response_tokens
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                server.requests += 1
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                text = SAMPLE_SCRIPT if "Selenium" in (body.get("system") or "") else SAMPLE_TABLE
+                # Pad to the configured length with whitespace-separated tokens
+                tokens = text.split(" ")
+                while len(tokens) < server.response_tokens:
+                    tokens.append("\n")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                time.sleep(server.first_token_latency)
+                interval = 1.0 / server.tokens_per_s if server.tokens_per_s > 0 else 0.0
+                for i, tok in enumerate(tokens[: server.response_tokens]):
+                    piece = tok if i == 0 else " " + tok
+                    self._chunk({"model": body.get("model"), "response": piece, "done": False})
+                    if interval:
+                        time.sleep(interval)
+                self._chunk({"model": body.get("model"), "response": "", "done": True})
+                self.wfile.write(b"0\r\n\r\n")
+
+            def _chunk(self, obj):
+                data = (json.dumps(obj) + "\n").encode("utf-8")
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+        self.httpd = _QuietServer((host, port), Handler)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockOllamaServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Run a mock Ollama server")
+    ap.add_argument("--port", type=int, default=11435)
+    ap.add_argument("--first-token-latency", type=float, default=0.2)
+    ap.add_argument("--tokens-per-s", type=float, default=50.0)
+    ap.add_argument("--response-tokens", type=int, default=120)
+    args = ap.parse_args()
+    server = MockOllamaServer(port=args.port, first_token_latency=args.first_token_latency,
+                              tokens_per_s=args.tokens_per_s, response_tokens=args.response_tokens)
+    print(f"Mock Ollama listening on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+"""
+Reproducible benchmark runner.
+
+    python -m benchmarks.run --scenarios build,retrieve,generate,script,api --out bench.json
+    python -m benchmarks.run --baseline bench.json --max-regression 0.2
+
+Runs against a synthetic corpus in a temporary persist dir and a local mock
+Ollama server, and writes p50/p95/p99 latency, throughput and peak RSS as JSON.
+"""
+from typing import List, Dict, Any, Callable, Optional
+import argparse
+import asyncio
+import atexit
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from benchmarks.corpus import generate_corpus
+from benchmarks.mock_ollama import MockOllamaServer
+
+
+QUERIES = [
+    "Generate all positive and negative test cases for the discount code feature.",
+    "What happens when SAVE15 is applied?",
+    "Validation rules for the email field",
+    "express shipping cost",
+    "POST /apply_coupon request body",
+    "Pay Now button behaviour with an invalid form",
+    "discount_code input error message",
+    "payment methods available at checkout",
+]
+
+
+def peak_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def latency_stats(samples: List[float], wall_s: Optional[float] = None) -> Dict[str, Any]:
+    wall_s = wall_s if wall_s is not None else sum(samples)
+    return {
+        "n": len(samples),
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p95_ms": percentile(samples, 95) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+        "mean_ms": (statistics.fmean(samples) * 1000) if samples else 0.0,
+        "throughput_per_s": (len(samples) / wall_s) if wall_s else 0.0,
+    }
+
+
+def timed(fn: Callable, *args, **kwargs):
+    start = time.perf_counter()
+    out = fn(*args, **kwargs)
+    return time.perf_counter() - start, out
+
+
+def scenario_build(ctx: Dict[str, Any]) -> Dict[str, Any]:
+    from qa_agent.knowledge_base import KnowledgeBase
+
+    corpus = ctx["corpus"]
+    kb = KnowledgeBase(persist_dir=os.path.join(ctx["workdir"], "chroma_build"))
+    cold_s, cold = timed(kb.build, corpus["documents"], html_document=corpus["html_document"])
+    warm_s, _ = timed(kb.build, corpus["documents"], html_document=corpus["html_document"])
+    edited = [dict(d) for d in corpus["documents"]]
+    edited[0]["content"] = edited[0]["content"] + b"\nOne more line.\n"
+    incr_s, incr = timed(kb.build, edited, html_document=corpus["html_document"])
+    return {
+        "cold_s": cold_s,
+        "cold_chunks": cold["added"],
+        "cold_chunks_per_s": cold["added"] / cold_s if cold_s else 0.0,
+        "unchanged_rebuild_s": warm_s,
+        "one_doc_edit_s": incr_s,
+        "one_doc_edit_changed_chunks": incr["added"] + incr["updated"] + incr["deleted"],
+    }
+
+
+def _ready_kb(ctx: Dict[str, Any]):
+    from qa_agent.knowledge_base import KnowledgeBase
+
+    if "kb" not in ctx:
+        corpus = ctx["corpus"]
+        kb = KnowledgeBase(persist_dir=os.path.join(ctx["workdir"], "chroma"))
+        kb.build(corpus["documents"], html_document=corpus["html_document"])
+        ctx["kb"] = kb
+    return ctx["kb"]
+
+
+def scenario_retrieve(ctx: Dict[str, Any]) -> Dict[str, Any]:
+    kb = _ready_kb(ctx)
+    out = {}
+    for mode in ("vector", "lexical", "hybrid"):
+        samples = []
+        for _ in range(ctx["repeat"]):
+            for q in QUERIES:
+                dt, _ = timed(kb.retrieve, q, top_k=6, mode=mode)
+                samples.append(dt)
+        out[mode] = latency_stats(samples)
+    return out
+
+
+def _llm(ctx: Dict[str, Any]):
+    from qa_agent.llm import LLMProvider
+
+    return LLMProvider(ollama_url=ctx["ollama_url"], ollama_model="bench")
+
+
+def scenario_generate(ctx: Dict[str, Any]) -> Dict[str, Any]:
+    from qa_agent.agent import generate_test_cases
+
+    kb, llm = _ready_kb(ctx), _llm(ctx)
+    uncached = [timed(generate_test_cases, q, kb, llm, use_cache=False)[0] for q in QUERIES[: ctx["repeat"] * 2]]
+    for q in QUERIES:
+        generate_test_cases(q, kb, llm)
+    cached = [timed(generate_test_cases, q, kb, llm)[0] for q in QUERIES]
+    return {"uncached": latency_stats(uncached), "cached": latency_stats(cached)}
+
+
+def scenario_script(ctx: Dict[str, Any]) -> Dict[str, Any]:
+    from qa_agent.script_generator import generate_selenium_script, generate_selenium_scripts, scripts_report
+
+    kb, llm = _ready_kb(ctx), _llm(ctx)
+    html = kb.get_html() or ""
+    cases = [
+        {"Test_ID": f"TC-{i:03d}", "Feature": "Discount Code", "Test_Scenario": "Apply valid code SAVE15"}
+        for i in range(ctx["repeat"] * 4)
+    ]
+    single = [timed(generate_selenium_script, tc, html, kb, llm)[0] for tc in cases[: ctx["repeat"]]]
+    batch_s, results = timed(generate_selenium_scripts, cases, html, kb, llm, concurrency=ctx["concurrency"])
+    return {
+        "single": latency_stats(single),
+        "batch": {
+            "cases": len(results),
+            "wall_s": batch_s,
+            "throughput_per_s": len(results) / batch_s if batch_s else 0.0,
+            "per_case": latency_stats([r["elapsed_s"] for r in results], wall_s=batch_s),
+            "paths": scripts_report(results)["paths"],
+        },
+    }
+
+
+def scenario_api(ctx: Dict[str, Any]) -> Dict[str, Any]:
+    # backend.app keeps its KnowledgeBase under ./data relative to the working directory
+    api_dir = os.path.join(ctx["workdir"], "api")
+    os.makedirs(api_dir, exist_ok=True)
+    cwd = os.getcwd()
+    os.chdir(api_dir)
+    try:
+        return _run_api(ctx)
+    finally:
+        os.chdir(cwd)
+
+
+def _run_api(ctx: Dict[str, Any]) -> Dict[str, Any]:
+    import httpx
+    from backend.app import app
+
+    corpus = ctx["corpus"]
+    text_docs = [
+        {"filename": d["filename"], "content": d["content"].decode("utf-8", errors="ignore")}
+        for d in corpus["documents"] if not d["filename"].endswith(".pdf")
+    ]
+    html = corpus["html_document"]
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+            r = await client.post("/build_kb", json={
+                "documents": text_docs,
+                "html_document": {"filename": html["filename"], "content": html["content"].decode("utf-8")},
+            })
+            r.raise_for_status()
+
+            async def one(path: str, payload: Dict[str, Any]) -> float:
+                start = time.perf_counter()
+                resp = await client.post(path, json=payload)
+                resp.raise_for_status()
+                return time.perf_counter() - start
+
+            results = {}
+            for path, make in (
+                ("/generate_test_cases", lambda i: {"query": f"{QUERIES[i % len(QUERIES)]} #{i}"}),
+                ("/generate_selenium_script", lambda i: {"test_case": {"Test_ID": f"TC-{i}", "Test_Scenario": "Apply SAVE15"}}),
+            ):
+                n = ctx["concurrency"] * ctx["repeat"]
+                sem = asyncio.Semaphore(ctx["concurrency"])
+
+                async def bounded(i):
+                    async with sem:
+                        return await one(path, make(i))
+
+                start = time.perf_counter()
+                samples = await asyncio.gather(*(bounded(i) for i in range(n)))
+                results[path] = latency_stats(list(samples), wall_s=time.perf_counter() - start)
+            return results
+
+    return {"concurrency": ctx["concurrency"], **asyncio.run(run())}
+
+
+SCENARIOS = {
+    "build": scenario_build,
+    "retrieve": scenario_retrieve,
+    "generate": scenario_generate,
+    "script": scenario_script,
+    "api": scenario_api,
+}
+
+
+def _flatten(prefix: str, obj: Any, out: Dict[str, float]):
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            _flatten(f"{prefix}.{k}" if prefix else k, v, out)
+    elif isinstance(obj, (int, float)) and not isinstance(obj, bool):
+        out[prefix] = float(obj)
+
+
+# Lower is better for latencies and timings, higher is better for rates
+LATENCY_SUFFIXES = ("_ms", "wall_s", "cold_s", "unchanged_rebuild_s", "one_doc_edit_s")
+RATE_SUFFIX = "_per_s"
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], max_regression: float) -> List[str]:
+    """Return metrics that got worse than baseline by more than max_regression:
+    latencies (_ms, wall and build times) that grew, rates (_per_s) that fell."""
+    cur, base = {}, {}
+    _flatten("", current.get("scenarios", {}), cur)
+    _flatten("", baseline.get("scenarios", {}), base)
+    regressions = []
+    for key, value in cur.items():
+        old = base.get(key)
+        if not old:
+            continue
+        if key.endswith(RATE_SUFFIX):
+            if value < old * (1 - max_regression):
+                regressions.append(f"{key}: {old:.3f} -> {value:.3f} ({(value / old - 1) * 100:.0f}%)")
+        elif key.endswith(LATENCY_SUFFIXES):
+            if value > old * (1 + max_regression):
+                regressions.append(f"{key}: {old:.3f} -> {value:.3f} (+{(value / old - 1) * 100:.0f}%)")
+    return regressions
+
+
+def main():
+    ap = argparse.ArgumentParser(description="QA agent benchmark suite")
+    ap.add_argument("--scenarios", default=",".join(SCENARIOS))
+    ap.add_argument("--docs", type=int, default=40)
+    ap.add_argument("--doc-size", type=int, default=8_000)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--tokens-per-s", type=float, default=200.0)
+    ap.add_argument("--first-token-latency", type=float, default=0.05)
+    ap.add_argument("--response-tokens", type=int, default=120)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", default="-")
+    ap.add_argument("--baseline", default=None, help="previous JSON result to compare against")
+    ap.add_argument("--max-regression", type=float, default=0.2)
+    args = ap.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="qa-bench-")
+    # Registered first so it runs after the caches' own atexit flushes
+    atexit.register(shutil.rmtree, workdir, True)
+    # Keep caches inside the run so results are reproducible
+    os.environ["EMBEDDING_CACHE_DIR"] = os.path.join(workdir, "embedding_cache")
+    corpus = generate_corpus(args.docs, args.doc_size, seed=args.seed)
+    report: Dict[str, Any] = {
+        "config": vars(args),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "scenarios": {},
+    }
+    with MockOllamaServer(first_token_latency=args.first_token_latency, tokens_per_s=args.tokens_per_s,
+                          response_tokens=args.response_tokens) as ollama:
+        ctx = {
+            "workdir": workdir,
+            "corpus": corpus,
+            "repeat": args.repeat,
+            "concurrency": args.concurrency,
+            "ollama_url": ollama.url,
+        }
+        os.environ["OLLAMA_URL"] = ollama.url
+        for name in [s for s in args.scenarios.split(",") if s]:
+            start = time.perf_counter()
+            result = SCENARIOS[name](ctx)
+            result["scenario_wall_s"] = time.perf_counter() - start
+            result["peak_rss_mb"] = peak_rss_mb()
+            report["scenarios"][name] = result
+            print(f"[bench] {name} done in {result['scenario_wall_s']:.2f}s", file=sys.stderr)
+    report["peak_rss_mb"] = peak_rss_mb()
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.max_regression)
+        report["regressions"] = regressions
+        if regressions:
+            print("[bench] regressions:\n  " + "\n  ".join(regressions), file=sys.stderr)
+            exit_code = 1
+
+    payload = json.dumps(report, indent=2)
+    if args.out == "-":
+        print(payload)
+    else:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(payload)
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
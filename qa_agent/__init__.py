@@ -1,3 +1,17 @@
-from .knowledge_base import KnowledgeBase
-from .agent import generate_test_cases
-from .script_generator import generate_selenium_script
\ No newline at end of file
+# Heavy modules (chromadb, sentence-transformers) load on first attribute access
+_EXPORTS = {
+    "KnowledgeBase": ".knowledge_base",
+    "generate_test_cases": ".agent",
+    "generate_selenium_script": ".script_generator",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        from importlib import import_module
+        value = getattr(import_module(_EXPORTS[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,7 +1,18 @@
-from typing import List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Any, Iterator, Optional
+import hashlib
+import json
+import os
+import re
+import time
 
+import numpy as np
+
+from . import metrics
+from .context import pack_context
 from .knowledge_base import KnowledgeBase
-from .llm import LLMProvider
+from .llm import BULK, INTERACTIVE, LLMProvider
+from .response_cache import ResponseCache
 
 
 SYSTEM_PROMPT_TESTS = (
@@ -11,22 +22,408 @@ SYSTEM_PROMPT_TESTS = (
 )
 
 
-def _format_context(chunks: List[Dict[str, Any]]) -> str:
-    lines = []
-    for i, ch in enumerate(chunks):
-        meta = ch.get("metadata", {})
-        src = meta.get("source_document", "unknown")
-        lines.append(f"[Source: {src}] {ch['text']}")
-    return "\n\n".join(lines)
+SYSTEM_PROMPT_PLAN = (
+    "You are a QA Test Case generation agent. "
+    "Write test cases for a single feature, grounded strictly in the provided context. "
+    'Respond with a JSON array of objects with the keys "Test_ID", "Feature", "Test_Scenario", '
+    '"Expected_Result" and "Grounded_In" (the source documents).'
+)
+
+DEFAULT_INSTRUCTION = "Return comprehensive positive and negative test cases."
+
+
+# Hybrid retrieval recovers exact tokens (coupon codes, element IDs, API paths)
+# that vector search misses, so fewer chunks are needed per prompt; the
+# context packer then trims them to CONTEXT_TOKEN_BUDGET
+RETRIEVAL_TOP_K = 6
+RETRIEVAL_MODE = "hybrid"
+
+
+def _format_context(chunks: List[Dict[str, Any]], token_budget: Optional[int] = None) -> Dict[str, Any]:
+    # Merge overlapping windows, drop near-duplicates and stop at the token budget
+    return pack_context(chunks, token_budget=token_budget)
+
+
+def _parse_json_cases(text: str) -> Optional[List[Dict[str, Any]]]:
+    candidates = re.findall(r"```(?:json)?\s*(.*?)```", text, flags=re.S) or [text]
+    for cand in candidates:
+        start = min([i for i in (cand.find("["), cand.find("{")) if i >= 0], default=-1)
+        if start < 0:
+            continue
+        try:
+            obj, _ = json.JSONDecoder().raw_decode(cand[start:])
+        except ValueError:
+            continue
+        if isinstance(obj, dict):
+            # {"test_cases": [...]} or a single case
+            obj = next((v for v in obj.values() if isinstance(v, list)), [obj])
+        cases = [c for c in obj if isinstance(c, dict)]
+        if cases:
+            return cases
+    return None
+
+
+def _parse_markdown_cases(text: str) -> List[Dict[str, Any]]:
+    rows = [ln.strip() for ln in text.splitlines() if ln.strip().startswith("|")]
+    if len(rows) < 2:
+        return []
+    def cells(row: str) -> List[str]:
+        return [c.strip() for c in row.strip("|").split("|")]
+    header = cells(rows[0])
+    cases = []
+    for row in rows[1:]:
+        values = cells(row)
+        if all(set(v) <= set("-: ") for v in values):
+            continue
+        cases.append(dict(zip(header, values)))
+    return cases
+
+
+def parse_test_cases(text: str) -> List[Dict[str, Any]]:
+    """Extract structured test cases from an LLM reply (JSON or Markdown table)."""
+    return _parse_json_cases(text) or _parse_markdown_cases(text)
+
+
+def _relevant_elements(query: str, kb: KnowledgeBase) -> str:
+    # Looked up in the KB's selector index, never by re-parsing the HTML
+    index = kb.get_selector_index()
+    matches = index.search(query) if index is not None else []
+    if not matches:
+        return ""
+    described = "; ".join(
+        f"{e['css']} ({e['role']}{', ' + repr(e['label'] or e['text']) if (e['label'] or e['text']) else ''})"
+        for e in matches
+    )
+    return f"Relevant UI elements: {described}\n\n"
 
 
-def generate_test_cases(query: str, kb: KnowledgeBase, llm: LLMProvider) -> str:
-    retrieved = kb.retrieve(query, top_k=8)
-    context = _format_context(retrieved)
-    prompt = (
-        f"User Request: {query}\n\n"
-        f"Context (strictly ground tests here, cite sources):\n{context}\n\n"
-        "Return comprehensive positive and negative test cases."
+def _prepare(
+    query: str,
+    kb: KnowledgeBase,
+    llm: LLMProvider,
+    instruction: str = DEFAULT_INSTRUCTION,
+    system: str = SYSTEM_PROMPT_TESTS,
+):
+    query_embedding = kb.embed_query(query)
+    retrieved = kb.retrieve(query, top_k=RETRIEVAL_TOP_K, query_embedding=query_embedding, mode=RETRIEVAL_MODE)
+    namespace = ResponseCache.namespace(
+        kb.version, llm.ollama_model, system, [ch["id"] for ch in retrieved]
     )
-    out = llm.generate(prompt, system=SYSTEM_PROMPT_TESTS)
-    return out
\ No newline at end of file
+    with metrics.span("prompt"):
+        context = _format_context(retrieved)
+        elements = _relevant_elements(query, kb)
+        prompt = (
+            f"User Request: {query}\n\n"
+            f"Context (strictly ground tests here, cite sources):\n{context['text']}\n\n"
+            f"{elements}"
+            f"{instruction}"
+        )
+    return query_embedding, namespace, prompt, context["tokens"], retrieved
+
+
+def _generate(
+    query: str,
+    kb: KnowledgeBase,
+    llm: LLMProvider,
+    use_cache: bool = True,
+    instruction: str = DEFAULT_INSTRUCTION,
+    system: str = SYSTEM_PROMPT_TESTS,
+    priority: str = INTERACTIVE,
+) -> Dict[str, Any]:
+    query_embedding, namespace, prompt, _, retrieved = _prepare(query, kb, llm, instruction=instruction, system=system)
+    if use_cache:
+        cached = kb.response_cache.get(query, query_embedding, namespace)
+        if cached is not None:
+            return {"text": cached, "cached": True, "retrieved": retrieved}
+    out = llm.generate(prompt, system=system, priority=priority)
+    # Template fallbacks are never cached so a recovered LLM is used next time
+    if use_cache and not llm.is_fallback(out):
+        kb.response_cache.put(query, query_embedding, namespace, out, kb.version)
+    return {"text": out, "cached": False, "retrieved": retrieved}
+
+
+def generate_test_cases(query: str, kb: KnowledgeBase, llm: LLMProvider, use_cache: bool = True) -> str:
+    return _generate(query, kb, llm, use_cache=use_cache)["text"]
+
+
+def stream_test_cases(query: str, kb: KnowledgeBase, llm: LLMProvider, use_cache: bool = True) -> Iterator[Dict[str, Any]]:
+    """
+    Yield {"type": "token", "text"} events as the LLM produces them, then one
+    {"type": "result", "data", "test_cases", "cached", "context_tokens"} event
+    with the parsed plan.
+    """
+    query_embedding, namespace, prompt, context_tokens, _ = _prepare(query, kb, llm)
+    if use_cache:
+        cached = kb.response_cache.get(query, query_embedding, namespace)
+        if cached is not None:
+            yield {"type": "token", "text": cached}
+            yield {"type": "result", "data": cached, "test_cases": parse_test_cases(cached), "cached": True, "context_tokens": context_tokens}
+            return
+    parts: List[str] = []
+    for tok in llm.generate_stream(prompt, system=SYSTEM_PROMPT_TESTS):
+        parts.append(tok)
+        yield {"type": "token", "text": tok}
+    out = "".join(parts)
+    if use_cache and out and not llm.is_fallback(out):
+        kb.response_cache.put(query, query_embedding, namespace, out, kb.version)
+    yield {"type": "result", "data": out, "test_cases": parse_test_cases(out), "cached": False, "context_tokens": context_tokens}
+
+
+# --- Planner: one sub-query per feature, generated concurrently and merged into one plan
+
+PLAN_COLUMNS = ["Test_ID", "Feature", "Test_Scenario", "Expected_Result", "Grounded_In"]
+
+_CASE_KEYS = {
+    "testid": "Test_ID",
+    "id": "Test_ID",
+    "feature": "Feature",
+    "testscenario": "Test_Scenario",
+    "scenario": "Test_Scenario",
+    "expectedresult": "Expected_Result",
+    "expected": "Expected_Result",
+    "groundedin": "Grounded_In",
+    "source": "Grounded_In",
+    "sources": "Grounded_In",
+}
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def _words(text: str) -> List[str]:
+    # Crude plural folding so "Discount Codes" matches "discount code"
+    return [w[:-1] if len(w) > 3 and w.endswith("s") else w for w in _WORD_RE.findall(text.lower())]
+
+
+# Words that say what to produce rather than which feature it is about
+_REQUEST_WORDS = {
+    "a", "an", "the", "all", "any", "every", "each", "for", "of", "and", "or", "to", "on", "in", "with",
+    "test", "case", "plan", "scenario", "write", "generate", "create", "cover", "coverage", "feature",
+    "positive", "negative", "edge", "page", "please", "rule", "behaviour", "behavior", "check", "flow",
+    "whole", "entire", "full", "complete", "everything",
+}
+
+
+def _topic(query: str) -> List[str]:
+    return [w for w in _words(query) if w not in _REQUEST_WORDS]
+
+
+def _name_overlap(topic: List[str], names: List[str]) -> List[float]:
+    """Share of each feature name's words that the request topic uses."""
+    return [len(set(topic) & set(_words(n))) / max(1, len(set(_words(n)))) for n in names]
+
+
+def _similarity(topic: List[str], names: List[str], kb: KnowledgeBase) -> List[float]:
+    """Cosine similarity of the request topic to each feature name, with the KB's embedder."""
+    vectors = np.asarray(kb.store.embed([" ".join(topic)] + names), dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    return [float(v) for v in vectors[1:] @ vectors[0]]
+
+
+def plan_features(query: str, kb: KnowledgeBase, max_features: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Features of the KB, one per leaf section heading: [{"feature", "sources"}].
+
+    Headings that only title other headings (a document's H1) are skipped and
+    equal names across documents are merged. A request about the whole KB
+    (no words beyond filler and document titles, e.g. "all tests for
+    checkout") keeps every feature. One that names at most half of the
+    features keeps only those; otherwise features whose embedding
+    similarity to the request is more than PLANNER_RELEVANCE_DROP (default
+    0.25) below the best match are dropped. Survivors are
+    ranked by relevance, then document order, and capped at max_features
+    (PLANNER_MAX_FEATURES, default 12).
+    """
+    max_features = max_features or int(os.getenv("PLANNER_MAX_FEATURES", "12"))
+    features: Dict[str, Dict[str, Any]] = {}
+    titles = set()
+    for doc in kb.outline():
+        headings = doc["headings"]
+        if headings:
+            # A document's first heading names the document (its H1)
+            titles.update(_words(headings[0].split(" > ")[0]))
+        for heading in headings:
+            if any(other.startswith(heading + " > ") for other in headings):
+                continue
+            name = heading.split(" > ")[-1].strip()
+            key = " ".join(_words(name)) or name.lower()
+            feature = features.setdefault(key, {"feature": name, "sources": []})
+            if doc["source_document"] not in feature["sources"]:
+                feature["sources"].append(doc["source_document"])
+    if not features:
+        return []
+    candidates = list(features.values())
+    names = [f["feature"] for f in candidates]
+    # Words of a document title ("checkout" in "E-Shop Checkout") scope the whole KB
+    topic = [w for w in _topic(query) if w not in titles]
+    scores = _name_overlap(topic, names)
+    matched = sum(1 for score in scores if score > 0)
+    if not topic:
+        # Nothing but "all tests for checkout": every feature is in scope
+        cutoff = float("-inf")
+    elif 0 < matched <= len(names) // 2:
+        # The request names a few features: keep just those
+        cutoff = 1e-9
+    else:
+        scores = _similarity(topic, names, kb)
+        cutoff = max(scores) - float(os.getenv("PLANNER_RELEVANCE_DROP", "0.25"))
+    # Stable sort: equal scores keep document order
+    ranked = sorted(zip(scores, candidates), key=lambda pair: -pair[0])
+    return [f for score, f in ranked if score >= cutoff][:max_features]
+
+
+def _citation(chunk: Dict[str, Any]) -> Dict[str, Any]:
+    meta = chunk.get("metadata") or {}
+    citation = {"source_document": meta.get("source_document", "unknown")}
+    for key in ("heading", "page", "path"):
+        if meta.get(key):
+            citation[key] = meta[key]
+    return citation
+
+
+def _normalize_case(case: Dict[str, Any]) -> Dict[str, Any]:
+    out: Dict[str, Any] = {}
+    for key, value in case.items():
+        column = _CASE_KEYS.get(re.sub(r"[^a-z]", "", str(key).lower()), key)
+        if isinstance(value, list):
+            value = ", ".join(str(v) for v in value)
+        out.setdefault(column, value)
+    return out
+
+
+def _case_key(case: Dict[str, Any]) -> str:
+    key = " ".join(_words(f"{case.get('Test_Scenario', '')} {case.get('Expected_Result', '')}"))
+    # Rows without a scenario or expected result are keyed on everything they have
+    return key or " ".join(_words(" ".join(f"{k} {v}" for k, v in sorted(case.items()))))
+
+
+def _stable_test_id(feature: str, case_key: str) -> str:
+    # Derived from content, not position: the same case keeps its id across runs and completion orders
+    slug = "-".join(_WORD_RE.findall(feature.lower())).upper()[:24].strip("-") or "GENERAL"
+    digest = hashlib.sha1(f"{feature.lower()}\0{case_key}".encode("utf-8")).hexdigest()[:6].upper()
+    return f"TC-{slug}-{digest}"
+
+
+def _plan_feature(request: str, feature: Dict[str, Any], kb: KnowledgeBase, llm: LLMProvider, use_cache: bool) -> Dict[str, Any]:
+    started = time.perf_counter()
+    name = feature["feature"]
+    sub_query = f"{name}: {request}"
+    result: Dict[str, Any] = {
+        "feature": name,
+        "sub_query": sub_query,
+        "status": "ok",
+        "cached": False,
+        "cases": [],
+        "citations": [],
+        "error": None,
+    }
+    try:
+        with metrics.span("plan_feature"):
+            out = _generate(
+                sub_query, kb, llm, use_cache=use_cache, system=SYSTEM_PROMPT_PLAN, priority=BULK,
+                instruction=f'Return positive and negative test cases for the "{name}" feature only, as a JSON array.',
+            )
+        result["cached"] = out["cached"]
+        result["citations"] = list({json.dumps(c, sort_keys=True): c for c in map(_citation, out["retrieved"])}.values())
+        if llm.is_fallback(out["text"]):
+            # The template is not about this feature; report it instead of merging it
+            result["status"] = "fallback"
+        else:
+            result["cases"] = [_normalize_case(c) for c in parse_test_cases(out["text"])]
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = str(e)
+    result["elapsed_s"] = time.perf_counter() - started
+    return result
+
+
+def merge_test_plan(request: str, results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    One plan from per-feature results (in feature order): cases repeated across
+    features are dropped, every case gets a content-derived Test_ID, its
+    Feature, Grounded_In and the retrieved chunks it cites.
+    """
+    seen = set()
+    cases = []
+    duplicates = 0
+    for result in results:
+        for case in result["cases"]:
+            key = _case_key(case)
+            if key and key in seen:
+                duplicates += 1
+                continue
+            seen.add(key)
+            grounded = str(case.get("Grounded_In") or "")
+            cited = [c for c in result["citations"] if c["source_document"].lower() in grounded.lower()]
+            citations = cited or result["citations"]
+            merged = {
+                **case,
+                "Test_ID": _stable_test_id(result["feature"], key),
+                "Feature": case.get("Feature") or result["feature"],
+                "Grounded_In": grounded or ", ".join(dict.fromkeys(c["source_document"] for c in citations)),
+                "Citations": citations,
+            }
+            cases.append({**{col: merged.get(col, "") for col in PLAN_COLUMNS}, **merged})
+    return {
+        "request": request,
+        "features": [{**r, "cases": len(r["cases"])} for r in results],
+        "test_cases": cases,
+        "duplicates_removed": duplicates,
+    }
+
+
+def iter_test_plan(
+    request: str,
+    kb: KnowledgeBase,
+    llm: LLMProvider,
+    concurrency: Optional[int] = None,
+    max_features: Optional[int] = None,
+    use_cache: bool = True,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Planner mode: fan the request out into one retrieval + generation per KB
+    feature with at most ``concurrency`` (PLANNER_CONCURRENCY, default 4) in
+    flight. Yields a {"type": "feature", ...} event as each feature finishes,
+    then {"type": "result", "plan"} with the merged plan.
+    """
+    started = time.perf_counter()
+    concurrency = max(1, concurrency or int(os.getenv("PLANNER_CONCURRENCY", "4")))
+    features = plan_features(request, kb, max_features=max_features)
+    if not features:
+        # No headings to split on: plan the request as a single feature
+        features = [{"feature": request, "sources": []}]
+    results: List[Optional[Dict[str, Any]]] = [None] * len(features)
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="plan") as pool:
+        futures = {pool.submit(_plan_feature, request, f, kb, llm, use_cache): i for i, f in enumerate(features)}
+        for fut in as_completed(futures):
+            result = fut.result()
+            results[futures[fut]] = result
+            yield {"type": "feature", **result, "cases": len(result["cases"])}
+    plan = merge_test_plan(request, results)
+    plan["elapsed_s"] = time.perf_counter() - started
+    metrics.record_stage("plan", plan["elapsed_s"])
+    yield {"type": "result", "plan": plan}
+
+
+def generate_test_plan(
+    request: str,
+    kb: KnowledgeBase,
+    llm: LLMProvider,
+    concurrency: Optional[int] = None,
+    max_features: Optional[int] = None,
+    use_cache: bool = True,
+) -> Dict[str, Any]:
+    plan: Dict[str, Any] = {}
+    for event in iter_test_plan(request, kb, llm, concurrency=concurrency, max_features=max_features, use_cache=use_cache):
+        if event["type"] == "result":
+            plan = event["plan"]
+    return plan
+
+
+def plan_to_markdown(plan: Dict[str, Any]) -> str:
+    rows = [
+        "| " + " | ".join(PLAN_COLUMNS) + " |",
+        "|" + "|".join("---" for _ in PLAN_COLUMNS) + "|",
+    ]
+    for case in plan.get("test_cases", []):
+        rows.append("| " + " | ".join(str(case.get(col, "")).replace("|", "\\|").replace("\n", " ") for col in PLAN_COLUMNS) + " |")
+    return "\n".join(rows)
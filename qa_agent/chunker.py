@@ -0,0 +1,202 @@
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
+import itertools
+import os
+import re
+
+from .parser import JsonPath, json_path
+from .tokens import count_tokens, truncate_to_tokens
+
+
+_MD_HEADING_RE = re.compile(r"^(#{1,6})\s+(.*\S)\s*$")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+# A unit is the smallest structural piece (paragraph, JSON key path, HTML block)
+Unit = Tuple[str, Dict[str, Any]]
+
+
+def default_chunk_tokens() -> int:
+    # all-MiniLM-L6-v2 truncates input beyond 256 word pieces
+    return int(os.getenv("CHUNK_MAX_TOKENS", "200"))
+
+
+def _markdown_units(lines: Iterable[str]) -> Iterator[Unit]:
+    trail: List[Tuple[int, str]] = []
+    para: List[str] = []
+
+    def meta():
+        return {"heading": " > ".join(h for _, h in trail)} if trail else {}
+
+    for line in lines:
+        m = _MD_HEADING_RE.match(line)
+        if m:
+            if para:
+                yield "\n".join(para), meta()
+                para = []
+            level = len(m.group(1))
+            trail = [(lvl, h) for lvl, h in trail if lvl < level] + [(level, m.group(2))]
+            # Heading lines are kept with the section they open
+            para.append(line)
+            continue
+        if not line.strip():
+            if para and not _MD_HEADING_RE.match(para[-1]):
+                yield "\n".join(para), meta()
+                para = []
+            continue
+        para.append(line)
+    if para:
+        yield "\n".join(para), meta()
+
+
+def _json_units(entries: Iterable[Tuple[JsonPath, Any]]) -> Iterator[Unit]:
+    # parse_document flattens JSON to (path segments, value) pairs; keys may hold "/" or ": "
+    for segments, value in entries:
+        if not segments:
+            # Top-level scalar, or raw text of a file that turned out not to be JSON
+            if str(value).strip():
+                yield str(value), {}
+            continue
+        yield f"{json_path(segments)}: {value}", {"segments": segments}
+
+
+def _html_units(blocks: List[Dict[str, Any]]) -> Iterator[Unit]:
+    for b in blocks:
+        yield b["text"], ({"heading": b["heading"]} if b.get("heading") else {})
+
+
+def _page_units(pages: Iterable[str], first_page: int = 1) -> Iterator[Unit]:
+    for number, page in enumerate(pages, start=first_page):
+        for para in re.split(r"\n\s*\n", page):
+            if para.strip():
+                yield para.strip(), {"page": number}
+
+
+def _plain_units(lines: Iterable[str]) -> Iterator[Unit]:
+    para: List[str] = []
+    for line in lines:
+        if line.strip():
+            para.append(line)
+        elif para:
+            yield "\n".join(para).strip(), {}
+            para = []
+    if para:
+        yield "\n".join(para).strip(), {}
+
+
+def _split_oversized(text: str, max_tokens: int) -> Iterator[str]:
+    """Split one unit that exceeds the budget at sentence, then word boundaries."""
+    current = ""
+    for sentence in _SENTENCE_RE.split(text):
+        while count_tokens(sentence) > max_tokens:
+            head = truncate_to_tokens(sentence, max_tokens)
+            if not head:
+                # A single token-dense word; hard cut it
+                head = sentence[: max_tokens * 4]
+            if current:
+                yield current
+                current = ""
+            yield head
+            sentence = sentence[len(head):].lstrip()
+        candidate = f"{current} {sentence}".strip() if current else sentence
+        if current and count_tokens(candidate) > max_tokens:
+            yield current
+            current = sentence
+        else:
+            current = candidate
+    if current:
+        yield current
+
+
+def _common_segments(paths: List[JsonPath]) -> JsonPath:
+    common = paths[0]
+    for p in paths[1:]:
+        n = 0
+        while n < min(len(common), len(p)) and common[n] == p[n]:
+            n += 1
+        common = common[:n]
+    return common
+
+
+def _chunk_meta(metas: List[Dict[str, Any]]) -> Dict[str, Any]:
+    meta: Dict[str, Any] = {}
+    headings = [m["heading"] for m in metas if m.get("heading")]
+    if headings:
+        meta["heading"] = headings[0]
+        distinct = list(dict.fromkeys(headings))
+        if len(distinct) > 1:
+            meta["headings"] = " | ".join(distinct)
+    paths = [m["segments"] for m in metas if m.get("segments")]
+    if paths:
+        meta["path"] = json_path(_common_segments(paths))
+    pages = [m["page"] for m in metas if m.get("page")]
+    if pages:
+        meta["page"] = pages[0]
+    return meta
+
+
+def _units(parsed: Dict[str, Any]) -> Iterator[Unit]:
+    ext = parsed.get("ext", "")
+    if parsed.get("pages") is not None:
+        return _page_units(parsed["pages"], parsed.get("first_page", 1))
+    if parsed.get("blocks"):
+        return _html_units(parsed["blocks"])
+    if parsed.get("entries") is not None:
+        return _json_units(parsed["entries"])
+    # Streamed documents carry a lazy "lines" iterator instead of "text"
+    lines = parsed.get("lines")
+    if lines is None:
+        lines = parsed.get("text", "").splitlines()
+    lines = iter(lines)
+    first = next(lines, None)
+    if first is None:
+        return iter(())
+    lines = itertools.chain([first], lines)
+    if ext == "md" or _MD_HEADING_RE.search(first):
+        return _markdown_units(lines)
+    return _plain_units(lines)
+
+
+def iter_chunks(parsed: Dict[str, Any], max_tokens: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Lazily yield structure-aware chunks {"text", "metadata"} for a parsed document.
+
+    Whole units (Markdown sections/paragraphs, flattened JSON key paths, HTML
+    blocks, PDF paragraphs) are packed greedily up to max_tokens; a chunk never
+    spans two PDF pages or two top-level JSON keys, and only oversized units
+    are split (at sentence, then word boundaries). Metadata carries the
+    heading trail, JSON path or page number.
+    """
+    max_tokens = max_tokens or default_chunk_tokens()
+    buf: List[str] = []
+    metas: List[Dict[str, Any]] = []
+    used = 0
+
+    def emit():
+        return {"text": "\n".join(buf), "metadata": _chunk_meta(metas)}
+
+    def boundary(meta: Dict[str, Any]) -> bool:
+        if not metas:
+            return False
+        last = metas[-1]
+        if "page" in meta and meta.get("page") != last.get("page"):
+            return True
+        if "segments" in meta:
+            return meta["segments"][:1] != last.get("segments", ())[:1]
+        return False
+
+    for text, meta in _units(parsed):
+        cost = count_tokens(text)
+        if cost > max_tokens:
+            if buf:
+                yield emit()
+                buf, metas, used = [], [], 0
+            for piece in _split_oversized(text, max_tokens):
+                yield {"text": piece, "metadata": _chunk_meta([meta])}
+            continue
+        if buf and (used + cost > max_tokens or boundary(meta)):
+            yield emit()
+            buf, metas, used = [], [], 0
+        buf.append(text)
+        metas.append(meta)
+        used += cost
+    if buf:
+        yield emit()
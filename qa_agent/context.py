@@ -0,0 +1,119 @@
+from typing import List, Dict, Any, Optional
+import os
+
+from .tokens import count_tokens, truncate_to_tokens
+
+
+def _shingles(text: str, n: int = 3) -> set:
+    words = text.lower().split()
+    if len(words) < n:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + n]) for i in range(len(words) - n + 1)}
+
+
+def _containment(a: set, b: set) -> float:
+    # Overlap coefficient: also catches a chunk fully contained in a merged run
+    if not a or not b:
+        return 0.0
+    return len(a & b) / min(len(a), len(b))
+
+
+def _merge_overlap(left: str, right: str, max_overlap: int = 400) -> str:
+    """Join two consecutive windows, dropping the longest suffix/prefix overlap."""
+    limit = min(len(left), len(right), max_overlap)
+    for size in range(limit, 0, -1):
+        if left.endswith(right[:size]):
+            return left + right[size:]
+    return left + "\n" + right
+
+
+def _merge_runs(chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Merge chunks from the same document whose chunk_index values are consecutive."""
+    by_source: Dict[str, List[Dict[str, Any]]] = {}
+    for rank, ch in enumerate(chunks):
+        meta = ch.get("metadata", {})
+        src = meta.get("source_document", "unknown")
+        by_source.setdefault(src, []).append({
+            "source": src,
+            "index": int(meta.get("chunk_index", 0)),
+            "rank": rank,
+            "text": ch["text"],
+        })
+    segments = []
+    for src, items in by_source.items():
+        items.sort(key=lambda it: it["index"])
+        current = None
+        for it in items:
+            if current is not None and it["index"] == current["last"] + 1:
+                current["text"] = _merge_overlap(current["text"], it["text"])
+                current["last"] = it["index"]
+                current["rank"] = min(current["rank"], it["rank"])
+                continue
+            if current is not None and it["index"] == current["last"]:
+                continue
+            current = {"source": src, "first": it["index"], "last": it["index"], "rank": it["rank"], "text": it["text"]}
+            segments.append(current)
+    return segments
+
+
+def _citation(seg: Dict[str, Any]) -> str:
+    if seg["first"] == seg["last"]:
+        return f"[Source: {seg['source']}, chunk {seg['first']}]"
+    return f"[Source: {seg['source']}, chunks {seg['first']}-{seg['last']}]"
+
+
+def pack_context(
+    chunks: List[Dict[str, Any]],
+    token_budget: Optional[int] = None,
+    dedup_threshold: float = 0.85,
+    min_partial_tokens: int = 48,
+) -> Dict[str, Any]:
+    """
+    Pack retrieved chunks (in relevance order) into a prompt context that fits
+    token_budget: consecutive chunks of one document are merged with their
+    overlap removed, near-duplicate segments are dropped, and segments are
+    added by relevance until the budget is full (the last one truncated).
+
+    Returns {"text", "tokens", "segments", "dropped_duplicates", "truncated"}.
+    """
+    if token_budget is None:
+        token_budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+    segments = sorted(_merge_runs(chunks), key=lambda s: s["rank"])
+
+    kept: List[Dict[str, Any]] = []
+    kept_shingles: List[set] = []
+    dropped = 0
+    for seg in segments:
+        sh = _shingles(seg["text"])
+        if any(_containment(sh, other) >= dedup_threshold for other in kept_shingles):
+            dropped += 1
+            continue
+        kept.append(seg)
+        kept_shingles.append(sh)
+
+    parts: List[str] = []
+    used = 0
+    truncated = False
+    separator_cost = count_tokens("\n\n")
+    for seg in kept:
+        block = f"{_citation(seg)} {seg['text']}"
+        cost = count_tokens(block) + (separator_cost if parts else 0)
+        if used + cost <= token_budget:
+            parts.append(block)
+            used += cost
+            continue
+        remaining = token_budget - used - (separator_cost if parts else 0)
+        if remaining >= min_partial_tokens:
+            block = truncate_to_tokens(block, remaining)
+            parts.append(block)
+            used += count_tokens(block) + (separator_cost if len(parts) > 1 else 0)
+            truncated = True
+        break
+
+    return {
+        "text": "\n\n".join(parts),
+        "tokens": used,
+        "segments": len(parts),
+        "dropped_duplicates": dropped,
+        "truncated": truncated,
+    }
@@ -0,0 +1,333 @@
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+from .tokens import count_tokens
+
+
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+BASELINE_BACKEND = "sentence-transformers"
+
+
+def _slug(name: str) -> str:
+    return "".join(ch if ch.isalnum() else "_" for ch in name)
+
+
+def _unit(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+class Embedder:
+    """
+    Texts -> float32 vectors, callable like a Chroma embedding function.
+
+    The model loads on first use. Inputs are sorted by length and cut into
+    batches of at most batch_size texts and max_batch_tokens padded tokens, so
+    short chunks are not padded out to the longest one in a large batch.
+    """
+
+    backend = ""
+
+    def __init__(
+        self,
+        model_name: str = EMBEDDING_MODEL,
+        batch_size: Optional[int] = None,
+        max_batch_tokens: Optional[int] = None,
+        threads: Optional[int] = None,
+    ):
+        self.model_name = model_name
+        self.batch_size = batch_size or int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+        self.max_batch_tokens = max_batch_tokens or int(os.getenv("EMBEDDING_MAX_BATCH_TOKENS", "8192"))
+        # 0 keeps the runtime's default (all cores)
+        self.threads = threads if threads is not None else int(os.getenv("EMBEDDING_THREADS", "0"))
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def id(self) -> str:
+        """Identifies the vector space; stored with collections and used to key the embedding cache."""
+        return self.model_name if self.backend == BASELINE_BACKEND else f"{self.model_name}:{self.backend}"
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    def load(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = self._load()
+        return self._model
+
+    def _load(self):
+        raise NotImplementedError
+
+    def _tokenize(self, model, texts: List[str]) -> Tuple[List[Any], List[int]]:
+        """Model inputs per text and their lengths in tokens (estimated unless overridden)."""
+        return texts, [count_tokens(t) for t in texts]
+
+    def _encode(self, model, batch: List[Any]) -> np.ndarray:
+        raise NotImplementedError
+
+    def batches(self, lengths: Sequence[int]) -> Iterator[List[int]]:
+        order = sorted(range(len(lengths)), key=lengths.__getitem__)
+        batch: List[int] = []
+        for i in order:
+            # Sorted ascending, so the newest item sets the padded width
+            width = max(lengths[i], 1)
+            if batch and (len(batch) >= self.batch_size or width * (len(batch) + 1) > self.max_batch_tokens):
+                yield batch
+                batch = []
+            batch.append(i)
+        if batch:
+            yield batch
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        texts = list(texts)
+        # Before load(): nothing to encode is no reason to load the model
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        model = self.load()
+        items, lengths = self._tokenize(model, texts)
+        out: List[Optional[np.ndarray]] = [None] * len(texts)
+        for batch in self.batches(lengths):
+            vectors = self._encode(model, [items[i] for i in batch])
+            for i, v in zip(batch, vectors):
+                out[i] = np.asarray(v, dtype=np.float32)
+        return np.vstack(out)
+
+    def __call__(self, input: List[str]) -> List[np.ndarray]:
+        return list(self.embed(input))
+
+
+class SentenceTransformerEmbedder(Embedder):
+    """The baseline: sentence-transformers on PyTorch, full precision."""
+
+    backend = BASELINE_BACKEND
+
+    def _load(self):
+        from sentence_transformers import SentenceTransformer
+
+        if self.threads:
+            import torch
+            torch.set_num_threads(self.threads)
+        return SentenceTransformer(self.model_name, device="cpu")
+
+    def _encode(self, model, batch: List[str]) -> np.ndarray:
+        return model.encode(batch, batch_size=len(batch), convert_to_numpy=True, show_progress_bar=False)
+
+
+def export_onnx(model_name: str, model_dir: str, opset: int = 14):
+    """
+    Export a sentence-transformers model's transformer to model_dir/model.onnx,
+    with its tokenizer and pooling settings. Needs torch, once per model.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    st = SentenceTransformer(model_name, device="cpu")
+    transformer = st[0]
+    pooling = next((m for m in st if type(m).__name__ == "Pooling"), None)
+    os.makedirs(model_dir, exist_ok=True)
+    transformer.tokenizer.save_pretrained(model_dir)
+    sample = transformer.tokenizer(["warm-up"], return_tensors="pt")
+    names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in sample]
+    path = os.path.join(model_dir, "model.onnx")
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer.auto_model.eval(),
+            tuple(sample[n] for n in names),
+            tmp,
+            input_names=names,
+            output_names=["last_hidden_state"],
+            dynamic_axes={n: {0: "batch", 1: "sequence"} for n in names + ["last_hidden_state"]},
+            opset_version=opset,
+        )
+    with open(os.path.join(model_dir, "embedder.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "model": model_name,
+            "pooling": "cls" if pooling is not None and pooling.pooling_mode_cls_token else "mean",
+            "normalize": any(type(m).__name__ == "Normalize" for m in st),
+            "max_length": st.max_seq_length,
+        }, f)
+    os.replace(tmp, path)
+
+
+def quantize_onnx(source: str, target: str):
+    """Dynamic int8 quantization of the weights; activations stay float."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    tmp = f"{target}.{os.getpid()}.tmp.onnx"
+    quantize_dynamic(source, tmp, weight_type=QuantType.QInt8)
+    os.replace(tmp, target)
+
+
+class OnnxEmbedder(Embedder):
+    """
+    The same model exported to ONNX and run with ONNX Runtime on CPU.
+
+    Models are exported on first use into EMBEDDING_ONNX_DIR (default
+    data/onnx); a directory with model.onnx, tokenizer.json and
+    embedder.json can also be provided ahead of time, then only
+    onnxruntime and tokenizers are needed at runtime.
+    """
+
+    backend = "onnx"
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL, model_dir: Optional[str] = None, **kwargs):
+        super().__init__(model_name, **kwargs)
+        self.model_dir = model_dir or os.path.join(os.getenv("EMBEDDING_ONNX_DIR", "data/onnx"), _slug(model_name))
+
+    def _model_path(self) -> str:
+        path = os.path.join(self.model_dir, "model.onnx")
+        if not os.path.exists(path):
+            export_onnx(self.model_name, self.model_dir)
+        return path
+
+    def _load(self):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        path = self._model_path()
+        with open(os.path.join(self.model_dir, "embedder.json"), "r", encoding="utf-8") as f:
+            config = json.load(f)
+        tokenizer = Tokenizer.from_file(os.path.join(self.model_dir, "tokenizer.json"))
+        tokenizer.enable_truncation(int(config.get("max_length", 256)))
+        tokenizer.no_padding()
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.threads:
+            options.intra_op_num_threads = self.threads
+            options.inter_op_num_threads = 1
+        session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        inputs = {i.name for i in session.get_inputs()}
+        return session, tokenizer, inputs, config
+
+    def _tokenize(self, model, texts: List[str]) -> Tuple[List[Any], List[int]]:
+        ids = [e.ids for e in model[1].encode_batch(texts)]
+        return ids, [len(i) for i in ids]
+
+    def _encode(self, model, batch: List[List[int]]) -> np.ndarray:
+        session, _, inputs, config = model
+        width = max(len(ids) for ids in batch)
+        input_ids = np.zeros((len(batch), width), dtype=np.int64)
+        mask = np.zeros((len(batch), width), dtype=np.int64)
+        for row, ids in enumerate(batch):
+            input_ids[row, :len(ids)] = ids
+            mask[row, :len(ids)] = 1
+        feeds = {"input_ids": input_ids, "attention_mask": mask, "token_type_ids": np.zeros_like(input_ids)}
+        hidden = session.run(None, {k: v for k, v in feeds.items() if k in inputs})[0]
+        if config.get("pooling") == "cls":
+            pooled = hidden[:, 0]
+        else:
+            weights = mask[..., None].astype(np.float32)
+            pooled = (hidden * weights).sum(axis=1) / np.maximum(weights.sum(axis=1), 1e-9)
+        return _unit(pooled) if config.get("normalize", True) else pooled.astype(np.float32)
+
+
+class QuantizedOnnxEmbedder(OnnxEmbedder):
+    """ONNX backend with int8 weights, quantized once from the float model."""
+
+    backend = "onnx-int8"
+
+    def _model_path(self) -> str:
+        path = os.path.join(self.model_dir, "model.int8.onnx")
+        if not os.path.exists(path):
+            quantize_onnx(super()._model_path(), path)
+        return path
+
+
+BACKENDS = {
+    SentenceTransformerEmbedder.backend: SentenceTransformerEmbedder,
+    OnnxEmbedder.backend: OnnxEmbedder,
+    QuantizedOnnxEmbedder.backend: QuantizedOnnxEmbedder,
+}
+
+
+def create_embedder(backend: Optional[str] = None, model_name: Optional[str] = None, **kwargs) -> Embedder:
+    """Embedder for EMBEDDING_BACKEND / EMBEDDING_MODEL unless given explicitly."""
+    backend = backend or os.getenv("EMBEDDING_BACKEND", BASELINE_BACKEND)
+    cls = BACKENDS.get(backend)
+    if cls is None:
+        raise ValueError(f"Unknown embedding backend {backend!r}; expected one of: {', '.join(BACKENDS)}")
+    return cls(model_name or os.getenv("EMBEDDING_MODEL", EMBEDDING_MODEL), **kwargs)
+
+
+def check_consistency(candidate: Embedder, baseline: Embedder, texts: List[str], queries: List[str], k: int = 5) -> Dict[str, Any]:
+    """
+    Recall@k of the candidate's nearest neighbours against the baseline's:
+    for each query, the share of the baseline's top-k texts the candidate also
+    ranks in its top k. Also reports encode throughput for both.
+    """
+    k = min(k, len(texts))
+    report: Dict[str, Any] = {"baseline": baseline.id, "candidate": candidate.id, "k": k, "documents": len(texts), "queries": len(queries)}
+    ranked = []
+    spaces = []
+    for label, embedder in (("baseline", baseline), ("candidate", candidate)):
+        embedder.load()
+        start = time.perf_counter()
+        docs = _unit(embedder.embed(texts))
+        elapsed = time.perf_counter() - start
+        report[f"{label}_texts_per_s"] = round(len(texts) / elapsed, 1) if elapsed else None
+        scores = _unit(embedder.embed(queries)) @ docs.T
+        ranked.append(np.argsort(-scores, axis=1)[:, :k])
+        spaces.append(docs)
+    overlap = [len(set(b) & set(c)) / k for b, c in zip(*ranked)] if k else []
+    report["recall_at_k"] = round(float(np.mean(overlap)), 4) if overlap else 1.0
+    if spaces[0].shape == spaces[1].shape:
+        report["mean_cosine"] = round(float(np.mean(np.sum(spaces[0] * spaces[1], axis=1))), 4)
+    return report
+
+
+def _docs_corpus(docs_dir: str) -> List[str]:
+    from .knowledge_base import _document_chunks
+    from .parser import parse_document
+
+    texts = []
+    for name in sorted(os.listdir(docs_dir)):
+        path = os.path.join(docs_dir, name)
+        if os.path.isfile(path):
+            texts.extend(ch["text"] for ch in _document_chunks(name, parse_document(name, path=path)))
+    return texts
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Check an embedding backend's retrieval against the baseline model.")
+    parser.add_argument("--backend", required=True, choices=list(BACKENDS))
+    parser.add_argument("--baseline", default=BASELINE_BACKEND, choices=list(BACKENDS))
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--docs", nargs="+", default=["docs", "assets"], help="directories whose documents are chunked as the corpus")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--max-queries", type=int, default=50)
+    parser.add_argument("--min-recall", type=float, default=0.9)
+    args = parser.parse_args(argv)
+
+    texts = [t for d in args.docs if os.path.isdir(d) for t in _docs_corpus(d)]
+    if not texts:
+        parser.error("no documents found")
+    # Queries: the opening words of evenly spaced chunks
+    step = max(1, len(texts) // args.max_queries)
+    queries = [" ".join(t.split()[:12]) for t in texts[::step][:args.max_queries]]
+    report = check_consistency(
+        create_embedder(args.backend, args.model),
+        create_embedder(args.baseline, args.model),
+        texts,
+        queries,
+        k=args.k,
+    )
+    report["passed"] = report["recall_at_k"] >= args.min_recall
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    return 0 if report["passed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
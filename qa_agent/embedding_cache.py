@@ -0,0 +1,286 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional
+import atexit
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+
+try:
+    from filelock import FileLock
+except ImportError:  # optional: without it each process keeps a private cache directory
+    FileLock = None
+
+from . import metrics
+
+
+_DIGEST_BYTES = 20  # sha1
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.split())
+
+
+def _slug(model_name: str) -> str:
+    return "".join(ch if ch.isalnum() else "_" for ch in model_name)
+
+
+class EmbeddingCache:
+    """
+    Disk-backed, size-bounded LRU cache of float32 embeddings, shareable by
+    processes pointed at the same directory.
+
+    ``vectors.f32`` holds one vector per slot and ``keys.bin`` the
+    sha1(model, normalized text) owning each slot (zeros when free), both
+    memory-mapped. Lookups and inserts run under the ``cache.lock`` file
+    lock after picking up slots other processes wrote (``seq`` counts
+    writes), and a vector is only returned while its slot is still owned by
+    the requested key. ``index.json`` keeps this process's LRU order.
+    """
+
+    def __init__(self, cache_dir: str, model_name: str, max_entries: int = 100_000, flush_every: int = 256):
+        self.model_name = model_name
+        self.dir = os.path.join(cache_dir, _slug(model_name))
+        if FileLock is None:
+            # Slots cannot be allocated safely across processes without a file lock
+            self.dir = os.path.join(self.dir, f"process-{os.getpid()}")
+            atexit.register(shutil.rmtree, self.dir, True)
+        self.max_entries = max_entries
+        self.flush_every = flush_every
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._file_lock = None
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._free: List[int] = []
+        self._dim: Optional[int] = None
+        self._capacity = 0
+        self._vectors: Optional[np.memmap] = None
+        self._owners: Optional[np.memmap] = None
+        self._seen_seq = -1
+        self._dirty = 0
+        os.makedirs(self.dir, exist_ok=True)
+        if FileLock is not None:
+            self._file_lock = FileLock(self._path("cache.lock"))
+        with self._locked():
+            self._seq = self._open_seq()
+            self._load()
+        atexit.register(self.flush)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.dir, name)
+
+    def key(self, text: str) -> str:
+        return hashlib.sha1(f"{self.model_name}\0{_normalize(text)}".encode("utf-8")).hexdigest()
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            if self._file_lock is None:
+                yield
+            else:
+                with self._file_lock:
+                    yield
+
+    def _open_seq(self) -> np.memmap:
+        with open(self._path("seq"), "ab") as f:
+            if f.tell() < 8:
+                f.truncate(8)
+        return np.memmap(self._path("seq"), dtype=np.int64, mode="r+", shape=(1,))
+
+    def _bump(self):
+        # Only called in sync, so the new value is everything this process has seen
+        self._seq[0] += 1
+        self._seen_seq = int(self._seq[0])
+
+    def _map(self) -> bool:
+        """Map the files at their current size; False while nothing is stored yet."""
+        if self._dim is None:
+            try:
+                with open(self._path("meta.json"), "r", encoding="utf-8") as f:
+                    self._dim = int(json.load(f)["dim"])
+            except (OSError, ValueError, KeyError):
+                return False
+        keys_path = self._path("keys.bin")
+        capacity = os.path.getsize(keys_path) // _DIGEST_BYTES if os.path.exists(keys_path) else 0
+        if not capacity:
+            return False
+        if capacity != self._capacity or self._owners is None:
+            self._release()
+            self._vectors = np.memmap(self._path("vectors.f32"), dtype=np.float32, mode="r+", shape=(capacity, self._dim))
+            self._owners = np.memmap(keys_path, dtype=np.uint8, mode="r+", shape=(capacity, _DIGEST_BYTES))
+            self._capacity = capacity
+        return True
+
+    def _release(self):
+        for m in (self._vectors, self._owners):
+            if m is not None:
+                m.flush()
+        self._vectors = self._owners = None
+
+    def _sync(self):
+        """Rebuild the slot map from keys.bin when another process has written since our last look."""
+        seq = int(self._seq[0])
+        if seq == self._seen_seq:
+            return
+        self._seen_seq = seq
+        if not self._map():
+            return
+        used = self._owners.any(axis=1)
+        on_disk = {self._owners[slot].tobytes().hex(): int(slot) for slot in np.flatnonzero(used)}
+        # Keep our LRU order for entries still owned as we remember; others' entries count as recent
+        index: "OrderedDict[str, int]" = OrderedDict()
+        for k, slot in self._index.items():
+            if on_disk.get(k) == slot:
+                index[k] = on_disk.pop(k)
+        index.update(on_disk)
+        self._index = index
+        self._free = np.flatnonzero(~used).tolist()
+
+    def _load(self):
+        self._sync()
+        try:
+            with open(self._path("index.json"), "r", encoding="utf-8") as f:
+                order = json.load(f).get("lru", [])
+        except (OSError, ValueError, AttributeError):
+            return
+        rank = {k: i for i, k in enumerate(order)}
+        self._index = OrderedDict(sorted(self._index.items(), key=lambda item: rank.get(item[0], -1)))
+
+    def _grow(self, dim: int):
+        if self._dim is None:
+            self._dim = dim
+            tmp = self._path("meta.json.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"model": self.model_name, "dim": dim}, f)
+            os.replace(tmp, self._path("meta.json"))
+        old_capacity = self._capacity
+        new_capacity = min(self.max_entries, max(1024, old_capacity * 2))
+        if new_capacity <= old_capacity:
+            return
+        self._release()
+        for name, row_bytes in (("vectors.f32", self._dim * 4), ("keys.bin", _DIGEST_BYTES)):
+            with open(self._path(name), "ab") as f:
+                f.truncate(new_capacity * row_bytes)
+        self._map()
+        self._free.extend(range(old_capacity, new_capacity))
+        self._bump()
+
+    def _slot_for_insert(self, dim: int) -> int:
+        if not self._free:
+            self._grow(dim)
+        if self._free:
+            return self._free.pop()
+        _, slot = self._index.popitem(last=False)
+        self.evictions += 1
+        return slot
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        out: List[Optional[np.ndarray]] = []
+        with self._locked():
+            self._sync()
+            for t in texts:
+                k = self.key(t)
+                slot = self._index.get(k)
+                if slot is not None and self._owners[slot].tobytes() != bytes.fromhex(k):
+                    # Taken over by another writer; never return its vector for this text
+                    del self._index[k]
+                    slot = None
+                if slot is None:
+                    self.misses += 1
+                    out.append(None)
+                    continue
+                self._index.move_to_end(k)
+                self.hits += 1
+                out.append(np.array(self._vectors[slot], dtype=np.float32))
+        hits = sum(1 for v in out if v is not None)
+        if hits:
+            metrics.inc("qa_embedding_cache_requests_total", hits, result="hit")
+        if len(out) - hits:
+            metrics.inc("qa_embedding_cache_requests_total", len(out) - hits, result="miss")
+        return out
+
+    def put_many(self, texts: List[str], vectors: List[Any]):
+        with self._locked():
+            self._sync()
+            written = 0
+            for t, v in zip(texts, vectors):
+                v = np.asarray(v, dtype=np.float32).ravel()
+                if self._dim is not None and v.shape[0] != self._dim:
+                    continue
+                k = self.key(t)
+                slot = self._index.get(k)
+                if slot is None:
+                    slot = self._slot_for_insert(v.shape[0])
+                # Clear the owner first so the slot never pairs one text's key with another's vector
+                self._owners[slot] = 0
+                self._vectors[slot] = v
+                self._owners[slot] = np.frombuffer(bytes.fromhex(k), dtype=np.uint8)
+                self._index[k] = slot
+                self._index.move_to_end(k)
+                written += 1
+            if written:
+                self._bump()
+                self._dirty += written
+            if self._dirty >= self.flush_every:
+                self._flush_locked()
+
+    def _flush_locked(self):
+        if self._vectors is None:
+            return
+        self._vectors.flush()
+        self._owners.flush()
+        tmp = self._path(f"index.json.{os.getpid()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"model": self.model_name, "lru": list(self._index)}, f)
+        os.replace(tmp, self._path("index.json"))
+        self._dirty = 0
+
+    def flush(self):
+        with self._locked():
+            if self._dirty:
+                self._flush_locked()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "model": self.model_name,
+            "entries": len(self._index),
+            "capacity": self._capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits / total) if total else 0.0,
+        }
+
+
+class CachedEmbeddingFunction(EmbeddingFunction[Documents]):
+    """Chroma embedding function that consults an EmbeddingCache before the encoder."""
+
+    def __init__(self, base: EmbeddingFunction, cache: EmbeddingCache):
+        self.base = base
+        self.cache = cache
+
+    def __call__(self, input: Documents) -> Embeddings:
+        texts = list(input)
+        cached = self.cache.get_many(texts)
+        missing = [i for i, v in enumerate(cached) if v is None]
+        if missing:
+            # Encode each distinct missing text once
+            unique: Dict[str, int] = {}
+            for i in missing:
+                unique.setdefault(_normalize(texts[i]), i)
+            order = list(unique.values())
+            with metrics.span("encode"):
+                fresh = self.base([texts[i] for i in order])
+            self.cache.put_many([texts[i] for i in order], fresh)
+            by_text = {_normalize(texts[i]): np.asarray(v, dtype=np.float32) for i, v in zip(order, fresh)}
+            for i in missing:
+                cached[i] = by_text[_normalize(texts[i])]
+        return cached
@@ -0,0 +1,181 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import List, Dict, Any, Callable, Iterable, Iterator, Optional, Tuple
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+
+ProgressCallback = Callable[[Dict[str, Any]], None]
+
+
+def default_workers() -> int:
+    return int(os.getenv("INGEST_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+
+def default_batch_size() -> int:
+    return int(os.getenv("INGEST_BATCH_SIZE", "64"))
+
+
+class IngestPipeline:
+    """
+    Streaming ingestion: parse/chunk in a process pool, embed fixed-size
+    batches on writer threads and write each batch as soon as it is ready.
+
+    The parse window and the batch queue are both bounded so at most a few
+    documents and batches are held in memory at once. All progress callbacks
+    run on the calling thread (Streamlit cannot update widgets from others).
+    """
+
+    def __init__(
+        self,
+        write_batch: Callable[[List[Dict[str, Any]]], None],
+        workers: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        embed_workers: int = 1,
+        queue_size: int = 4,
+        pool_threshold: int = 8,
+        progress: Optional[ProgressCallback] = None,
+    ):
+        self.write_batch = write_batch
+        self.workers = max(1, workers if workers is not None else default_workers())
+        self.batch_size = max(1, batch_size or default_batch_size())
+        self.embed_workers = max(1, embed_workers)
+        self.queue_size = max(1, queue_size)
+        self.pool_threshold = pool_threshold
+        self.progress = progress
+        self._batches: "queue.Queue[Optional[List[Dict[str, Any]]]]" = queue.Queue(maxsize=self.queue_size)
+        self._events: "queue.Queue[int]" = queue.Queue()
+        self._errors: List[BaseException] = []
+        self._buffer: List[Dict[str, Any]] = []
+        self._counters = {"documents_total": 0, "documents_done": 0, "chunks_queued": 0, "chunks_written": 0}
+        self._started = 0.0
+
+    def _writer(self):
+        while True:
+            batch = self._batches.get()
+            if batch is None:
+                return
+            try:
+                if not self._errors:
+                    self.write_batch(batch)
+                    self._events.put(len(batch))
+            except BaseException as e:  # surfaced on the calling thread
+                self._errors.append(e)
+                self._events.put(0)
+
+    def _report(self):
+        if self.progress is None:
+            return
+        elapsed = time.perf_counter() - self._started
+        written = self._counters["chunks_written"]
+        self.progress({
+            **self._counters,
+            "elapsed_s": elapsed,
+            "chunks_per_s": (written / elapsed) if elapsed > 0 else 0.0,
+        })
+
+    def _drain_events(self, timeout: Optional[float] = None):
+        got = False
+        while True:
+            try:
+                n = self._events.get(timeout=timeout) if (timeout and not got) else self._events.get_nowait()
+            except queue.Empty:
+                break
+            got = True
+            self._counters["chunks_written"] += n
+        if got:
+            self._report()
+
+    def _enqueue(self, batch: List[Dict[str, Any]]):
+        # Block while the writers are behind (backpressure), but keep reporting
+        while True:
+            try:
+                self._batches.put(batch, timeout=0.1)
+                return
+            except queue.Full:
+                self._drain_events()
+                if self._errors:
+                    raise self._errors[0]
+
+    def add_chunks(self, chunks: Iterable[Dict[str, Any]]):
+        """Queue chunks for writing; full batches are handed to the writers."""
+        for ch in chunks:
+            self._buffer.append(ch)
+            self._counters["chunks_queued"] += 1
+            if len(self._buffer) >= self.batch_size:
+                batch, self._buffer = self._buffer, []
+                self._enqueue(batch)
+
+    def _parse_results(self, prepare: Callable, items: List[Tuple], inline: Optional[Callable[[Tuple], bool]] = None) -> Iterator[Any]:
+        local = [item for item in items if inline is not None and inline(item)]
+        pooled = [item for item in items if not (inline is not None and inline(item))]
+        if self.workers <= 1 or len(pooled) < self.pool_threshold:
+            for item in local + pooled:
+                yield prepare(*item)
+            return
+        ctx = multiprocessing.get_context("spawn")
+        window = self.workers * 2
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx) as pool:
+            pending = set()
+            it = iter(pooled)
+            for item in it:
+                pending.add(pool.submit(prepare, *item))
+                if len(pending) >= window:
+                    break
+            # The pool works through its first window while inline items stream here
+            for item in local:
+                yield prepare(*item)
+            while pending:
+                done, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    yield fut.result()
+                    nxt = next(it, None)
+                    if nxt is not None:
+                        pending.add(pool.submit(prepare, *nxt))
+                self._drain_events()
+
+    def run(
+        self,
+        prepare: Callable,
+        items: List[Tuple],
+        on_result: Callable[[Any], Iterable[Dict[str, Any]]],
+        inline: Optional[Callable[[Tuple], bool]] = None,
+    ) -> Dict[str, Any]:
+        """
+        prepare: picklable top-level function run in the pool as prepare(*item)
+        on_result: runs on this thread per prepared document; returns chunks to write
+        inline: items it accepts are prepared on this thread instead, so their
+            results may hold lazy generators that are consumed batch by batch
+        """
+        self._started = time.perf_counter()
+        self._counters["documents_total"] = len(items)
+        writers = [threading.Thread(target=self._writer, daemon=True) for _ in range(self.embed_workers)]
+        for w in writers:
+            w.start()
+        try:
+            for result in self._parse_results(prepare, items, inline):
+                self.add_chunks(on_result(result))
+                self._counters["documents_done"] += 1
+                self._report()
+                if self._errors:
+                    raise self._errors[0]
+            if self._buffer:
+                batch, self._buffer = self._buffer, []
+                self._enqueue(batch)
+        finally:
+            for _ in writers:
+                self._batches.put(None)
+            while any(w.is_alive() for w in writers):
+                self._drain_events(timeout=0.1)
+            self._drain_events()
+        if self._errors:
+            raise self._errors[0]
+        elapsed = time.perf_counter() - self._started
+        return {
+            "documents": self._counters["documents_done"],
+            "chunks_written": self._counters["chunks_written"],
+            "elapsed_s": elapsed,
+            "chunks_per_s": (self._counters["chunks_written"] / elapsed) if elapsed > 0 else 0.0,
+        }
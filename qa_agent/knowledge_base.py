@@ -1,11 +1,23 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterable, Iterator, NamedTuple, Optional, Tuple
+import json
 import os
+import shutil
+import threading
+import time
 
-from .parser import parse_document
-from .vectorstore import VectorStore
+from . import metrics
+from .chunker import iter_chunks
+from .ingest import IngestPipeline, ProgressCallback
+from .manifest import Manifest, content_hash, file_hash
+from .lexical_index import reciprocal_rank_fusion
+from .parser import lazy_parse_seconds, parse_document, pdf_page_count
+from .response_cache import ResponseCache
+from .selector_index import SelectorIndex, load_selector_index, remember, save_selector_index
 
 
+@metrics.timed("chunk")
 def chunk_text(text: str, chunk_size: int = 800, overlap: int = 120) -> List[str]:
+    # Fixed-width character windows; ingestion uses chunker.iter_chunks instead
     if not text:
         return []
     chunks = []
@@ -21,52 +33,415 @@ def chunk_text(text: str, chunk_size: int = 800, overlap: int = 120) -> List[str
     return chunks
 
 
+def _document_chunks(filename: str, parsed: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    # ids and chunk_index are assigned by KnowledgeBase once a document's parts are in order
+    for ch in iter_chunks(parsed):
+        yield {
+            "text": ch["text"],
+            "source_document": filename,
+            "metadata": {**parsed.get("metadata", {}), **ch["metadata"]},
+        }
+
+
+def _chunk_headings(meta: Dict[str, Any]) -> List[str]:
+    # A chunk spanning sections keeps its first heading in "heading" and all of them in "headings"
+    return [h for h in [meta.get("heading", ""), *meta.get("headings", "").split(" | ")] if h]
+
+
+def _chunk_hash(ch: Dict[str, Any]) -> str:
+    return content_hash(ch["text"] + json.dumps(ch.get("metadata", {}), sort_keys=True, default=str))
+
+
+def pdf_pages_per_task() -> int:
+    return int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+
+
+def stream_threshold_bytes() -> int:
+    # Text/JSON files at least this large are streamed on the calling process
+    return int(os.getenv("INGEST_STREAM_BYTES", str(16 * 1024 * 1024)))
+
+
+class _Task(NamedTuple):
+    """One unit of parse work: a whole document or a page range of a PDF."""
+    doc_key: str
+    filename: str
+    content: Optional[bytes]
+    path: Optional[str]
+    doc_hash: str
+    is_html: bool
+    parse_only: bool
+    page_range: Optional[Tuple[int, int]]
+    part: int
+    parts: int
+    lazy: bool
+
+
+def _prepare_document(
+    doc_key: str,
+    filename: str,
+    content: Optional[bytes],
+    path: Optional[str],
+    doc_hash: str,
+    is_html: bool,
+    parse_only: bool,
+    page_range: Optional[Tuple[int, int]] = None,
+    part: int = 0,
+    parts: int = 1,
+    lazy: bool = False,
+) -> Dict[str, Any]:
+    """
+    Parse and chunk one document or PDF page range; runs inside the ingestion
+    process pool unless lazy, in which case chunks stay a generator.
+    """
+    start = time.perf_counter()
+    parsed = parse_document(filename, content, path=path, page_range=page_range)
+    timings = {"parse": time.perf_counter() - start}
+    if parse_only:
+        chunks: Any = []
+    elif lazy:
+        chunks = _document_chunks(filename, parsed)
+    else:
+        start = time.perf_counter()
+        chunks = list(_document_chunks(filename, parsed))
+        elapsed = time.perf_counter() - start
+        # Reading lines/pages while chunking is parse work; parse_document records it in-process
+        produced = lazy_parse_seconds(parsed) or 0.0
+        timings["parse"] += produced
+        timings["chunk"] = elapsed - produced
+        metrics.record_stage("chunk", timings["chunk"])
+    return {
+        "doc_key": doc_key,
+        "filename": filename,
+        "doc_hash": doc_hash,
+        "is_html": is_html,
+        "html_text": parsed.get("text") if is_html else None,
+        "selectors": parsed.get("selectors") if is_html else None,
+        "chunks": chunks,
+        "parse_only": parse_only,
+        "part": part,
+        "parts": parts,
+        # Pool workers have their own metrics registry; the parent replays these
+        "timings": timings,
+        "pid": os.getpid(),
+    }
+
+
 class KnowledgeBase:
-    def __init__(self, persist_dir: str = "data/chroma"):
-        self.store = VectorStore(persist_dir=persist_dir)
+    def __init__(self, persist_dir: str = "data/chroma", collection_name: str = "knowledgebase", state_dir: Optional[str] = None):
+        # Imported here so importing this module (and spawning ingestion workers) skips chromadb
+        from .vectorstore import VectorStore
+
+        self.persist_dir = persist_dir
+        # Manifest, caches, lexical index and HTML/selector state; next to the Chroma data by default
+        self.state_dir = state_dir or persist_dir
+        self.store = VectorStore(persist_dir=persist_dir, collection_name=collection_name, state_dir=self.state_dir)
+        self.manifest = Manifest(os.path.join(self.state_dir, "manifest.json"))
+        self.response_cache = ResponseCache(os.path.join(self.state_dir, "response_cache.json"))
+        if self.store.reindexed:
+            # Cached responses are matched by query embeddings from the old vector space
+            self.manifest.kb_version += 1
+            self.response_cache.invalidate(self.version)
+            self.manifest.save()
+        self._write_lock = threading.Lock()
+        # Builds mutate the manifest; concurrent callers are serialized
+        self._build_lock = threading.Lock()
         self._html_content: Optional[str] = None
         self._html_filename: Optional[str] = None
+        self._html_hash: Optional[str] = None
+        self._selector_index: Optional[SelectorIndex] = None
+
+    @property
+    def version(self) -> int:
+        return self.manifest.kb_version
 
-    def build(self, documents: List[Dict[str, Any]], html_document: Optional[Dict[str, Any]] = None):
+    def _assemble(self, result: Dict[str, Any], assembling: Dict[str, Dict[str, Any]], stats: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
         """
-        documents: list of {filename: str, content: bytes}
-        html_document: optional {filename: str, content: bytes}
+        Yield the changed chunks of one prepared part, in document order.
+
+        Parts (PDF page ranges) may finish out of order; they are held until
+        their predecessors arrive so chunk ids stay "{doc_key}-{idx}". Once the
+        last part is consumed, orphaned chunks are deleted and the manifest
+        entry is updated.
         """
-        chunks_to_add: List[Dict[str, Any]] = []
+        doc_key = result["doc_key"]
+        state = assembling.setdefault(doc_key, {"next": 0, "ready": {}, "index": 0, "hashes": {}, "headings": {}})
+        state["ready"][result["part"]] = result["chunks"]
+        previous = (self.manifest.get(doc_key) or {}).get("chunks", {})
+        while state["next"] in state["ready"]:
+            for ch in state["ready"].pop(state["next"]):
+                idx = state["index"]
+                state["index"] += 1
+                ch["id"] = f"{doc_key}-{idx}"
+                ch["chunk_index"] = idx
+                h = _chunk_hash(ch)
+                state["hashes"][ch["id"]] = h
+                state["headings"].update(dict.fromkeys(_chunk_headings(ch.get("metadata", {}))))
+                metrics.inc("qa_chunks_total")
+                old = previous.get(ch["id"])
+                if old == h:
+                    stats["skipped"] += 1
+                    continue
+                stats["updated" if old else "added"] += 1
+                yield ch
+            state["next"] += 1
+        if state["next"] < result["parts"]:
+            return
+        del assembling[doc_key]
+        orphaned = [cid for cid in previous if cid not in state["hashes"]]
+        if orphaned:
+            with self._write_lock:
+                self.store.delete_ids(orphaned)
+            stats["deleted"] += len(orphaned)
+        self.manifest.set(doc_key, result["filename"], result["doc_hash"], state["hashes"], list(state["headings"]))
 
-        if html_document:
-            parsed = parse_document(html_document["filename"], html_document["content"])
-            self._html_content = parsed["text"] if parsed else None
-            self._html_filename = html_document["filename"]
-            # Also add HTML text to store for retrieval
-            for idx, ch in enumerate(chunk_text(parsed.get("text", ""))):
-                chunks_to_add.append({
-                    "id": f"html-{idx}",
-                    "text": ch,
-                    "source_document": html_document["filename"],
-                    "chunk_index": idx,
-                    "metadata": parsed.get("metadata", {}),
-                })
+    def _write_batch(self, batch: List[Dict[str, Any]]):
+        # Encode outside the lock so embedding overlaps with Chroma writes
+        embeddings = self.store.embed([ch["text"] for ch in batch])
+        with self._write_lock:
+            self.store.upsert_chunks(batch, embeddings=embeddings)
+
+    def build(
+        self,
+        documents: List[Dict[str, Any]],
+        html_document: Optional[Dict[str, Any]] = None,
+        progress: Optional[ProgressCallback] = None,
+        workers: Optional[int] = None,
+        batch_size: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """
+        documents: list of {filename: str, content: bytes} or {filename: str, path: str}
+        html_document: optional {filename: str, content: bytes} (or path)
+        progress: optional callback receiving pipeline counters and chunks_per_s
+
+        Incremental: documents whose content hash matches the manifest are skipped,
+        only changed chunks are re-embedded and orphaned chunks are deleted.
+        Parsing runs in a process pool and embeddings are written in batches.
+        Documents given by path are hashed and parsed from disk: PDFs are split
+        into page ranges across the pool, and text/JSON files of at least
+        INGEST_STREAM_BYTES are streamed through the chunker on this process.
+        Returns chunk counts {added, updated, deleted, skipped} plus throughput.
+        """
+        with self._build_lock, metrics.span("build"):
+            return self._build(documents, html_document, progress, workers, batch_size)
 
+    def _build(self, documents, html_document, progress, workers, batch_size) -> Dict[str, Any]:
+        stats: Dict[str, Any] = {"added": 0, "updated": 0, "deleted": 0, "skipped": 0}
+        pending = []
+        if html_document:
+            # HTML chunks keep their historical "html-{idx}" ids
+            pending.append(("html", html_document, True))
         for doc in documents:
-            parsed = parse_document(doc["filename"], doc["content"])
-            for idx, ch in enumerate(chunk_text(parsed.get("text", ""))):
-                chunks_to_add.append({
-                    "id": f"{doc['filename']}-{idx}",
-                    "text": ch,
-                    "source_document": doc["filename"],
-                    "chunk_index": idx,
-                    "metadata": parsed.get("metadata", {}),
-                })
-
-        if chunks_to_add:
-            self.store.add_chunks(chunks_to_add)
-
-    def retrieve(self, query: str, top_k: int = 6) -> List[Dict[str, Any]]:
-        return self.store.query(query_text=query, top_k=top_k)
+            pending.append((doc["filename"], doc, False))
+
+        # Restores the persisted HTML so unchanged HTML is not parsed again
+        self.get_html()
+        items: List[_Task] = []
+        pages_per_task = max(1, pdf_pages_per_task())
+        for doc_key, doc, is_html in pending:
+            path = doc.get("path")
+            content = None if path else doc["content"]
+            doc_hash = file_hash(path) if path else content_hash(content)
+            previous = self.manifest.get(doc_key) or {}
+            unchanged = previous.get("doc_hash") == doc_hash
+            if unchanged:
+                stats["skipped"] += len(previous.get("chunks", {}))
+                # Unchanged HTML is parsed again only if its persisted copy is missing
+                if not (is_html and self._html_hash != doc_hash):
+                    continue
+            ext = doc["filename"].lower().rsplit(".", 1)[-1]
+            ranges: List[Optional[Tuple[int, int]]] = [None]
+            # In-memory PDFs stay one task: every range would pickle the whole file
+            if path and ext == "pdf" and not is_html:
+                n_pages = pdf_page_count(path)
+                if n_pages > pages_per_task:
+                    ranges = [(s, min(s + pages_per_task, n_pages)) for s in range(0, n_pages, pages_per_task)]
+            lazy = bool(path) and not is_html and ext != "pdf" and os.path.getsize(path) >= stream_threshold_bytes()
+            for part, page_range in enumerate(ranges):
+                items.append(_Task(
+                    doc_key, doc["filename"], content, path, doc_hash, is_html, unchanged,
+                    page_range, part, len(ranges), lazy,
+                ))
+
+        assembling: Dict[str, Dict[str, Any]] = {}
+
+        def on_result(result: Dict[str, Any]) -> Iterable[Dict[str, Any]]:
+            if result["pid"] != os.getpid():
+                for stage, seconds in result["timings"].items():
+                    metrics.record_stage(stage, seconds)
+            if result["is_html"]:
+                self._set_html(result["html_text"], result["filename"], result["doc_hash"])
+                self._set_selector_index(SelectorIndex(result["selectors"] or {}, content_hash=result["doc_hash"]))
+            if result["parse_only"]:
+                return []
+            return self._assemble(result, assembling, stats)
+
+        pipeline = IngestPipeline(self._write_batch, workers=workers, batch_size=batch_size, progress=progress)
+        try:
+            stats.update(pipeline.run(_prepare_document, items, on_result, inline=lambda task: task.lazy))
+            stats["documents"] = len({task.doc_key for task in items})
+        except BaseException:
+            # Never persist hashes for chunks that may not have been written
+            self.manifest.load()
+            raise
+
+        if stats["added"] or stats["updated"] or stats["deleted"]:
+            self.manifest.kb_version += 1
+            self.response_cache.invalidate(self.version)
+        self.manifest.save()
+        self.store.flush()
+        return stats
+
+    def outline(self) -> List[Dict[str, Any]]:
+        """Section headings of every document, in document order: [{"source_document", "headings"}]."""
+        out = []
+        for entry in list(self.manifest.documents.values()):
+            headings = entry.get("headings")
+            if headings is None:
+                # Documents ingested before headings were recorded in the manifest
+                res = self.store.collection.get(where={"source_document": entry["filename"]}, include=["metadatas"])
+                metas = sorted(res["metadatas"], key=lambda m: m.get("chunk_index", 0))
+                headings = list(dict.fromkeys(h for m in metas for h in _chunk_headings(m)))
+            out.append({"source_document": entry["filename"], "headings": headings})
+        return out
+
+    def embed_query(self, query: str):
+        return self.store.embed([query])[0]
+
+    def retrieve(
+        self,
+        query: str,
+        top_k: int = 6,
+        query_embedding: Optional[Any] = None,
+        mode: str = "vector",
+    ) -> List[Dict[str, Any]]:
+        """
+        mode: "vector" (cosine search in Chroma), "lexical" (BM25) or "hybrid"
+        (both rankings fused with reciprocal rank fusion).
+        """
+        with metrics.span("retrieve", mode=mode):
+            return self._retrieve(query, top_k, query_embedding, mode)
+
+    def _retrieve(self, query: str, top_k: int, query_embedding: Optional[Any], mode: str) -> List[Dict[str, Any]]:
+        if mode == "lexical":
+            return self.store.lexical_query(query, top_k=top_k)
+        if mode != "hybrid":
+            return self.store.query(query_text=query, top_k=top_k, query_embedding=query_embedding)
+        # Over-fetch from each retriever so fusion has candidates to reorder
+        depth = top_k * 2
+        vector_hits = self.store.query(query_text=query, top_k=depth, query_embedding=query_embedding)
+        lexical_hits = self.store.lexical_query(query, top_k=depth)
+        fused = reciprocal_rank_fusion([[h["id"] for h in vector_hits], [h["id"] for h in lexical_hits]])
+        by_id = {h["id"]: h for h in lexical_hits}
+        by_id.update({h["id"]: h for h in vector_hits})
+        results = []
+        for cid, score in fused[:top_k]:
+            hit = dict(by_id[cid])
+            hit["score"] = score
+            results.append(hit)
+        return results
+
+    @property
+    def _selectors_dir(self) -> str:
+        return os.path.join(self.state_dir, "selectors")
+
+    def _html_path(self, doc_hash: str) -> str:
+        return os.path.join(self._selectors_dir, f"{doc_hash}.html")
+
+    def _set_html(self, text: str, filename: str, doc_hash: str):
+        self._html_content = text
+        self._html_filename = filename
+        self._html_hash = doc_hash
+        # Persisted with the selector index so a reopened KB still serves get_html()
+        path = self._html_path(doc_hash)
+        os.makedirs(self._selectors_dir, exist_ok=True)
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(f"{path}.tmp", path)
+
+    def _set_selector_index(self, index: SelectorIndex):
+        self._selector_index = index
+        remember(index)
+        save_selector_index(index, self._selectors_dir)
+
+    def get_selector_index(self) -> Optional[SelectorIndex]:
+        """DOM selector index of the current checkout HTML; loaded from disk without re-parsing."""
+        if self._selector_index is None:
+            html_entry = self.manifest.get("html")
+            if html_entry:
+                self._selector_index = load_selector_index(self._selectors_dir, html_entry["doc_hash"])
+        return self._selector_index
 
     def get_html(self) -> Optional[str]:
+        if self._html_content is None:
+            html_entry = self.manifest.get("html")
+            path = self._html_path(html_entry["doc_hash"]) if html_entry else None
+            if path and os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    self._html_content = f.read()
+                self._html_filename = html_entry["filename"]
+                self._html_hash = html_entry["doc_hash"]
         return self._html_content
 
     def has_html(self) -> bool:
-        return self._html_content is not None
\ No newline at end of file
+        return self.get_html() is not None
+
+    def footprint_bytes(self) -> int:
+        """Rough resident size: the vector index plus the JSON state this KB loads."""
+        paths = [self.manifest.path, self.response_cache.path, self.store.lexical.path]
+        return self.store.vector_bytes() + sum(os.path.getsize(p) for p in paths if os.path.exists(p))
+
+    def close(self):
+        self.store.flush()
+
+    def compact(self) -> Dict[str, Any]:
+        """
+        Rewrite the collection without deleted entries, drop expired cached
+        responses and selector/HTML files of superseded checkout pages.
+        """
+        with self._build_lock, metrics.span("compact"):
+            before = self.footprint_bytes()
+            chunks = self.store.compact()
+            self.store.flush()
+            self.response_cache.compact()
+            html_entry = self.manifest.get("html")
+            keep = html_entry["doc_hash"] if html_entry else None
+            removed = 0
+            if os.path.isdir(self._selectors_dir):
+                for name in os.listdir(self._selectors_dir):
+                    if name.split(".", 1)[0] != keep:
+                        os.remove(os.path.join(self._selectors_dir, name))
+                        removed += 1
+            return {"chunks": chunks, "bytes_before": before, "bytes_after": self.footprint_bytes(), "files_removed": removed}
+
+    def export_snapshot(self, path: str) -> Dict[str, Any]:
+        """Write a portable snapshot (chunks, embeddings, manifest, lexical index, HTML/selectors) to path."""
+        from .snapshot import export_snapshot
+
+        with self._build_lock:
+            return export_snapshot(self, path)
+
+    def import_snapshot(self, path: str, verify: bool = True) -> Dict[str, Any]:
+        """Replace this KB with a snapshot's contents without re-encoding anything."""
+        from .snapshot import import_snapshot
+
+        with self._build_lock:
+            try:
+                return import_snapshot(self, path, verify=verify)
+            except BaseException:
+                # The swap may or may not have happened; serve whatever the files now say
+                self.manifest.load()
+                self.store.reload_lexical()
+                raise
+
+    def destroy(self):
+        """Delete this KB's collection and all of its state."""
+        with self._build_lock:
+            self.store.drop()
+            for path in (self.manifest.path, self.response_cache.path):
+                if os.path.exists(path):
+                    os.remove(path)
+            shutil.rmtree(self._selectors_dir, ignore_errors=True)
+            self.manifest.load()
+            self.response_cache.invalidate()
+            self._html_content = self._html_filename = self._html_hash = None
+            self._selector_index = None
\ No newline at end of file
@@ -0,0 +1,153 @@
+from collections import Counter
+from typing import List, Dict, Iterable, Optional, Tuple
+import json
+import math
+import os
+import re
+import threading
+
+
+# Keep identifiers such as SAVE15, discount_code, add-item-1 and /apply_coupon whole
+_TOKEN_RE = re.compile(r"[A-Za-z0-9]+(?:[_\-./][A-Za-z0-9]+)*")
+_SPLIT_RE = re.compile(r"[_\-./]")
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for m in _TOKEN_RE.finditer(text):
+        tok = m.group(0).lower()
+        tokens.append(tok)
+        # Also index the parts so "discount" matches "discount_code"
+        parts = _SPLIT_RE.split(tok)
+        if len(parts) > 1:
+            tokens.extend(p for p in parts if p)
+    return tokens
+
+
+class LexicalIndex:
+    """
+    In-process BM25 inverted index persisted as JSON next to the Chroma data.
+
+    Loaded lazily on first use; mutations are kept in memory until save().
+    """
+
+    def __init__(self, path: str, k1: float = 1.5, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._dirty = False
+        self._doc_terms: Dict[str, Dict[str, int]] = {}
+        self._doc_len: Dict[str, int] = {}
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._total_len = 0
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            if os.path.exists(self.path):
+                try:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        data = json.load(f)
+                    for doc_id, terms in data.get("doc_terms", {}).items():
+                        self._add_locked(doc_id, terms)
+                except Exception:
+                    self._doc_terms.clear()
+                    self._doc_len.clear()
+                    self._postings.clear()
+                    self._total_len = 0
+            self._loaded = True
+
+    def _add_locked(self, doc_id: str, terms: Dict[str, int]):
+        self._doc_terms[doc_id] = terms
+        length = sum(terms.values())
+        self._doc_len[doc_id] = length
+        self._total_len += length
+        for term, tf in terms.items():
+            self._postings.setdefault(term, {})[doc_id] = tf
+
+    def _remove_locked(self, doc_id: str):
+        terms = self._doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        self._total_len -= self._doc_len.pop(doc_id, 0)
+        for term in terms:
+            posting = self._postings.get(term)
+            if posting is not None:
+                posting.pop(doc_id, None)
+                if not posting:
+                    del self._postings[term]
+
+    def upsert(self, ids: Iterable[str], texts: Iterable[str]):
+        self._ensure_loaded()
+        with self._lock:
+            for doc_id, text in zip(ids, texts):
+                self._remove_locked(doc_id)
+                self._add_locked(doc_id, dict(Counter(tokenize(text))))
+            self._dirty = True
+
+    def delete(self, ids: Iterable[str]):
+        self._ensure_loaded()
+        with self._lock:
+            for doc_id in ids:
+                self._remove_locked(doc_id)
+            self._dirty = True
+
+    def clear(self):
+        with self._lock:
+            self._doc_terms.clear()
+            self._doc_len.clear()
+            self._postings.clear()
+            self._total_len = 0
+            self._loaded = True
+            self._dirty = True
+
+    def __len__(self) -> int:
+        self._ensure_loaded()
+        return len(self._doc_terms)
+
+    def search(self, query: str, top_k: int = 6) -> List[Tuple[str, float]]:
+        self._ensure_loaded()
+        with self._lock:
+            n = len(self._doc_terms)
+            if not n:
+                return []
+            avg_len = self._total_len / n
+            scores: Dict[str, float] = {}
+            for term in set(tokenize(query)):
+                posting = self._postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+                for doc_id, tf in posting.items():
+                    norm = tf + self.k1 * (1 - self.b + self.b * self._doc_len[doc_id] / avg_len)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+        return sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:top_k]
+
+    def save(self):
+        with self._lock:
+            if not (self._loaded and self._dirty):
+                return
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"doc_terms": self._doc_terms}, f)
+            os.replace(tmp, self.path)
+            self._dirty = False
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60, weights: Optional[List[float]] = None) -> List[Tuple[str, float]]:
+    """Fuse several ranked id lists; score(id) = sum(w / (k + rank))."""
+    weights = weights or [1.0] * len(rankings)
+    scores: Dict[str, float] = {}
+    for ranking, w in zip(rankings, weights):
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + w / (k + rank)
+    return sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
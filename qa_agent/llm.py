@@ -1,53 +1,185 @@
-from typing import Optional
+from typing import Any, Dict, Iterator, Optional
+import asyncio
+import hashlib
 import os
 import json
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import metrics
+from .llm_scheduler import BULK, INTERACTIVE, LLMScheduler, shared_scheduler
+from .tokens import count_tokens
+
+
+FALLBACK_SCRIPT_HINT = (
+    "# Fallback generator: ensure IDs in checkout.html are used. "
+    "# The final script should open the local checkout page, fill form, apply coupon, and assert payment success."
+)
+
+FALLBACK_TEST_TABLE = (
+    "| Test_ID | Feature | Test_Scenario | Expected_Result | Grounded_In |\n"
+    "|---------|---------|---------------|-----------------|-------------|\n"
+    "| TC-001 | Discount Code | Apply valid code SAVE15 | Total reduced by 15% | product_specs.md |\n"
+    "| TC-002 | Discount Code | Apply invalid code ABC | Error message shown | product_specs.md |\n"
+)
 
 
 class LLMProvider:
-    def __init__(self, ollama_url: Optional[str] = None, ollama_model: Optional[str] = None):
+    def __init__(
+        self,
+        ollama_url: Optional[str] = None,
+        ollama_model: Optional[str] = None,
+        connect_timeout: Optional[float] = None,
+        read_timeout: Optional[float] = None,
+        retries: Optional[int] = None,
+        backoff: Optional[float] = None,
+        pool_size: Optional[int] = None,
+    ):
         self.ollama_url = ollama_url or os.getenv("OLLAMA_URL", "http://localhost:11434")
         self.ollama_model = ollama_model or os.getenv("OLLAMA_MODEL", "llama3")
+        self.connect_timeout = connect_timeout if connect_timeout is not None else float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))
+        # Read timeout applies between streamed chunks, not to the whole generation
+        self.read_timeout = read_timeout if read_timeout is not None else float(os.getenv("OLLAMA_READ_TIMEOUT", "120"))
+        self.retries = retries if retries is not None else int(os.getenv("OLLAMA_RETRIES", "2"))
+        self.backoff = backoff if backoff is not None else float(os.getenv("OLLAMA_BACKOFF", "0.5"))
+        pool_size = pool_size or int(os.getenv("OLLAMA_POOL_SIZE", "8"))
+        # Keep-alive connection pool; retries only cover connecting and
+        # retryable statuses, never a generation that already started streaming
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            max_retries=Retry(
+                total=self.retries,
+                connect=self.retries,
+                read=0,
+                status=self.retries,
+                backoff_factor=self.backoff,
+                status_forcelist=(429, 502, 503, 504),
+                allowed_methods=None,
+                raise_on_status=False,
+            ),
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # Per-model slots, priorities and coalescing, shared by every provider in the process
+        self.scheduler: LLMScheduler = shared_scheduler(self.ollama_url, self.ollama_model)
+
+    def _payload(self, prompt: str, system: Optional[str]) -> Dict[str, Any]:
+        payload: Dict[str, Any] = {"model": self.ollama_model, "prompt": prompt, "stream": True}
+        if system:
+            payload["system"] = system
+        return payload
+
+    def _stream_tokens(self, prompt: str, system: Optional[str] = None) -> Iterator[str]:
+        url = f"{self.ollama_url}/api/generate"
+        with self.session.post(
+            url,
+            json=self._payload(prompt, system),
+            stream=True,
+            timeout=(self.connect_timeout, self.read_timeout),
+        ) as r:
+            r.raise_for_status()
+            done = False
+            # Ollama streams newline-delimited JSON
+            for ln in r.iter_lines():
+                if not ln:
+                    continue
+                try:
+                    obj = json.loads(ln)
+                except ValueError:
+                    continue
+                if obj.get("error"):
+                    raise RuntimeError(obj["error"])
+                if obj.get("response"):
+                    yield obj["response"]
+                if obj.get("done"):
+                    done = True
+                    break
+            if not done:
+                raise ConnectionError("Ollama stream ended before the response was done")
 
-    def _ollama_generate(self, prompt: str, system: Optional[str] = None) -> Optional[str]:
+    def _record(self, prompt: str, system: Optional[str], out: str, fallback: bool):
+        metrics.inc("qa_llm_requests_total", outcome="fallback" if fallback else "ok", model=self.ollama_model)
+        metrics.inc("qa_llm_tokens_total", count_tokens(prompt) + count_tokens(system or ""), kind="prompt")
+        if not fallback:
+            metrics.inc("qa_llm_tokens_total", count_tokens(out), kind="response")
+
+    def _upstream(self, prompt: str, system: Optional[str]) -> Iterator[str]:
+        """The Ollama call itself; the scheduler runs it once per group of identical requests."""
+        start = time.perf_counter()
+        produced = []
         try:
-            url = f"{self.ollama_url}/api/generate"
-            payload = {"model": self.ollama_model, "prompt": prompt}
-            if system:
-                payload["system"] = system
-            r = requests.post(url, json=payload, timeout=60)
-            if r.status_code == 200:
-                # Ollama streams newline-delimited JSON
-                lines = r.text.strip().splitlines()
-                outputs = []
-                for ln in lines:
-                    try:
-                        obj = json.loads(ln)
-                        if "response" in obj:
-                            outputs.append(obj["response"])
-                    except Exception:
-                        continue
-                return "".join(outputs)
-            return None
+            for tok in self._stream_tokens(prompt, system):
+                produced.append(tok)
+                yield tok
+        except Exception as e:
+            # Callers fall back to the template; keep the failure visible in metrics
+            metrics.inc("qa_llm_errors_total", error=type(e).__name__)
+            raise
+        finally:
+            metrics.record_stage("llm_generate", time.perf_counter() - start)
+        if produced:
+            self._record(prompt, system, "".join(produced), False)
+
+    def _request_key(self, prompt: str, system: Optional[str]) -> str:
+        return hashlib.sha256(json.dumps([self.ollama_url, self.ollama_model, system or "", prompt]).encode("utf-8")).hexdigest()
+
+    def _scheduled(self, prompt: str, system: Optional[str], priority: str) -> Iterator[str]:
+        return self.scheduler.stream(self._request_key(prompt, system), priority, lambda: self._upstream(prompt, system))
+
+    def _ollama_generate(self, prompt: str, system: Optional[str] = None, priority: str = INTERACTIVE) -> Optional[str]:
+        try:
+            return "".join(self._scheduled(prompt, system, priority))
         except Exception:
             return None
 
-    def generate(self, prompt: str, system: Optional[str] = None) -> str:
-        # Try Ollama first
-        out = self._ollama_generate(prompt, system)
-        if out:
-            return out
-        # Fallback: deterministic template response
+    def generate_stream(self, prompt: str, system: Optional[str] = None, priority: str = INTERACTIVE) -> Iterator[str]:
+        """
+        Yield response tokens as Ollama produces them; falls back to the
+        template if nothing arrives. A failure after the first token is
+        raised: the text so far is truncated and must not pass for a response.
+        """
+        produced = False
+        try:
+            for tok in self._scheduled(prompt, system, priority):
+                produced = True
+                yield tok
+        except Exception:
+            # Counted in _upstream
+            if produced:
+                raise
+        if not produced:
+            fallback = self._fallback(system)
+            self._record(prompt, system, fallback, True)
+            yield fallback
+
+    async def agenerate(self, prompt: str, system: Optional[str] = None, priority: str = INTERACTIVE) -> str:
+        """Async generate for the FastAPI backend; waits for its model slot on a worker thread."""
+        return await asyncio.to_thread(self.generate, prompt, system, priority)
+
+    def _fallback(self, system: Optional[str]) -> str:
+        # Deterministic template response
         if system and "Selenium" in system:
             # Basic instruction response stub for scripts
-            return (
-                "# Fallback generator: ensure IDs in checkout.html are used. "
-                "# The final script should open the local checkout page, fill form, apply coupon, and assert payment success."
-            )
+            return FALLBACK_SCRIPT_HINT
         # For test cases, produce a small markdown table with citations placeholder
-        return (
-            "| Test_ID | Feature | Test_Scenario | Expected_Result | Grounded_In |\n"
-            "|---------|---------|---------------|-----------------|-------------|\n"
-            "| TC-001 | Discount Code | Apply valid code SAVE15 | Total reduced by 15% | product_specs.md |\n"
-            "| TC-002 | Discount Code | Apply invalid code ABC | Error message shown | product_specs.md |\n"
-        )
\ No newline at end of file
+        return FALLBACK_TEST_TABLE
+
+    def generate(self, prompt: str, system: Optional[str] = None, priority: str = INTERACTIVE) -> str:
+        """
+        Full response for a prompt. priority is INTERACTIVE for a user waiting
+        on this one answer, BULK for batch fan-out (plans, script batches).
+        """
+        # Try Ollama first
+        out = self._ollama_generate(prompt, system, priority)
+        if out:
+            return out
+        self._record(prompt, system, "", True)
+        return self._fallback(system)
+
+    @staticmethod
+    def is_fallback(text: str) -> bool:
+        return text in (FALLBACK_SCRIPT_HINT, FALLBACK_TEST_TABLE)
@@ -0,0 +1,252 @@
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+import os
+import threading
+import time
+
+from . import metrics
+
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+DEFAULT_WEIGHTS = {INTERACTIVE: 4, BULK: 1}
+
+
+def _parse_pairs(spec: str) -> Dict[str, int]:
+    # "interactive=4,bulk=1" -> {"interactive": 4, "bulk": 1}
+    out = {}
+    for part in spec.split(","):
+        name, sep, value = part.partition("=")
+        if sep and name.strip():
+            out[name.strip()] = max(1, int(value))
+    return out
+
+
+class _Ticket:
+    __slots__ = ("priority", "granted")
+
+    def __init__(self, priority: str):
+        self.priority = priority
+        self.granted = False
+
+
+class _Flight:
+    """One upstream generation; every coalesced caller replays its tokens from the start."""
+
+    def __init__(self, key: Optional[str], priority: str):
+        self.key = key
+        self.ticket = _Ticket(priority)
+        self.queued = time.perf_counter()
+        self.tokens: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.followers = 0
+        self.cond = threading.Condition()
+
+    def push(self, token: str):
+        with self.cond:
+            self.tokens.append(token)
+            self.cond.notify_all()
+
+    def finish(self, error: Optional[BaseException] = None):
+        with self.cond:
+            self.done = True
+            self.error = error
+            self.cond.notify_all()
+
+    def follow(self) -> Iterator[str]:
+        seen = 0
+        while True:
+            with self.cond:
+                while seen >= len(self.tokens) and not self.done:
+                    self.cond.wait()
+                new = self.tokens[seen:]
+                finished = self.done
+            for token in new:
+                yield token
+            seen += len(new)
+            if finished:
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+class LLMScheduler:
+    """
+    Admission control for one model on one LLM server.
+
+    At most max_concurrency generations run at once. Waiting requests are
+    queued per priority class and dispatched by smooth weighted round robin,
+    so interactive requests overtake bulk ones without starving them.
+    Identical requests (same key) that arrive while one is queued or running
+    share its generation instead of starting another.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrency: int = 4,
+        weights: Optional[Dict[str, int]] = None,
+        coalesce: bool = True,
+    ):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.weights = dict(weights or DEFAULT_WEIGHTS)
+        self.coalesce = coalesce
+        self.active = 0
+        self.coalesced = 0
+        self.granted = {p: 0 for p in self.weights}
+        self._cond = threading.Condition()
+        self._queues: Dict[str, Deque[_Ticket]] = {p: deque() for p in self.weights}
+        self._credit = {p: 0 for p in self.weights}
+        self._flights: Dict[str, _Flight] = {}
+
+    def _check_priority(self, priority: str) -> str:
+        if priority not in self.weights:
+            raise ValueError(f"Unknown priority {priority!r}; expected one of {sorted(self.weights)}")
+        return priority
+
+    def _dispatch_locked(self):
+        while self.active < self.max_concurrency:
+            ready = [p for p, q in self._queues.items() if q]
+            if not ready:
+                break
+            for p in ready:
+                self._credit[p] += self.weights[p]
+            chosen = max(ready, key=lambda p: self._credit[p])
+            self._credit[chosen] -= sum(self.weights[p] for p in ready)
+            ticket = self._queues[chosen].popleft()
+            ticket.granted = True
+            self.active += 1
+            self.granted[chosen] += 1
+        self._cond.notify_all()
+
+    def _enqueue_locked(self, ticket: _Ticket):
+        # Queued by the caller under the lock, so a joiner can always find it to promote
+        self._queues[ticket.priority].append(ticket)
+        self._dispatch_locked()
+
+    def _wait_granted(self, ticket: _Ticket):
+        with self._cond:
+            while not ticket.granted:
+                self._cond.wait()
+
+    def _release(self):
+        with self._cond:
+            self.active -= 1
+            self._dispatch_locked()
+
+    def _promote_locked(self, ticket: _Ticket, priority: str):
+        # An interactive caller joining a queued bulk request must not wait behind bulk
+        if ticket.granted or self.weights[priority] <= self.weights[ticket.priority]:
+            return
+        self._queues[ticket.priority].remove(ticket)
+        ticket.priority = priority
+        self._queues[priority].append(ticket)
+
+    def _abandoned(self, flight: _Flight) -> bool:
+        # Checked under the scheduler lock, which joiners hold while subscribing,
+        # and detached at once so nobody joins a generation that is being dropped
+        with self._cond:
+            if flight.followers:
+                return False
+            if flight.key is not None and self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+            return True
+
+    def _run(self, flight: _Flight, produce: Callable[[], Iterator[str]]):
+        self._wait_granted(flight.ticket)
+        metrics.observe("qa_llm_queue_wait_seconds", time.perf_counter() - flight.queued, model=self.name, priority=flight.ticket.priority)
+        error = None
+        try:
+            # Callers that gave up while queued (closed streams) need no generation
+            if not self._abandoned(flight):
+                tokens = produce()
+                try:
+                    for token in tokens:
+                        flight.push(token)
+                        if not flight.followers and self._abandoned(flight):
+                            break
+                finally:
+                    tokens.close()
+        except Exception as e:
+            error = e
+        finally:
+            self._release()
+            with self._cond:
+                if flight.key is not None and self._flights.get(flight.key) is flight:
+                    del self._flights[flight.key]
+            flight.finish(error)
+
+    def stream(self, key: Optional[str], priority: str, produce: Callable[[], Iterator[str]]) -> Iterator[str]:
+        """
+        Yield the tokens of produce(), run on a worker thread once a slot is
+        free. Callers passing the same key while it is in flight get the
+        same tokens; key=None never coalesces.
+        """
+        self._check_priority(priority)
+        with self._cond:
+            flight = self._flights.get(key) if key is not None and self.coalesce else None
+            leader = flight is None
+            if leader:
+                flight = _Flight(key, priority)
+                if key is not None and self.coalesce:
+                    self._flights[key] = flight
+                self._enqueue_locked(flight.ticket)
+            else:
+                self.coalesced += 1
+                self._promote_locked(flight.ticket, priority)
+            with flight.cond:
+                flight.followers += 1
+        if leader:
+            threading.Thread(target=self._run, args=(flight, produce), name=f"llm-{self.name}", daemon=True).start()
+        else:
+            metrics.inc("qa_llm_coalesced_total", model=self.name)
+        try:
+            yield from flight.follow()
+        finally:
+            with flight.cond:
+                flight.followers -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            queued = {p: len(q) for p, q in self._queues.items()}
+            granted = dict(self.granted)
+            out = {
+                "model": self.name,
+                "max_concurrency": self.max_concurrency,
+                "active": self.active,
+                "in_flight_requests": len(self._flights),
+                "coalesced": self.coalesced,
+                "weights": dict(self.weights),
+            }
+        out["queued"] = queued
+        out["granted"] = granted
+        out["queue_wait"] = {
+            p: metrics.summary("qa_llm_queue_wait_seconds", model=self.name, priority=p) for p in self.weights
+        }
+        return out
+
+
+# One scheduler per (server, model) and process, shared by every LLMProvider
+_lock = threading.Lock()
+_schedulers: Dict[Tuple[str, str], LLMScheduler] = {}
+
+
+def shared_scheduler(url: str, model: str) -> LLMScheduler:
+    with _lock:
+        scheduler = _schedulers.get((url, model))
+        if scheduler is None:
+            limits = _parse_pairs(os.getenv("LLM_MODEL_CONCURRENCY", ""))
+            scheduler = _schedulers[(url, model)] = LLMScheduler(
+                model,
+                max_concurrency=limits.get(model) or int(os.getenv("LLM_MAX_CONCURRENCY", "4")),
+                weights={**DEFAULT_WEIGHTS, **_parse_pairs(os.getenv("LLM_PRIORITY_WEIGHTS", ""))},
+                coalesce=os.getenv("LLM_COALESCE", "1") != "0",
+            )
+        return scheduler
+
+
+def all_schedulers() -> List[LLMScheduler]:
+    with _lock:
+        return list(_schedulers.values())
@@ -0,0 +1,71 @@
+from typing import Dict, Any, List, Optional
+import hashlib
+import json
+import os
+
+
+MANIFEST_VERSION = 1
+
+
+def content_hash(data) -> str:
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_hash(path: str, block_size: int = 1 << 20) -> str:
+    """content_hash of a file, read in blocks so large uploads are never held in memory."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class Manifest:
+    """
+    Content-hash manifest stored next to the Chroma persist dir.
+
+    documents: {doc_key: {filename, doc_hash, chunks: {chunk_id: chunk_hash}, headings}}
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.documents: Dict[str, Dict[str, Any]] = {}
+        self.kb_version = 0
+        self.load()
+
+    def load(self):
+        self.documents = {}
+        self.kb_version = 0
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception:
+            # A corrupt manifest only costs a full re-ingest
+            return
+        if data.get("version") != MANIFEST_VERSION:
+            return
+        self.documents = data.get("documents", {})
+        self.kb_version = int(data.get("kb_version", 0))
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({
+                "version": MANIFEST_VERSION,
+                "kb_version": self.kb_version,
+                "documents": self.documents,
+            }, f)
+        os.replace(tmp, self.path)
+
+    def get(self, doc_key: str) -> Optional[Dict[str, Any]]:
+        return self.documents.get(doc_key)
+
+    def set(self, doc_key: str, filename: str, doc_hash: str, chunks: Dict[str, str], headings: Optional[List[str]] = None):
+        self.documents[doc_key] = {"filename": filename, "doc_hash": doc_hash, "chunks": chunks}
+        if headings is not None:
+            self.documents[doc_key]["headings"] = headings
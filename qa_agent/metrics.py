@@ -0,0 +1,237 @@
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+import bisect
+import threading
+import time
+
+try:
+    from opentelemetry import trace as _otel_trace
+except ImportError:  # optional: spans are only emitted when OpenTelemetry is installed
+    _otel_trace = None
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+STAGE_SECONDS = "qa_stage_duration_seconds"
+
+HELP = {
+    STAGE_SECONDS: "Wall time per pipeline stage",
+    "qa_llm_requests_total": "LLM generations by outcome (ok, fallback)",
+    "qa_llm_errors_total": "LLM call failures by exception type",
+    "qa_llm_tokens_total": "Prompt and response tokens (heuristic count)",
+    "qa_embedding_cache_requests_total": "Embedding cache lookups by result",
+    "qa_response_cache_requests_total": "Response cache lookups by result",
+    "qa_chunks_total": "Chunks produced by ingestion",
+    "qa_llm_queue_wait_seconds": "Time LLM requests waited for a model slot, by priority",
+    "qa_llm_coalesced_total": "LLM requests served by an identical in-flight request",
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th observation."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return self.max
+
+
+def _summary(hist: Optional[_Histogram]) -> Dict[str, Any]:
+    if hist is None or not hist.count:
+        return {"count": 0, "total_s": 0.0, "mean_ms": 0.0, "p95_ms_le": 0.0, "max_ms": 0.0}
+    return {
+        "count": hist.count,
+        "total_s": round(hist.sum, 4),
+        "mean_ms": round(hist.sum / hist.count * 1000, 2),
+        "p95_ms_le": round(hist.quantile(0.95) * 1000, 2),
+        "max_ms": round(hist.max * 1000, 2),
+    }
+
+
+class Registry:
+    """In-process counters and histograms, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, _Histogram]] = {}
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            key = _key(labels)
+            series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            key = _key(labels)
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = _Histogram()
+            hist.observe(value)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def counter(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._counters.get(name, {}).get(_key(labels), 0.0)
+
+    def summary(self, name: str, **labels) -> Dict[str, Any]:
+        with self._lock:
+            return _summary(self._histograms.get(name, {}).get(_key(labels)))
+
+    def render_prometheus(self) -> str:
+        def fmt_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+            pairs = list(key) + ([extra] if extra else [])
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+        def fmt_value(value: float) -> str:
+            # Full precision: "{:g}" would export 1234567 as 1.23457e+06
+            value = float(value)
+            return str(int(value)) if value.is_integer() else repr(value)
+
+        lines: List[str] = []
+        with self._lock:
+            for name in sorted(self._counters):
+                if name in HELP:
+                    lines.append(f"# HELP {name} {HELP[name]}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in sorted(self._counters[name].items()):
+                    lines.append(f"{name}{fmt_labels(key)} {fmt_value(value)}")
+            for name in sorted(self._histograms):
+                if name in HELP:
+                    lines.append(f"# HELP {name} {HELP[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, hist in sorted(self._histograms[name].items()):
+                    cumulative = 0
+                    for bound, n in zip(hist.buckets, hist.counts):
+                        cumulative += n
+                        lines.append(f"{name}_bucket{fmt_labels(key, ('le', f'{bound:g}'))} {cumulative}")
+                    lines.append(f"{name}_bucket{fmt_labels(key, ('le', '+Inf'))} {hist.count}")
+                    lines.append(f"{name}_sum{fmt_labels(key)} {fmt_value(hist.sum)}")
+                    lines.append(f"{name}_count{fmt_labels(key)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Plain dict for UIs: per-stage timings, counters and derived cache hit rates."""
+        with self._lock:
+            stages = {
+                dict(key).get("stage", ""): _summary(hist)
+                for key, hist in self._histograms.get(STAGE_SECONDS, {}).items()
+            }
+            llm_queue_wait = {
+                "{model}/{priority}".format(**dict(key)): _summary(hist)
+                for key, hist in self._histograms.get("qa_llm_queue_wait_seconds", {}).items()
+            }
+            counters = {
+                name + (("{" + ",".join(f"{k}={v}" for k, v in key) + "}") if key else ""): value
+                for name, series in self._counters.items()
+                for key, value in series.items()
+            }
+
+            def hit_rate(name: str) -> Optional[float]:
+                series = self._counters.get(name, {})
+                total = sum(series.values())
+                if not total:
+                    return None
+                hits = sum(v for k, v in series.items() if dict(k).get("result") in ("hit", "near_hit"))
+                return hits / total
+
+            return {
+                "stages": stages,
+                "llm_queue_wait": llm_queue_wait,
+                "counters": counters,
+                "embedding_cache_hit_rate": hit_rate("qa_embedding_cache_requests_total"),
+                "response_cache_hit_rate": hit_rate("qa_response_cache_requests_total"),
+            }
+
+
+REGISTRY = Registry()
+
+
+def inc(name: str, value: float = 1.0, **labels):
+    REGISTRY.inc(name, value, **labels)
+
+
+def observe(name: str, value: float, **labels):
+    REGISTRY.observe(name, value, **labels)
+
+
+def record_stage(stage: str, seconds: float):
+    REGISTRY.observe(STAGE_SECONDS, seconds, stage=stage)
+
+
+@contextmanager
+def span(stage: str, **attributes) -> Iterator[None]:
+    """Time a block into qa_stage_duration_seconds{stage=...}; also an OpenTelemetry span when available."""
+    start = time.perf_counter()
+    if _otel_trace is not None:
+        with _otel_trace.get_tracer("qa_agent").start_as_current_span(stage, attributes=attributes or None):
+            try:
+                yield
+            finally:
+                record_stage(stage, time.perf_counter() - start)
+        return
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+def timed(stage: str) -> Callable:
+    """Decorator form of span()."""
+    def decorator(fn: Callable) -> Callable:
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def summary(name: str, **labels) -> Dict[str, Any]:
+    """count/mean/p95/max of one histogram series."""
+    return REGISTRY.summary(name, **labels)
+
+
+def render_prometheus() -> str:
+    return REGISTRY.render_prometheus()
+
+
+def snapshot() -> Dict[str, Any]:
+    return REGISTRY.snapshot()
@@ -1,8 +1,61 @@
-import io
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+import codecs
 import json
-from typing import Dict, Any
+import time
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, NavigableString, Comment
+
+try:
+    import ijson
+except ImportError:  # optional: large JSON files are then loaded whole before flattening
+    ijson = None
+
+from . import metrics
+from .selector_index import build_selector_index
+
+
+BLOCK_TAGS = {
+    "address", "article", "aside", "blockquote", "dd", "div", "dl", "dt", "fieldset",
+    "figcaption", "figure", "footer", "form", "h1", "h2", "h3", "h4", "h5", "h6",
+    "header", "legend", "li", "main", "nav", "ol", "p", "pre", "section", "table",
+    "td", "th", "tr", "ul",
+}
+HEADING_TAGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+
+_END = object()
+
+
+def _html_blocks(soup: BeautifulSoup):
+    """Group visible strings by their nearest block-level ancestor, tracking the current heading."""
+    blocks = []
+    heading = ""
+    current = None
+    parts = []
+
+    def flush():
+        text = " ".join(parts).strip()
+        if text:
+            blocks.append({"text": text, "heading": heading})
+
+    root = soup.body or soup
+    for node in root.descendants:
+        if not isinstance(node, NavigableString) or isinstance(node, Comment):
+            continue
+        if node.find_parent(["script", "style", "head", "noscript"]) is not None:
+            continue
+        text = node.strip()
+        if not text:
+            continue
+        block = node.find_parent(BLOCK_TAGS) or root
+        if block is not current:
+            flush()
+            parts = []
+            current = block
+            if block.name in HEADING_TAGS:
+                heading = block.get_text(" ", strip=True)
+        parts.append(text)
+    flush()
+    return blocks
 
 
 def _decode_bytes(content: bytes) -> str:
@@ -12,11 +65,224 @@ def _decode_bytes(content: bytes) -> str:
         return content.decode("latin-1", errors="ignore")
 
 
-def parse_document(filename: str, content: bytes) -> Dict[str, Any]:
+def _read_bytes(content: Optional[bytes], path: Optional[str]) -> bytes:
+    if path is None:
+        return content or b""
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _is_utf8(path: str, block_size: int = 1 << 20) -> bool:
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    try:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(block_size), b""):
+                decoder.decode(block)
+        decoder.decode(b"", final=True)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def _text_lines(content: Optional[bytes], path: Optional[str]) -> Iterator[str]:
+    """Lines of a text document; files are streamed, never read whole."""
+    if path is None:
+        yield from _decode_bytes(content or b"").splitlines()
+        return
+    # Same utf-8 then latin-1 fallback as _decode_bytes, decided before streaming
+    encoding = "utf-8" if _is_utf8(path) else "latin-1"
+    with open(path, "r", encoding=encoding, errors="ignore") as f:
+        for line in f:
+            yield line.rstrip("\r\n")
+
+
+def _json_events(obj: Any) -> Iterator[Tuple[str, Any]]:
+    """Walk a loaded JSON value iteratively, emitting ijson.basic_parse-style events."""
+    stack = [iter((obj,))]
+    closers: List[Optional[str]] = [None]
+    while stack:
+        item = next(stack[-1], _END)
+        if item is _END:
+            stack.pop()
+            closer = closers.pop()
+            if closer:
+                yield closer, None
+            continue
+        if closers[-1] == "end_map":
+            key, item = item
+            yield "map_key", key
+        if isinstance(item, dict):
+            yield "start_map", None
+            stack.append(iter(item.items()))
+            closers.append("end_map")
+        elif isinstance(item, list):
+            yield "start_array", None
+            stack.append(iter(item))
+            closers.append("end_array")
+        else:
+            yield "scalar", item
+
+
+# A flattened JSON leaf: its path as keys and array indexes, and its value
+JsonPath = Tuple[Union[str, int], ...]
+
+
+def json_path(segments: JsonPath) -> str:
+    """Render path segments as "key/path[0]"."""
+    out = ""
+    for seg in segments:
+        if isinstance(seg, int):
+            out += f"[{seg}]"
+        else:
+            out = f"{out}/{seg}" if out else str(seg)
+    return out
+
+
+def _flatten_json(events: Iterable[Tuple[str, Any]]) -> Iterator[Tuple[JsonPath, Any]]:
+    """Flatten JSON events to (path segments, scalar value) pairs without recursion."""
+    # One [path, next array index or None for objects] entry per open container
+    open_containers: List[List[Any]] = []
+    key = ""
+    for event, value in events:
+        if event == "map_key":
+            key = value
+            continue
+        if event in ("end_map", "end_array"):
+            open_containers.pop()
+            continue
+        if not open_containers:
+            path: JsonPath = ()
+        else:
+            parent = open_containers[-1]
+            if parent[1] is None:
+                path = parent[0] + (key,)
+            else:
+                path = parent[0] + (parent[1],)
+                parent[1] += 1
+        if event == "start_map":
+            open_containers.append([path, None])
+        elif event == "start_array":
+            open_containers.append([path, 0])
+        else:
+            yield path, value
+
+
+def _json_stream_entries(path: str) -> Iterator[Tuple[JsonPath, Any]]:
+    produced = False
+    try:
+        with open(path, "rb") as f:
+            for entry in _flatten_json(ijson.basic_parse(f, use_float=True)):
+                produced = True
+                yield entry
+    except ijson.JSONError:
+        if produced:
+            return
+        # Not valid JSON: index the raw text, as pathless entries, like the non-streaming path does
+        for line in _text_lines(None, path):
+            yield (), line
+
+
+def pdf_page_count(path: str) -> int:
+    """Number of pages, or 0 when the file cannot be opened as a PDF."""
+    try:
+        import fitz  # PyMuPDF
+        with fitz.open(path) as doc:
+            return doc.page_count
+    except Exception:
+        return 0
+
+
+def _pdf_pages(doc, start: int, stop: int) -> Iterator[str]:
+    try:
+        for number in range(start, min(stop, doc.page_count)):
+            yield doc.load_page(number).get_text()
+    finally:
+        doc.close()
+
+
+_LAZY_KEYS = ("lines", "entries", "pages")
+
+
+class _ParseTimer:
+    """
+    Wraps a lazy "lines"/"entries"/"pages" iterator so the time spent
+    producing items counts as parsing. It is recorded once, with the time
+    parse_document itself took, when the iterator is exhausted or closed.
     """
-    Parse a document into text with minimal metadata.
+
+    def __init__(self, items: Iterable[Any], build_seconds: float):
+        self.produced = 0.0
+        self._build = build_seconds
+        self._items = self._run(iter(items))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._items)
+
+    def close(self):
+        self._items.close()
+
+    def _run(self, items: Iterator[Any]) -> Iterator[Any]:
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(items)
+                except StopIteration:
+                    return
+                finally:
+                    self.produced += time.perf_counter() - start
+                yield item
+        finally:
+            if hasattr(items, "close"):
+                items.close()
+            metrics.record_stage("parse", self._build + self.produced)
+
+
+def lazy_parse_seconds(parsed: Dict[str, Any]) -> Optional[float]:
+    """Time spent so far producing a parsed document's lazy content, or None if it was parsed eagerly."""
+    for key in _LAZY_KEYS:
+        if isinstance(parsed.get(key), _ParseTimer):
+            return parsed[key].produced
+    return None
+
+
+def parse_document(
+    filename: str,
+    content: Optional[bytes] = None,
+    path: Optional[str] = None,
+    page_range: Optional[Tuple[int, int]] = None,
+) -> Dict[str, Any]:
+    """
+    Parse a document from in-memory bytes or a file path.
     Supports: .md, .txt, .json, .html, .htm, .pdf (basic text extraction via PyMuPDF if available).
+
+    Text, JSON and PDF content is exposed lazily for the chunker: "lines",
+    "entries" (flattened (path segments, value) pairs for JSON) or "pages"
+    plus "first_page" for PDFs, limited to page_range=(start, stop) when given.
+    HTML is parsed eagerly into "text", "blocks" and "selectors".
+
+    The "parse" stage covers consuming the lazy content, not just this call.
     """
+    start = time.perf_counter()
+    parsed = _parse_document(filename, content, path, page_range)
+    build = time.perf_counter() - start
+    for key in _LAZY_KEYS:
+        if parsed.get(key) is not None:
+            parsed[key] = _ParseTimer(parsed[key], build)
+            return parsed
+    metrics.record_stage("parse", build)
+    return parsed
+
+
+def _parse_document(
+    filename: str,
+    content: Optional[bytes] = None,
+    path: Optional[str] = None,
+    page_range: Optional[Tuple[int, int]] = None,
+) -> Dict[str, Any]:
     name = filename.lower()
     parsed = {
         "source_document": filename,
@@ -26,56 +292,43 @@ def parse_document(filename: str, content: bytes) -> Dict[str, Any]:
     }
 
     ext = parsed["ext"]
-    raw_text = _decode_bytes(content)
-
-    if ext in {"md", "txt"}:
-        parsed["text"] = raw_text
-        return parsed
 
     if ext in {"json"}:
+        if path is not None and ijson is not None:
+            parsed["entries"] = _json_stream_entries(path)
+            return parsed
+        raw_text = _decode_bytes(_read_bytes(content, path))
         try:
             obj = json.loads(raw_text)
-            # Flatten a bit for retrieval
-            flat_lines = []
-            def walk(prefix, v):
-                if isinstance(v, dict):
-                    for k, vv in v.items():
-                        walk(f"{prefix}/{k}" if prefix else str(k), vv)
-                elif isinstance(v, list):
-                    for i, vv in enumerate(v):
-                        walk(f"{prefix}[{i}]", vv)
-                else:
-                    flat_lines.append(f"{prefix}: {v}")
-            walk("", obj)
-            parsed["text"] = "\n".join(flat_lines)
         except Exception:
             parsed["text"] = raw_text
+            return parsed
+        parsed["entries"] = _flatten_json(_json_events(obj))
         return parsed
 
     if ext in {"html", "htm"}:
-        soup = BeautifulSoup(raw_text, "lxml")
+        soup = BeautifulSoup(_decode_bytes(_read_bytes(content, path)), "lxml")
         # Visible text
         text = soup.get_text(" ", strip=True)
         parsed["text"] = text
-        # Basic selector metadata for later use
-        ids = [e.get("id") for e in soup.find_all(attrs={"id": True})]
-        names = [e.get("name") for e in soup.find_all(attrs={"name": True})]
-        parsed["metadata"]["html_ids"] = [i for i in ids if i]
-        parsed["metadata"]["html_names"] = [n for n in names if n]
+        # Selector index (ids, names, labels, form fields, CSS paths) built from
+        # this same parse; KnowledgeBase persists it per content hash
+        parsed["selectors"] = build_selector_index(soup)
+        parsed["blocks"] = _html_blocks(soup)
         return parsed
 
     if ext in {"pdf"}:
         try:
             import fitz  # PyMuPDF
-            with fitz.open(stream=content, filetype="pdf") as doc:
-                texts = []
-                for page in doc:
-                    texts.append(page.get_text())
-                parsed["text"] = "\n".join(texts)
+            doc = fitz.open(path) if path is not None else fitz.open(stream=content, filetype="pdf")
         except Exception:
-            parsed["text"] = raw_text
+            parsed["lines"] = _text_lines(content, path)
+            return parsed
+        start, stop = page_range or (0, doc.page_count)
+        parsed["pages"] = _pdf_pages(doc, start, stop)
+        parsed["first_page"] = start + 1
         return parsed
 
-    # Fallback for unknown extensions
-    parsed["text"] = raw_text
-    return parsed
\ No newline at end of file
+    # .md, .txt and unknown extensions
+    parsed["lines"] = _text_lines(content, path)
+    return parsed
@@ -0,0 +1,225 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+import hashlib
+import os
+import re
+import shutil
+import threading
+
+from .knowledge_base import KnowledgeBase
+
+
+DEFAULT_PROJECT = "default"
+_PROJECT_ID_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]{0,63}$")
+
+
+class InvalidProjectId(ValueError):
+    pass
+
+
+class ProjectBusy(RuntimeError):
+    pass
+
+
+def validate_project_id(project_id: str) -> str:
+    if not isinstance(project_id, str) or not _PROJECT_ID_RE.match(project_id):
+        raise InvalidProjectId(
+            f"Invalid project id {project_id!r}: use 1-64 letters, digits, '-' or '_', starting with a letter or digit"
+        )
+    return project_id
+
+
+def collection_name(project_id: str) -> str:
+    """Chroma collection of a project; the hash keeps ids that differ only in case or punctuation apart."""
+    if project_id == DEFAULT_PROJECT:
+        return "knowledgebase"
+    readable = "".join(ch for ch in project_id.lower() if ch.isalnum())[:32]
+    return f"p{readable}{hashlib.sha1(project_id.encode('utf-8')).hexdigest()[:12]}"
+
+
+class ProjectPool:
+    """
+    LRU pool of per-project KnowledgeBases, opened lazily on first use.
+
+    Every project has its own Chroma collection and a state directory under
+    projects_dir (manifest, caches, lexical index, HTML and selectors); the
+    "default" project keeps the original layout in persist_dir. Once more
+    than max_open projects are open, or their estimated footprint exceeds
+    max_bytes (0 = unbounded), the least recently used projects that are not
+    leased are flushed and closed.
+    """
+
+    def __init__(
+        self,
+        persist_dir: Optional[str] = None,
+        projects_dir: Optional[str] = None,
+        max_open: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+    ):
+        self.persist_dir = persist_dir or os.getenv("CHROMA_DIR", "data/chroma")
+        self.projects_dir = projects_dir or os.getenv("PROJECTS_DIR", "data/projects")
+        self.max_open = max_open or int(os.getenv("PROJECT_POOL_MAX_OPEN", "8"))
+        self.max_bytes = max_bytes if max_bytes is not None else int(os.getenv("PROJECT_POOL_MAX_BYTES", str(512 << 20)))
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._open: "OrderedDict[str, KnowledgeBase]" = OrderedDict()
+        self._leases: Dict[str, int] = {}
+        self._footprints: Dict[str, int] = {}
+        # One lock per project so opening a large project does not block the others
+        self._opening: Dict[str, threading.Lock] = {}
+
+    def state_dir(self, project_id: str) -> str:
+        if project_id == DEFAULT_PROJECT:
+            return self.persist_dir
+        return os.path.join(self.projects_dir, project_id)
+
+    def exists(self, project_id: str) -> bool:
+        validate_project_id(project_id)
+        return project_id == DEFAULT_PROJECT or project_id in self._open or os.path.isdir(self.state_dir(project_id))
+
+    def project_ids(self) -> List[str]:
+        on_disk = os.listdir(self.projects_dir) if os.path.isdir(self.projects_dir) else []
+        ids = {DEFAULT_PROJECT, *self._open, *(p for p in on_disk if _PROJECT_ID_RE.match(p))}
+        return sorted(ids)
+
+    def _open_project(self, project_id: str) -> KnowledgeBase:
+        with self._lock:
+            kb = self._open.get(project_id)
+            if kb is not None:
+                self._open.move_to_end(project_id)
+                self.hits += 1
+                return kb
+            opening = self._opening.setdefault(project_id, threading.Lock())
+        with opening:
+            with self._lock:
+                kb = self._open.get(project_id)
+                if kb is not None:
+                    self.hits += 1
+                    return kb
+            state_dir = self.state_dir(project_id)
+            os.makedirs(state_dir, exist_ok=True)
+            kb = KnowledgeBase(persist_dir=self.persist_dir, collection_name=collection_name(project_id), state_dir=state_dir)
+            footprint = kb.footprint_bytes()
+            with self._lock:
+                self.misses += 1
+                self._open[project_id] = kb
+                self._footprints[project_id] = footprint
+                closed = self._evict_locked(keep=project_id)
+        for old in closed:
+            old.close()
+        return kb
+
+    def _evict_locked(self, keep: str) -> List[KnowledgeBase]:
+        closed = []
+        for project_id in list(self._open):
+            over_count = len(self._open) > self.max_open
+            over_bytes = self.max_bytes and sum(self._footprints.values()) > self.max_bytes
+            if not (over_count or over_bytes):
+                break
+            if project_id == keep or self._leases.get(project_id):
+                continue
+            closed.append(self._open.pop(project_id))
+            self._footprints.pop(project_id, None)
+            self.evictions += 1
+        return closed
+
+    def get(self, project_id: str = DEFAULT_PROJECT) -> KnowledgeBase:
+        """The project's KnowledgeBase without a lease; it may be closed once it becomes least recently used."""
+        return self._open_project(validate_project_id(project_id))
+
+    def acquire(self, project_id: str = DEFAULT_PROJECT) -> KnowledgeBase:
+        """Open (if needed) and lease a project; leased projects are never evicted. Pair with release()."""
+        validate_project_id(project_id)
+        with self._lock:
+            self._leases[project_id] = self._leases.get(project_id, 0) + 1
+        try:
+            return self._open_project(project_id)
+        except BaseException:
+            self.release(project_id, refresh=False)
+            raise
+
+    def release(self, project_id: str, refresh: bool = True):
+        kb = self._open.get(project_id)
+        # Re-measured after use: builds grow a project, compaction shrinks it
+        footprint = kb.footprint_bytes() if refresh and kb is not None else None
+        with self._lock:
+            left = self._leases.get(project_id, 0) - 1
+            if left > 0:
+                self._leases[project_id] = left
+            else:
+                self._leases.pop(project_id, None)
+            if footprint is not None and project_id in self._open:
+                self._footprints[project_id] = footprint
+            closed = self._evict_locked(keep="")
+        for old in closed:
+            old.close()
+
+    @contextmanager
+    def lease(self, project_id: str = DEFAULT_PROJECT) -> Iterator[KnowledgeBase]:
+        kb = self.acquire(project_id)
+        try:
+            yield kb
+        finally:
+            self.release(project_id)
+
+    def compact(self, project_id: str) -> Dict[str, Any]:
+        with self.lease(project_id) as kb:
+            return kb.compact()
+
+    def export_snapshot(self, project_id: str, path: str) -> Dict[str, Any]:
+        with self.lease(project_id) as kb:
+            return kb.export_snapshot(path)
+
+    def import_snapshot(self, project_id: str, path: str, verify: bool = True) -> Dict[str, Any]:
+        """Load a snapshot into a project, creating the project if needed; a project created by a failed import is removed again."""
+        created = not self.exists(project_id)
+        try:
+            with self.lease(project_id) as kb:
+                return kb.import_snapshot(path, verify=verify)
+        except BaseException:
+            if created:
+                try:
+                    self.delete(project_id)
+                except ProjectBusy:
+                    pass  # Someone started using it meanwhile
+            raise
+
+    def delete(self, project_id: str):
+        """Delete a project's collection and state; raises ProjectBusy while it is leased."""
+        kb = self._open_project(validate_project_id(project_id))
+        with self._lock:
+            if self._leases.get(project_id):
+                raise ProjectBusy(f"Project {project_id!r} is in use")
+            self._open.pop(project_id, None)
+            self._footprints.pop(project_id, None)
+        kb.destroy()
+        if project_id != DEFAULT_PROJECT:
+            shutil.rmtree(self.state_dir(project_id), ignore_errors=True)
+
+    def close(self):
+        with self._lock:
+            closed = list(self._open.values())
+            self._open.clear()
+            self._footprints.clear()
+        for kb in closed:
+            kb.close()
+
+    def open_projects(self) -> Dict[str, KnowledgeBase]:
+        with self._lock:
+            return dict(self._open)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "open": list(self._open),
+                "leased": {p: n for p, n in self._leases.items() if n},
+                "footprint_bytes": dict(self._footprints),
+                "max_open": self.max_open,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,69 @@
+from typing import Any, Dict, Optional
+import os
+import threading
+
+from .embedders import create_embedder
+
+
+# One embedding model, embedding cache and Chroma client per process, shared
+# by every KnowledgeBase (and every Streamlit session / API request)
+_lock = threading.Lock()
+_embedding_functions: Dict[tuple, Any] = {}
+_clients: Dict[str, Any] = {}
+
+
+def default_cache_dir() -> str:
+    return os.getenv("EMBEDDING_CACHE_DIR", "data/embedding_cache")
+
+
+def shared_embedding_function(cache_dir: Optional[str] = None, backend: Optional[str] = None, model_name: Optional[str] = None):
+    """
+    Process-wide CachedEmbeddingFunction for (embedder, cache dir); the
+    embedder is chosen by EMBEDDING_BACKEND and its model loads lazily.
+    """
+    from .embedding_cache import CachedEmbeddingFunction, EmbeddingCache
+
+    embedder = create_embedder(backend, model_name)
+    cache_dir = os.path.abspath(cache_dir or default_cache_dir())
+    key = (embedder.id, cache_dir)
+    with _lock:
+        ef = _embedding_functions.get(key)
+        if ef is None:
+            # Keyed by embedder id: backends never share cached vectors
+            cache = EmbeddingCache(
+                cache_dir,
+                model_name=embedder.id,
+                max_entries=int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "100000")),
+            )
+            ef = _embedding_functions[key] = CachedEmbeddingFunction(embedder, cache)
+        return ef
+
+
+def shared_chroma_client(persist_dir: str):
+    import chromadb
+
+    path = os.path.abspath(persist_dir)
+    with _lock:
+        client = _clients.get(path)
+        if client is None:
+            client = _clients[path] = chromadb.PersistentClient(path=path)
+        return client
+
+
+def warm_up(cache_dir: Optional[str] = None, background: bool = True) -> Optional[threading.Thread]:
+    """Import chromadb and load the embedding model ahead of the first request."""
+    def run():
+        try:
+            ef = shared_embedding_function(cache_dir)
+            # Bypass the cache so a real forward pass initializes the model
+            ef.base(["warm-up"])
+        except Exception:
+            # Best effort: the first real request loads (or reports) the model instead
+            pass
+
+    if not background:
+        run()
+        return None
+    thread = threading.Thread(target=run, name="qa-warm-up", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,158 @@
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional
+import hashlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from . import metrics
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def _unit(vec) -> np.ndarray:
+    v = np.asarray(vec, dtype=np.float32).ravel()
+    n = float(np.linalg.norm(v))
+    return v / n if n else v
+
+
+class ResponseCache:
+    """
+    Persistent LLM response cache with near-duplicate prompt matching.
+
+    An entry's namespace is (KB version, model, system prompt, retrieved chunk
+    ids); exact hits additionally match the normalized query, near hits need
+    query-embedding cosine similarity >= similarity_threshold. Entries expire
+    after ttl_seconds and the least recently used are evicted past max_entries.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        similarity_threshold: Optional[float] = None,
+        ttl_seconds: Optional[float] = None,
+        max_entries: Optional[int] = None,
+    ):
+        self.path = path
+        self.similarity_threshold = similarity_threshold if similarity_threshold is not None else float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.95"))
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else float(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+        self.max_entries = max_entries if max_entries is not None else int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "512"))
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._vectors: Dict[str, np.ndarray] = {}
+        self._load()
+
+    @staticmethod
+    def namespace(kb_version: int, model: str, system: Optional[str], chunk_ids: List[str]) -> str:
+        raw = json.dumps([kb_version, model, system or "", sorted(chunk_ids)])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            for key, entry in data.get("entries", []):
+                self._entries[key] = entry
+                self._vectors[key] = _unit(entry["embedding"])
+        except Exception:
+            self._entries.clear()
+            self._vectors.clear()
+
+    def _save_locked(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"entries": list(self._entries.items())}, f)
+        os.replace(tmp, self.path)
+
+    def _expire_locked(self, now: float) -> bool:
+        expired = [k for k, e in self._entries.items() if now - e["created"] > self.ttl_seconds]
+        for k in expired:
+            self._entries.pop(k, None)
+            self._vectors.pop(k, None)
+        return bool(expired)
+
+    def get(self, query: str, query_embedding, namespace: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            self._expire_locked(now)
+            key = hashlib.sha256(f"{namespace}\0{_normalize(query)}".encode("utf-8")).hexdigest()
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                metrics.inc("qa_response_cache_requests_total", result="hit")
+                return entry["response"]
+            if query_embedding is not None and self.similarity_threshold < 1.0:
+                q = _unit(query_embedding)
+                best_key, best_sim = None, self.similarity_threshold
+                for k, e in self._entries.items():
+                    v = self._vectors[k]
+                    if e["namespace"] != namespace or v.shape != q.shape:
+                        continue
+                    sim = float(np.dot(q, v))
+                    if sim >= best_sim:
+                        best_key, best_sim = k, sim
+                if best_key is not None:
+                    self._entries.move_to_end(best_key)
+                    self.near_hits += 1
+                    metrics.inc("qa_response_cache_requests_total", result="near_hit")
+                    return self._entries[best_key]["response"]
+            self.misses += 1
+            metrics.inc("qa_response_cache_requests_total", result="miss")
+            return None
+
+    def put(self, query: str, query_embedding, namespace: str, response: str, kb_version: int):
+        with self._lock:
+            key = hashlib.sha256(f"{namespace}\0{_normalize(query)}".encode("utf-8")).hexdigest()
+            vec = _unit(query_embedding) if query_embedding is not None else np.zeros(1, dtype=np.float32)
+            self._entries[key] = {
+                "namespace": namespace,
+                "kb_version": kb_version,
+                "embedding": vec.tolist(),
+                "response": response,
+                "created": time.time(),
+            }
+            self._vectors[key] = vec
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                old, _ = self._entries.popitem(last=False)
+                self._vectors.pop(old, None)
+            self._save_locked()
+
+    def invalidate(self, kb_version: Optional[int] = None):
+        """Drop entries built against any other KB version (all entries if None)."""
+        with self._lock:
+            stale = [k for k, e in self._entries.items() if kb_version is None or e.get("kb_version") != kb_version]
+            for k in stale:
+                self._entries.pop(k, None)
+                self._vectors.pop(k, None)
+            if stale:
+                self._save_locked()
+
+    def compact(self):
+        """Drop expired entries and rewrite the file."""
+        with self._lock:
+            self._expire_locked(time.time())
+            if os.path.exists(self.path) or self._entries:
+                self._save_locked()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.near_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "hit_rate": ((self.hits + self.near_hits) / total) if total else 0.0,
+        }
@@ -1,9 +1,17 @@
-from typing import Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Any, Iterator, List, Optional
+import io
+import json
 import os
-from bs4 import BeautifulSoup
+import re
+import time
+import zipfile
 
+from . import metrics
 from .knowledge_base import KnowledgeBase
-from .llm import LLMProvider
+from .llm import BULK, INTERACTIVE, LLMProvider
+from .script_synth import missing_steps, plan_steps, render_script, split_snippets, unresolved_prompt
+from .selector_index import SelectorIndex, selector_index_for_html
 
 
 SYSTEM_PROMPT_SELENIUM = (
@@ -16,24 +24,29 @@ def _get_checkout_file_url() -> str:
     # Construct local file URL for assets/checkout.html
     here = os.path.dirname(os.path.dirname(__file__))
     path = os.path.abspath(os.path.join(here, "assets", "checkout.html"))
-    return f"file:///{path.replace('\\', '/')}"
+    posix_path = path.replace("\\", "/")
+    return f"file:///{posix_path}"
 
 
-def _extract_ids(html: str):
-    soup = BeautifulSoup(html, "lxml")
-    ids = [e.get("id") for e in soup.find_all(attrs={"id": True})]
-    return [i for i in ids if i]
+def _selector_index(html_text: str, kb: Optional[KnowledgeBase]) -> SelectorIndex:
+    # Prefer the KB's index (built once at ingestion); otherwise memoized per HTML hash
+    index = kb.get_selector_index() if kb is not None else None
+    if index is None:
+        index = selector_index_for_html(html_text or "")
+    return index
 
 
-def generate_selenium_script(test_case: Dict[str, Any], html_text: str, kb: KnowledgeBase, llm: LLMProvider) -> str:
-    # Compose context for LLM (or fallback) including available IDs
-    ids = _extract_ids(html_text)
+@metrics.timed("script_prompt")
+def _build_prompt(test_case: Dict[str, Any], html_text: str, kb: Optional[KnowledgeBase] = None, index: Optional[SelectorIndex] = None):
+    """Return (prompt, base_script) for one test case."""
+    # Compose context for LLM (or fallback) including available selectors
+    index = index or _selector_index(html_text, kb)
     url = _get_checkout_file_url()
     scenario = test_case.get("Test_Scenario") or test_case.get("Test_Scenario".lower()) or "Run selected test scenario."
     feature = test_case.get("Feature", "Checkout")
 
     context = (
-        f"HTML IDs available: {', '.join(ids)}\n"
+        f"{index.describe()}\n"
         f"Open URL: {url}\n"
         f"Feature: {feature}\n"
         f"Scenario: {scenario}\n"
@@ -94,7 +107,10 @@ assert "Payment Successful!" in status.text
 driver.quit()
 """
 
-    llm_out = llm.generate(prompt, system=SYSTEM_PROMPT_SELENIUM)
+    return prompt, base_script
+
+
+def _extract_code(llm_out: str, base_script: str) -> str:
     # If the LLM returned only commentary fallback, return base_script
     if llm_out.strip().startswith("# Fallback") or len(llm_out.strip()) < 40:
         return base_script
@@ -103,10 +119,194 @@ driver.quit()
     code = llm_out
     if "```" in code:
         parts = code.split("```")
-        # try to find python block
-        for i in range(len(parts)-1):
-            if parts[i].strip().lower().startswith("python"):
-                return parts[i+1]
+        # Odd-indexed parts are fence contents; prefer one tagged python
+        blocks = parts[1::2]
+        for block in blocks:
+            if block.strip().lower().startswith("python"):
+                return block.split("\n", 1)[1] if "\n" in block else ""
         # otherwise take the last fence content
-        return parts[-2] if len(parts) >= 2 else base_script
-    return code
\ No newline at end of file
+        return blocks[-1] if blocks else base_script
+    return code
+
+
+def _synth_mode() -> str:
+    # auto: rules first, LLM only for unresolved steps; llm: always the full LLM prompt
+    return os.getenv("SCRIPT_SYNTH_MODE", "auto").lower()
+
+
+def _plan(test_case: Dict[str, Any], index: SelectorIndex) -> Optional[List[Dict[str, Any]]]:
+    """Rule-based step plan, or None when the whole script should come from the LLM."""
+    if _synth_mode() == "llm":
+        return None
+    with metrics.span("script_rules"):
+        planned = plan_steps(test_case, index)
+    # Nothing mapped: splicing would add nothing over the full prompt
+    if not any(s["actions"] for s in planned):
+        return None
+    return planned
+
+
+def _synth_result(code: str, path: str, planned: Optional[List[Dict[str, Any]]], started: float, missing: Optional[List[str]] = None) -> Dict[str, Any]:
+    metrics.inc("qa_script_synthesis_total", path=path)
+    planned = planned or []
+    return {
+        "code": code,
+        "path": path,
+        "steps_total": len(planned),
+        "steps_unresolved": [s["text"] for s in planned if not s["actions"]],
+        "steps_missing": missing or [],
+        "elapsed_s": time.perf_counter() - started,
+    }
+
+
+def _spliced_result(url: str, planned: List[Dict[str, Any]], llm_out: str, started: float) -> Dict[str, Any]:
+    # "partial" when some unresolved step got no LLM code and ships as a TODO
+    snippets = {} if llm_out.strip().startswith("# Fallback") else split_snippets(llm_out, planned)
+    missing = missing_steps(planned, snippets)
+    return _synth_result(render_script(url, planned, snippets), "partial" if missing else "hybrid", planned, started, missing)
+
+
+def synthesize_selenium_script(
+    test_case: Dict[str, Any],
+    html_text: str,
+    kb: Optional[KnowledgeBase],
+    llm: LLMProvider,
+    index: Optional[SelectorIndex] = None,
+    priority: str = INTERACTIVE,
+) -> Dict[str, Any]:
+    """
+    Script for one test case plus the path that produced it: "rules" (no LLM
+    call), "hybrid" (LLM for the unresolved steps only), "partial" (hybrid, but
+    some steps got no code and are left as TODOs) or "llm" (full prompt).
+    """
+    started = time.perf_counter()
+    index = index or _selector_index(html_text, kb)
+    planned = _plan(test_case, index)
+    if planned is None:
+        prompt, base_script = _build_prompt(test_case, html_text, kb, index=index)
+        code = _extract_code(llm.generate(prompt, system=SYSTEM_PROMPT_SELENIUM, priority=priority), base_script)
+        return _synth_result(code, "llm", planned, started)
+    url = _get_checkout_file_url()
+    if all(s["actions"] for s in planned):
+        return _synth_result(render_script(url, planned), "rules", planned, started)
+    llm_out = llm.generate(unresolved_prompt(planned, index, url), system=SYSTEM_PROMPT_SELENIUM, priority=priority)
+    return _spliced_result(url, planned, llm_out, started)
+
+
+def generate_selenium_script(test_case: Dict[str, Any], html_text: str, kb: KnowledgeBase, llm: LLMProvider) -> str:
+    return synthesize_selenium_script(test_case, html_text, kb, llm)["code"]
+
+
+def stream_selenium_script(test_case: Dict[str, Any], html_text: str, kb: KnowledgeBase, llm: LLMProvider) -> Iterator[Dict[str, Any]]:
+    """
+    Yield {"type": "token", "text"} events, then {"type": "result", "code", "path", ...}.
+    Fully rule-resolved cases produce no tokens, only the result.
+    """
+    started = time.perf_counter()
+    index = _selector_index(html_text, kb)
+    planned = _plan(test_case, index)
+    url = _get_checkout_file_url()
+    if planned is not None and all(s["actions"] for s in planned):
+        yield {"type": "result", **_synth_result(render_script(url, planned), "rules", planned, started)}
+        return
+    if planned is None:
+        prompt, base_script = _build_prompt(test_case, html_text, kb, index=index)
+    else:
+        prompt = unresolved_prompt(planned, index, url)
+    parts: List[str] = []
+    for tok in llm.generate_stream(prompt, system=SYSTEM_PROMPT_SELENIUM):
+        parts.append(tok)
+        yield {"type": "token", "text": tok}
+    llm_out = "".join(parts)
+    if planned is None:
+        result = _synth_result(_extract_code(llm_out, base_script), "llm", planned, started)
+    else:
+        result = _spliced_result(url, planned, llm_out, started)
+    yield {"type": "result", **result}
+
+
+def _test_id(test_case: Dict[str, Any], position: int) -> str:
+    return str(test_case.get("Test_ID") or f"TC-{position + 1:03d}")
+
+
+def iter_selenium_scripts(
+    test_cases: List[Dict[str, Any]],
+    html_text: str,
+    kb: KnowledgeBase,
+    llm: LLMProvider,
+    concurrency: Optional[int] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Generate scripts for many test cases with at most ``concurrency`` LLM calls
+    in flight, yielding {"position", "test_id", "code", "path", "ok", "error",
+    "elapsed_s"} for each case as soon as it finishes. The selector index is
+    resolved once.
+    """
+    concurrency = max(1, concurrency or int(os.getenv("SCRIPT_BATCH_CONCURRENCY", "4")))
+    index = _selector_index(html_text, kb)
+
+    def run(position: int, test_case: Dict[str, Any]) -> Dict[str, Any]:
+        started = time.perf_counter()
+        result = {"position": position, "test_id": _test_id(test_case, position), "code": "", "path": None, "ok": True, "error": None}
+        try:
+            synth = synthesize_selenium_script(test_case, html_text, kb, llm, index=index, priority=BULK)
+            result["code"] = synth["code"]
+            result["path"] = synth["path"]
+        except Exception as e:
+            result["ok"] = False
+            result["error"] = str(e)
+        result["elapsed_s"] = time.perf_counter() - started
+        return result
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="selenium-batch") as pool:
+        futures = [pool.submit(run, i, tc) for i, tc in enumerate(test_cases)]
+        for fut in as_completed(futures):
+            yield fut.result()
+
+
+def generate_selenium_scripts(
+    test_cases: List[Dict[str, Any]],
+    html_text: str,
+    kb: KnowledgeBase,
+    llm: LLMProvider,
+    concurrency: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    results = list(iter_selenium_scripts(test_cases, html_text, kb, llm, concurrency=concurrency))
+    return sorted(results, key=lambda r: r["position"])
+
+
+def scripts_report(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Per-case timing/failure report for a batch."""
+    timings = [r["elapsed_s"] for r in results]
+    return {
+        "total": len(results),
+        "succeeded": sum(1 for r in results if r["ok"]),
+        "failed": sum(1 for r in results if not r["ok"]),
+        "total_elapsed_s": sum(timings),
+        "max_elapsed_s": max(timings) if timings else 0.0,
+        "paths": {p: sum(1 for r in results if r.get("path") == p) for p in ("rules", "hybrid", "partial", "llm")},
+        "cases": [
+            {"test_id": r["test_id"], "ok": r["ok"], "path": r.get("path"), "error": r["error"], "elapsed_s": r["elapsed_s"]}
+            for r in sorted(results, key=lambda r: r["position"])
+        ],
+    }
+
+
+def build_scripts_zip(results: List[Dict[str, Any]]) -> bytes:
+    """Zip one <Test_ID>.py per successful case plus report.json."""
+    buf = io.BytesIO()
+    used = set()
+    with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for r in sorted(results, key=lambda r: r["position"]):
+            if not r["ok"]:
+                continue
+            base = re.sub(r"[^A-Za-z0-9_.-]+", "_", r["test_id"]) or "test"
+            name = f"{base}.py"
+            n = 2
+            while name in used:
+                name = f"{base}_{n}.py"
+                n += 1
+            used.add(name)
+            zf.writestr(name, r["code"])
+        zf.writestr("report.json", json.dumps(scripts_report(results), indent=2))
+    return buf.getvalue()
@@ -0,0 +1,393 @@
+from typing import Any, Dict, List, Optional, Set
+import json
+import re
+
+from .selector_index import SelectorIndex
+
+
+# Rule-based Selenium synthesis: test-case steps are parsed into actions
+# (click, fill, select, assert) and matched against the selector index, so
+# routine form flows need no LLM call. Steps that cannot be parsed or matched
+# unambiguously are left for the model.
+
+_STOPWORDS = {
+    "a", "an", "the", "to", "on", "in", "into", "of", "for", "with", "and", "or", "at", "from", "by",
+    "field", "fields", "button", "btn", "input", "box", "link", "option", "radio", "page", "form",
+    "user", "that", "is", "are", "be", "should", "value", "valid", "new", "it", "its", "then",
+    "message", "text", "section", "area", "label",
+}
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_QUOTED_RE = re.compile(r"\"([^\"]*)\"|'([^']*)'|“([^”]*)”")
+_VERBS = r"(?:click|press|tap|submit|add|apply|enter|type|fill|set|select|choose|pick|check|verify|assert|ensure|confirm)"
+_STEP_SPLIT_RE = re.compile(
+    r"\s*(?:\n+|;|(?:(?<=[a-z%\"')])|(?<=\d\d))\.(?:\s+|$)|,?\s+then\s+|,?\s+and\s+(?=" + _VERBS + r"\b)|,\s*(?=" + _VERBS + r"\b))\s*",
+    re.IGNORECASE,
+)
+_NUMBERING_RE = re.compile(r"^\s*(?:\d+[.)]|[-*•]|step\s*\d+\s*[:.)-]?)\s*", re.IGNORECASE)
+
+_FILL_RES = [
+    re.compile(r"^(?:enter|type|input|put|fill(?:\s+in)?|provide)\s+(?P<value>\"[^\"]*\"|'[^']*'|\S+@\S+|\d[\d.,]*)\s+(?:in|into|as|for)\s+(?:the\s+)?(?P<target>.+)$", re.I),
+    re.compile(r"^(?:fill(?:\s+in)?|set|enter|populate)\s+(?:the\s+)?(?P<target>.+?)\s+(?:with|to|as)\s+(?P<value>.+)$", re.I),
+    re.compile(r"^(?:enter|type|input|fill(?:\s+in)?|provide|leave)\s+(?P<target>.+)$", re.I),
+]
+_APPLY_RE = re.compile(
+    r"^(?:apply|redeem|use)\s+(?:an?\s+|the\s+)?(?P<target>.*?)\s*(?P<value>\"[^\"]*\"|'[^']*'|(?-i:[A-Z][A-Z0-9]{2,}))\s*$",
+    re.I,
+)
+_SELECT_RE = re.compile(r"^(?:select|choose|pick|check|tick)\s+(?:the\s+)?(?P<target>.+)$", re.I)
+_CLICK_RE = re.compile(r"^(?:click|press|tap|hit|submit|add|apply)\s+(?:on\s+)?(?:the\s+)?(?P<target>.+)$", re.I)
+_ASSERT_VALUE_RE = re.compile(
+    r"^(?:verify|assert|check|ensure|confirm|expect)?\s*(?:that\s+)?(?:the\s+)?(?P<target>.+?)\s+"
+    r"(?:should\s+(?:be|show|display|read|equal|contain)|shows?|displays?|contains?|reads?|equals?|is|are|becomes?)\s+"
+    r"(?P<value>\"[^\"]*\"|'[^']*'|[$€£]?\d[\d.,]*)\s*$",
+    re.I,
+)
+_ASSERT_VISIBLE_RE = re.compile(
+    r"^(?:verify|assert|check|ensure|confirm|expect)?\s*(?:that\s+)?(?:an?\s+|the\s+)?(?P<target>.+?)\s+"
+    r"(?:should\s+)?(?:is\s+|are\s+|be\s+)?(?:shown|displayed|visible|appears?|is\s+present)$",
+    re.I,
+)
+
+_FILL_ROLES = {"input", "textarea"}
+_CLICK_ROLES = {"button", "link", "radio", "checkbox"}
+_SELECT_ROLES = {"select", "radio", "checkbox"}
+_ASSERT_ROLES = {"text", "input", "textarea", "select", "button", "link", "radio", "checkbox"}
+_BULK_FILL_RE = re.compile(r"\b(?:all|required|every|details|form|information|info)\b", re.I)
+_BULK_SKIP_RE = re.compile(r"code|coupon|promo|search|qty|quantity", re.I)
+
+
+def _unquote(value: str) -> str:
+    value = value.strip().rstrip(".")
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in "\"'":
+        return value[1:-1]
+    return value
+
+
+def _words(text: str) -> Set[str]:
+    return {w[:-1] if len(w) > 3 and w.endswith("s") else w for w in _WORD_RE.findall(text.lower())}
+
+
+def _content_words(text: str) -> Set[str]:
+    return _words(text) - _STOPWORDS
+
+
+def _phrase(text: str) -> str:
+    return " ".join(_WORD_RE.findall(text.lower()))
+
+
+def _element_words(e: Dict[str, Any]) -> Set[str]:
+    return _words(" ".join([e["id"], e["name"], e["label"], e["text"], e["placeholder"], e["value"]]).replace("_", " "))
+
+
+_VERB_PHRASE_RE = re.compile(r"\b(" + _VERBS + r")\s+\w", re.IGNORECASE)
+
+
+def _consumes(target: str, elements: List[Dict[str, Any]]) -> bool:
+    """
+    True when the matched elements account for the whole target. A second
+    clause or a leftover verb phrase ("PayPal, click Pay Now") means the
+    step holds more than the rule mapped.
+    """
+    covered = set().union(*(_element_words(e) for e in elements))
+    head, *tails = re.split(r"[,;]", target)
+    if any(_content_words(t) - covered for t in tails):
+        return False
+    for m in _VERB_PHRASE_RE.finditer(target):
+        if not _words(m.group(1)) <= covered and _content_words(target[m.end(1):]) - covered:
+            return False
+    return True
+
+
+def resolve_element(
+    target: str,
+    index: SelectorIndex,
+    roles: Set[str],
+    context: Optional[Set[str]] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Best element for a target phrase among the given roles, or None when no
+    element covers at least half of the target's words or the top two tie.
+    Context words (from the scenario) only break ties.
+    """
+    want = _content_words(target)
+    if not want:
+        return None
+    phrase = _phrase(target)
+    context = context or set()
+    scored = []
+    for e in index.elements:
+        if e["role"] not in roles:
+            continue
+        words = _element_words(e)
+        hit = len(want & words)
+        if not hit:
+            continue
+        # An exact label/text match tells "Widget A Quantity" from "Widget B Quantity"
+        names = [_phrase(e[k]) for k in ("label", "text", "placeholder") if e[k]]
+        if any(n and f" {n} " in f" {phrase} " and want <= _words(n) for n in names):
+            hit += len(want)
+        scored.append((hit, len(context & words), e))
+    if not scored:
+        return None
+    scored.sort(key=lambda s: (s[0], s[1]), reverse=True)
+    best = scored[0]
+    if best[0] * 2 < len(want):
+        return None
+    if len(scored) > 1 and scored[1][:2] == best[:2]:
+        return None
+    return best[2]
+
+
+def sample_value(e: Dict[str, Any], hint: str = "") -> str:
+    """Plausible input for a field, or an invalid/empty one when the step asks for it."""
+    hint = hint.lower()
+    desc = " ".join([e["id"], e["name"], e["label"], e["placeholder"], e["type"]]).lower()
+    if re.search(r"\b(?:empty|blank|leave)\b", hint):
+        return ""
+    invalid = "invalid" in hint or "wrong" in hint
+    if "email" in desc:
+        return "invalid-email" if invalid else "qa.tester@example.com"
+    if e["type"] == "number" or "qty" in desc or "quantity" in desc:
+        return "-1" if invalid else "1"
+    if "code" in desc or "coupon" in desc:
+        return "INVALID" if invalid else "SAVE15"
+    if "phone" in desc or e["type"] == "tel":
+        return "abc" if invalid else "5550100"
+    if "address" in desc:
+        return "1 Test Street"
+    if "name" in desc:
+        return "QA Tester"
+    return "test"
+
+
+def test_case_steps(test_case: Dict[str, Any]) -> List[Dict[str, str]]:
+    """
+    Raw steps of a test case as [{"text", "kind"}], kind being "action" or
+    "expect". Explicit Steps/Test_Steps win over the scenario sentence.
+    """
+    def split(value) -> List[str]:
+        if isinstance(value, list):
+            items = []
+            for v in value:
+                # {"action": "click", "target": "Pay Now", ...} reads as "click Pay Now ..."
+                items.extend(split(" ".join(str(x) for x in v.values()) if isinstance(v, dict) else v))
+            return items
+        if not isinstance(value, str):
+            return []
+        parts = [_NUMBERING_RE.sub("", p).strip() for p in _STEP_SPLIT_RE.split(value)]
+        return [p for p in parts if p]
+
+    steps = test_case.get("Steps") or test_case.get("Test_Steps") or test_case.get("steps")
+    if not steps:
+        steps = test_case.get("Test_Scenario") or test_case.get("test_scenario") or ""
+    expected = test_case.get("Expected_Result") or test_case.get("expected_result") or ""
+    out = [{"text": s, "kind": "action"} for s in split(steps)]
+    out += [{"text": s, "kind": "expect"} for s in split(expected)]
+    return out
+
+
+def _parse_action(text: str, index: SelectorIndex, context: Set[str]) -> List[Dict[str, Any]]:
+    m = _APPLY_RE.match(text)
+    if m:
+        field = resolve_element(m.group("target") or "code", index, _FILL_ROLES, context)
+        button = resolve_element("apply " + (m.group("target") or ""), index, {"button"}, context) or resolve_element("apply", index, {"button"})
+        if field and button and _consumes(m.group("target"), [field, button]):
+            return [
+                {"action": "fill", "element": field, "value": _unquote(m.group("value"))},
+                {"action": "click", "element": button},
+            ]
+    for rx in _FILL_RES:
+        m = rx.match(text)
+        if not m:
+            continue
+        target = m.group("target")
+        if rx is _FILL_RES[2] and _BULK_FILL_RE.search(target):
+            fields = [
+                e for e in index.elements
+                if e["role"] in _FILL_ROLES and e["type"] in {"", "text", "email", "tel"} and e["label"]
+                and not _BULK_SKIP_RE.search(" ".join([e["id"], e["name"], e["label"]]))
+            ]
+            if fields:
+                if not _consumes(_BULK_FILL_RE.sub(" ", target), fields):
+                    return []
+                return [{"action": "fill", "element": e, "value": sample_value(e, text)} for e in fields]
+        element = resolve_element(target, index, _FILL_ROLES | {"select"}, context)
+        if element is None:
+            continue
+        if not _consumes(target, [element]):
+            return []
+        value = _unquote(m.group("value")) if "value" in m.groupdict() else sample_value(element, text)
+        return [{"action": "select" if element["role"] == "select" else "fill", "element": element, "value": value}]
+    m = _SELECT_RE.match(text)
+    if m:
+        element = resolve_element(m.group("target"), index, _SELECT_ROLES, context)
+        if element is None:
+            # "Select Express shipping" may also name an option of a <select>
+            quoted = _QUOTED_RE.search(text)
+            element = resolve_element(m.group("target"), index, {"select"}, context) if quoted else None
+            if element is not None and _consumes(_QUOTED_RE.sub(" ", m.group("target")), [element]):
+                return [{"action": "select", "element": element, "value": next(g for g in quoted.groups() if g is not None)}]
+        elif _consumes(m.group("target"), [element]):
+            return [{"action": "click", "element": element}]
+    m = _CLICK_RE.match(text)
+    if m:
+        element = resolve_element(m.group("target"), index, _CLICK_ROLES, context)
+        if element is not None and _consumes(m.group("target"), [element]):
+            return [{"action": "click", "element": element}]
+    return []
+
+
+def _parse_expect(text: str, index: SelectorIndex, context: Set[str]) -> List[Dict[str, Any]]:
+    m = _ASSERT_VALUE_RE.match(text)
+    if m:
+        value = _unquote(m.group("value")).lstrip("$€£")
+        element = resolve_element(m.group("target"), index, _ASSERT_ROLES, context)
+        if element is not None:
+            return [{"action": "assert_text", "element": element, "value": value}]
+    quoted = _QUOTED_RE.search(text)
+    if quoted:
+        value = next(g for g in quoted.groups() if g is not None)
+        rest = _QUOTED_RE.sub(" ", text)
+        element = resolve_element(rest, index, _ASSERT_ROLES, context)
+        # Without a matching element the text is still checked against the page body
+        return [{"action": "assert_text", "element": element, "value": value}]
+    m = _ASSERT_VISIBLE_RE.match(text)
+    if m:
+        element = resolve_element(m.group("target"), index, _ASSERT_ROLES, context)
+        if element is not None:
+            return [{"action": "assert_visible", "element": element}]
+    return []
+
+
+def plan_steps(test_case: Dict[str, Any], index: SelectorIndex) -> List[Dict[str, Any]]:
+    """
+    Map each step onto concrete actions: [{"text", "kind", "actions"}].
+    A step with no actions is unresolved and left for the LLM.
+    """
+    raw = test_case_steps(test_case)
+    context = _content_words(" ".join([str(test_case.get("Feature") or "")] + [s["text"] for s in raw]))
+    planned = []
+    for step in raw:
+        parse = _parse_action if step["kind"] == "action" else _parse_expect
+        actions = parse(step["text"], index, context)
+        if not actions and step["kind"] == "action":
+            # Scenarios sometimes phrase checks as actions ("Verify the total shows 10.00")
+            actions = _parse_expect(step["text"], index, context)
+        planned.append({**step, "actions": actions})
+    return planned
+
+
+def _locator(e: Optional[Dict[str, Any]]) -> str:
+    if e is None:
+        return "(By.TAG_NAME, \"body\")"
+    if e["id"]:
+        return f"(By.ID, {json.dumps(e['id'])})"
+    return f"(By.CSS_SELECTOR, {json.dumps(e['css'])})"
+
+
+def render_action(a: Dict[str, Any]) -> List[str]:
+    loc = _locator(a.get("element"))
+    value = json.dumps(a.get("value", ""))
+    if a["action"] == "fill":
+        return [
+            f"field = wait.until(EC.presence_of_element_located({loc}))",
+            "field.clear()",
+            f"field.send_keys({value})" if a.get("value") else "field.send_keys(Keys.TAB)",
+        ]
+    if a["action"] == "select":
+        return [f"Select(wait.until(EC.presence_of_element_located({loc}))).select_by_visible_text({value})"]
+    if a["action"] == "click":
+        return [f"wait.until(EC.element_to_be_clickable({loc})).click()"]
+    if a["action"] == "assert_text":
+        return [
+            f"wait.until(EC.text_to_be_present_in_element({loc}, {value}))",
+            f"assert {value} in driver.find_element(*{loc}).text",
+        ]
+    if a["action"] == "assert_visible":
+        lines = [f"assert wait.until(EC.visibility_of_element_located({loc})).is_displayed()"]
+        if a["element"]["role"] == "text":
+            # Message containers exist up front; wait until something is written into them
+            lines.append(f"wait.until(lambda d: d.find_element(*{loc}).text.strip())")
+        return lines
+    raise ValueError(f"Unknown action {a['action']!r}")
+
+
+def render_script(url: str, planned: List[Dict[str, Any]], snippets: Optional[Dict[int, str]] = None) -> str:
+    """
+    Assemble the script. snippets maps a step position to LLM-written code
+    for that step; unresolved steps without one become TODO comments.
+    """
+    snippets = snippets or {}
+    lines = [
+        "from selenium import webdriver",
+        "from selenium.webdriver.common.by import By",
+        "from selenium.webdriver.common.keys import Keys",
+        "from selenium.webdriver.support.ui import Select, WebDriverWait",
+        "from selenium.webdriver.support import expected_conditions as EC",
+        "",
+        "driver = webdriver.Chrome()",
+        "wait = WebDriverWait(driver, 10)",
+        "",
+        "try:",
+        f"    driver.get({json.dumps(url)})",
+    ]
+    for i, step in enumerate(planned):
+        lines.append("")
+        lines.append(f"    # Step {i + 1}: {' '.join(step['text'].split())}")
+        if step["actions"]:
+            body = [line for a in step["actions"] for line in render_action(a)]
+        elif snippets.get(i, "").strip():
+            body = snippets[i].strip("\n").splitlines()
+        else:
+            body = ["# TODO: could not map this step onto the page; implement it manually"]
+        lines.extend(f"    {line}" if line.strip() else "" for line in body)
+    lines += ["finally:", "    driver.quit()", ""]
+    return "\n".join(lines)
+
+
+def missing_steps(planned: List[Dict[str, Any]], snippets: Optional[Dict[int, str]] = None) -> List[str]:
+    """Steps neither the rules nor the LLM covered; render_script leaves TODOs for them."""
+    snippets = snippets or {}
+    return [s["text"] for i, s in enumerate(planned) if not s["actions"] and not snippets.get(i, "").strip()]
+
+
+def unresolved_prompt(planned: List[Dict[str, Any]], index: SelectorIndex, url: str) -> str:
+    """Ask only for the steps the rules could not map, one marked block per step."""
+    todo = [f"# Step {i + 1}: {s['text']}" for i, s in enumerate(planned) if not s["actions"]]
+    return (
+        f"A Selenium (Python) script for {url} already defines `driver`, `wait` (WebDriverWait), "
+        "`By`, `EC`, `Select` and `Keys`, and has opened the page. Write only the statements "
+        "for the steps below, in order, without imports, driver setup or driver.quit(). "
+        "Start each step's code with its '# Step N:' comment line exactly as given.\n"
+        f"{index.describe()}\n"
+        "Steps:\n" + "\n".join(todo)
+    )
+
+
+def split_snippets(llm_out: str, planned: List[Dict[str, Any]]) -> Dict[int, str]:
+    """Cut the model's reply into per-step code keyed by step position."""
+    code = llm_out
+    if "```" in code:
+        blocks = code.split("```")[1::2]
+        code = "\n".join(b.split("\n", 1)[1] if b.lower().startswith("python") else b for b in blocks)
+    positions = [i for i, s in enumerate(planned) if not s["actions"]]
+    if not positions:
+        return {}
+    marker = re.compile(r"^\s*#\s*Step\s+(\d+)\b.*$", re.I | re.M)
+    found = list(marker.finditer(code))
+    if not found:
+        # No markers: keep the whole reply at the first unresolved step
+        return {positions[0]: code}
+    snippets: Dict[int, str] = {}
+    for m, nxt in zip(found, found[1:] + [None]):
+        pos = int(m.group(1)) - 1
+        if pos in positions:
+            body = code[m.end():nxt.start() if nxt else len(code)]
+            snippets[pos] = snippets.get(pos, "") + body
+    return {pos: _dedent(body) for pos, body in snippets.items()}
+
+
+def _dedent(code: str) -> str:
+    lines = [line.rstrip() for line in code.strip("\n").splitlines()]
+    indent = min((len(line) - len(line.lstrip()) for line in lines if line.strip()), default=0)
+    return "\n".join(line[indent:] for line in lines)
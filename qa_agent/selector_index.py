@@ -0,0 +1,200 @@
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional
+import hashlib
+import json
+import os
+import threading
+
+from bs4 import BeautifulSoup
+
+
+SELECTOR_INDEX_VERSION = 1
+FORM_TAGS = {"input", "select", "textarea", "button"}
+
+
+def _role(el) -> str:
+    tag = el.name
+    typ = (el.get("type") or "").lower()
+    if tag == "button" or (tag == "input" and typ in {"button", "submit", "reset"}):
+        return "button"
+    if tag == "input" and typ in {"radio", "checkbox"}:
+        return typ
+    if tag == "input":
+        return "input"
+    if tag in {"select", "textarea"}:
+        return tag
+    if tag == "a":
+        return "link"
+    return "text"
+
+
+def _label_for(el, labels_by_for: Dict[str, str]) -> str:
+    el_id = el.get("id")
+    if el_id and el_id in labels_by_for:
+        return labels_by_for[el_id]
+    wrapping = el.find_parent("label")
+    if wrapping is not None:
+        return wrapping.get_text(" ", strip=True)
+    return el.get("aria-label") or ""
+
+
+def _css_path(el) -> str:
+    """Shortest stable selector: #id, then tag[name=...], else a path anchored at the nearest id."""
+    if el.get("id"):
+        return f"#{el['id']}"
+    if el.get("name"):
+        sel = f"{el.name}[name='{el['name']}']"
+        if el.get("value") is not None and (el.get("type") or "").lower() in {"radio", "checkbox"}:
+            sel += f"[value='{el['value']}']"
+        return sel
+    steps = []
+    node = el
+    while node is not None and node.name not in (None, "[document]", "html"):
+        if node.get("id"):
+            steps.append(f"#{node['id']}")
+            break
+        siblings = [s for s in node.parent.find_all(node.name, recursive=False)] if node.parent else [node]
+        steps.append(f"{node.name}:nth-of-type({siblings.index(node) + 1})" if len(siblings) > 1 else node.name)
+        node = node.parent
+    return " > ".join(reversed(steps))
+
+
+def build_selector_index(soup: BeautifulSoup) -> Dict[str, Any]:
+    """Collect every element with an id or name plus all form controls and links."""
+    labels_by_for = {
+        lab.get("for"): lab.get_text(" ", strip=True)
+        for lab in soup.find_all("label")
+        if lab.get("for")
+    }
+    elements = []
+    for el in soup.find_all(True):
+        if el.name in {"meta", "script", "style", "link"}:
+            continue
+        if not (el.get("id") or el.get("name") or el.name in FORM_TAGS or (el.name == "a" and el.get("href"))):
+            continue
+        elements.append({
+            "tag": el.name,
+            "id": el.get("id") or "",
+            "name": el.get("name") or "",
+            "type": (el.get("type") or "").lower(),
+            "role": _role(el),
+            "label": _label_for(el, labels_by_for),
+            "text": el.get_text(" ", strip=True)[:120] if el.name in {"button", "a", "span", "div", "h1", "h2", "h3"} else "",
+            "placeholder": el.get("placeholder") or "",
+            "value": el.get("value") or "",
+            "css": _css_path(el),
+        })
+    return {"version": SELECTOR_INDEX_VERSION, "elements": elements}
+
+
+class SelectorIndex:
+    def __init__(self, data: Dict[str, Any], content_hash: str = ""):
+        self.content_hash = content_hash
+        self.elements: List[Dict[str, Any]] = data.get("elements", [])
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"version": SELECTOR_INDEX_VERSION, "content_hash": self.content_hash, "elements": self.elements}
+
+    def ids(self) -> List[str]:
+        return [e["id"] for e in self.elements if e["id"]]
+
+    def names(self) -> List[str]:
+        return list(dict.fromkeys(e["name"] for e in self.elements if e["name"]))
+
+    def by_id(self, element_id: str) -> Optional[Dict[str, Any]]:
+        return next((e for e in self.elements if e["id"] == element_id), None)
+
+    def form_fields(self) -> List[Dict[str, Any]]:
+        return [e for e in self.elements if e["role"] in {"input", "select", "textarea", "radio", "checkbox"}]
+
+    def buttons(self) -> List[Dict[str, Any]]:
+        return [e for e in self.elements if e["role"] == "button"]
+
+    def search(self, query: str, limit: int = 8) -> List[Dict[str, Any]]:
+        """Rank elements by word overlap between the query and id/name/label/text/placeholder."""
+        words = {w for w in query.lower().replace("_", " ").replace("-", " ").split() if len(w) > 2}
+        scored = []
+        for e in self.elements:
+            hay = " ".join([e["id"], e["name"], e["label"], e["text"], e["placeholder"]]).lower()
+            hay = hay.replace("_", " ").replace("-", " ")
+            score = sum(1 for w in words if w in hay)
+            if score:
+                scored.append((score, e))
+        scored.sort(key=lambda se: se[0], reverse=True)
+        return [e for _, e in scored[:limit]]
+
+    def describe(self) -> str:
+        """Compact prompt context: ids, form fields and buttons with their labels."""
+        def fmt(e):
+            kind = f"{e['tag']}[type={e['type']}]" if e["type"] else e["tag"]
+            label = e["label"] or e["text"] or e["placeholder"]
+            return f"{e['css']} ({kind}{', ' + repr(label) if label else ''})"
+        lines = [f"HTML IDs available: {', '.join(self.ids())}"]
+        fields = self.form_fields()
+        if fields:
+            lines.append("Form fields: " + "; ".join(fmt(e) for e in fields))
+        buttons = self.buttons()
+        if buttons:
+            lines.append("Buttons: " + "; ".join(fmt(e) for e in buttons))
+        return "\n".join(lines)
+
+
+# Memoized per HTML content hash so repeated script requests never re-parse
+_MEMO: "OrderedDict[str, SelectorIndex]" = OrderedDict()
+_MEMO_LOCK = threading.Lock()
+_MEMO_SIZE = 32
+
+
+def html_hash(html) -> str:
+    if isinstance(html, str):
+        html = html.encode("utf-8")
+    return hashlib.sha256(html).hexdigest()
+
+
+def remember(index: SelectorIndex):
+    with _MEMO_LOCK:
+        _MEMO[index.content_hash] = index
+        _MEMO.move_to_end(index.content_hash)
+        while len(_MEMO) > _MEMO_SIZE:
+            _MEMO.popitem(last=False)
+
+
+def selector_index_for_html(html: str) -> SelectorIndex:
+    key = html_hash(html)
+    with _MEMO_LOCK:
+        hit = _MEMO.get(key)
+        if hit is not None:
+            _MEMO.move_to_end(key)
+            return hit
+    index = SelectorIndex(build_selector_index(BeautifulSoup(html, "lxml")), content_hash=key)
+    remember(index)
+    return index
+
+
+def save_selector_index(index: SelectorIndex, directory: str):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{index.content_hash}.json")
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(index.to_dict(), f)
+    os.replace(tmp, path)
+
+
+def load_selector_index(directory: str, content_hash: str) -> Optional[SelectorIndex]:
+    with _MEMO_LOCK:
+        hit = _MEMO.get(content_hash)
+    if hit is not None:
+        return hit
+    path = os.path.join(directory, f"{content_hash}.json")
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception:
+        return None
+    if data.get("version") != SELECTOR_INDEX_VERSION:
+        return None
+    index = SelectorIndex(data, content_hash=content_hash)
+    remember(index)
+    return index
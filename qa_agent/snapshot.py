@@ -0,0 +1,361 @@
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import zipfile
+
+import numpy as np
+
+from . import metrics
+from .selector_index import SelectorIndex
+
+
+# A snapshot is a zip holding everything a KnowledgeBase serves from:
+#   snapshot.json   header: format version, embedder id, dim, row count,
+#                   content checksum and the sha256 of every other member
+#   chunks.jsonl    {"id", "text", "metadata"} per row, sorted by id
+#   embeddings.f32  row-major little-endian float32 [count, dim], stored
+#                   uncompressed so it can be memory-mapped from the zip
+#   manifest.json   document/chunk hashes, headings, kb_version
+#   lexical.json    BM25 index
+#   selectors/      checkout HTML and its selector index
+SNAPSHOT_FORMAT = "qa-kb-snapshot"
+SNAPSHOT_VERSION = 1
+_BLOCK = 1 << 20
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def _batch_size() -> int:
+    return int(os.getenv("SNAPSHOT_BATCH_SIZE", "1000"))
+
+
+def _row_bytes(chunk_id: str, text: str, metadata: Dict[str, Any]) -> bytes:
+    return json.dumps([chunk_id, text, metadata], sort_keys=True, ensure_ascii=False).encode("utf-8")
+
+
+class _Checksum:
+    """
+    sha256 over the embedder and dim, then every (id, text, metadata) row in
+    id order. Vectors are left out: Chroma normalizes cosine vectors on
+    insert, so they come back equal only within float32 rounding. They are
+    covered by the embeddings.f32 sha256 and compared with a tolerance.
+    """
+
+    def __init__(self, embedder: str, dim: int):
+        self._h = hashlib.sha256(json.dumps([SNAPSHOT_FORMAT, embedder, dim]).encode("utf-8"))
+
+    def add(self, chunk_id: str, text: str, metadata: Dict[str, Any]):
+        self._h.update(_row_bytes(chunk_id, text, metadata))
+
+    def hexdigest(self) -> str:
+        return self._h.hexdigest()
+
+
+def _iter_rows(collection, batch_size: int) -> Iterator[Tuple[str, str, Dict[str, Any], np.ndarray]]:
+    ids = sorted(collection.get(include=[])["ids"])
+    for i in range(0, len(ids), batch_size):
+        batch = ids[i:i + batch_size]
+        res = collection.get(ids=batch, include=["documents", "metadatas", "embeddings"])
+        by_id = {cid: (d, m or {}, e) for cid, d, m, e in zip(res["ids"], res["documents"], res["metadatas"], res["embeddings"])}
+        for cid in batch:
+            doc, meta, emb = by_id[cid]
+            yield cid, doc, meta, np.asarray(emb, dtype="<f4")
+
+
+def index_checksum(kb, batch_size: Optional[int] = None) -> Dict[str, Any]:
+    """Checksum of what a KnowledgeBase currently serves; equal to the snapshot's after an import."""
+    store = kb.store
+    checksum = None
+    count = 0
+    for cid, doc, meta, vec in _iter_rows(store.collection, batch_size or _batch_size()):
+        if checksum is None:
+            checksum = _Checksum(store.embedder.id, len(vec))
+        checksum.add(cid, doc, meta)
+        count += 1
+    if checksum is None:
+        checksum = _Checksum(store.embedder.id, 0)
+    return {"checksum": checksum.hexdigest(), "chunks": count, "embedder": store.embedder.id}
+
+
+def _file_sha256(fileobj) -> str:
+    h = hashlib.sha256()
+    for block in iter(lambda: fileobj.read(_BLOCK), b""):
+        h.update(block)
+    return h.hexdigest()
+
+
+def export_snapshot(kb, path: str, batch_size: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Write kb to a snapshot zip at path (atomically replaced). Embeddings are
+    read back from the store, so the export never runs the encoder.
+    """
+    started = time.perf_counter()
+    batch_size = batch_size or _batch_size()
+    store = kb.store
+    store.flush()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_zip = f"{path}.tmp"
+    files: Dict[str, str] = {}
+    count = 0
+    dim = 0
+    checksum: Optional[_Checksum] = None
+    with tempfile.TemporaryDirectory(prefix="qa-snapshot-") as work, metrics.span("snapshot_export"):
+        vectors_path = os.path.join(work, "embeddings.f32")
+        with zipfile.ZipFile(tmp_zip, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+            chunks_hash = hashlib.sha256()
+            vectors_hash = hashlib.sha256()
+            with zf.open("chunks.jsonl", "w", force_zip64=True) as chunks, open(vectors_path, "wb") as vectors:
+                for cid, doc, meta, vec in _iter_rows(store.collection, batch_size):
+                    if checksum is None:
+                        dim = len(vec)
+                        checksum = _Checksum(store.embedder.id, dim)
+                    checksum.add(cid, doc, meta)
+                    line = json.dumps({"id": cid, "text": doc, "metadata": meta}, ensure_ascii=False).encode("utf-8") + b"\n"
+                    chunks.write(line)
+                    chunks_hash.update(line)
+                    raw = vec.tobytes()
+                    vectors.write(raw)
+                    vectors_hash.update(raw)
+                    count += 1
+            files["chunks.jsonl"] = chunks_hash.hexdigest()
+            files["embeddings.f32"] = vectors_hash.hexdigest()
+            zf.write(vectors_path, "embeddings.f32", compress_type=zipfile.ZIP_STORED)
+
+            def put(name: str, data: bytes):
+                zf.writestr(name, data)
+                files[name] = hashlib.sha256(data).hexdigest()
+
+            put("manifest.json", json.dumps({
+                "kb_version": kb.manifest.kb_version,
+                "documents": kb.manifest.documents,
+            }).encode("utf-8"))
+            if store.lexical.exists():
+                with open(store.lexical.path, "rb") as f:
+                    put("lexical.json", f.read())
+            html = kb.get_html()
+            index = kb.get_selector_index()
+            html_entry = kb.manifest.get("html")
+            if html is not None and html_entry:
+                put(f"selectors/{html_entry['doc_hash']}.html", html.encode("utf-8"))
+                if index is not None:
+                    put(f"selectors/{html_entry['doc_hash']}.json", json.dumps(index.to_dict()).encode("utf-8"))
+            header = {
+                "format": SNAPSHOT_FORMAT,
+                "version": SNAPSHOT_VERSION,
+                "created": time.time(),
+                "embedder": store.embedder.id,
+                "dim": dim,
+                "count": count,
+                "dtype": "<f4",
+                "checksum": (checksum or _Checksum(store.embedder.id, 0)).hexdigest(),
+                "files": files,
+            }
+            zf.writestr("snapshot.json", json.dumps(header, indent=2))
+    os.replace(tmp_zip, path)
+    return {
+        "path": path,
+        "bytes": os.path.getsize(path),
+        "chunks": count,
+        "embedder": header["embedder"],
+        "checksum": header["checksum"],
+        "elapsed_s": time.perf_counter() - started,
+    }
+
+
+def read_header(zf: zipfile.ZipFile) -> Dict[str, Any]:
+    try:
+        header = json.loads(zf.read("snapshot.json"))
+    except KeyError:
+        raise SnapshotError("Not a knowledge base snapshot: snapshot.json is missing")
+    if header.get("format") != SNAPSHOT_FORMAT:
+        raise SnapshotError(f"Not a knowledge base snapshot: format {header.get('format')!r}")
+    if header.get("version") != SNAPSHOT_VERSION:
+        raise SnapshotError(f"Unsupported snapshot version {header.get('version')!r}; expected {SNAPSHOT_VERSION}")
+    return header
+
+
+def _verify_files(zf: zipfile.ZipFile, header: Dict[str, Any]):
+    for name, expected in header["files"].items():
+        try:
+            with zf.open(name) as f:
+                actual = _file_sha256(f)
+        except KeyError:
+            raise SnapshotError(f"Snapshot member {name} is missing")
+        except zipfile.BadZipFile as e:
+            raise SnapshotError(f"Snapshot member {name} is corrupt ({e})")
+        if actual != expected:
+            raise SnapshotError(f"Snapshot member {name} is corrupt (sha256 mismatch)")
+
+
+def _member_offset(path: str, info: zipfile.ZipInfo) -> int:
+    # Data starts after the local file header: 30 fixed bytes, then name and extra field
+    with open(path, "rb") as f:
+        f.seek(info.header_offset)
+        local = f.read(30)
+    if local[:4] != b"PK\x03\x04":
+        raise SnapshotError(f"Bad local header for {info.filename}")
+    name_len, extra_len = struct.unpack("<HH", local[26:30])
+    return info.header_offset + 30 + name_len + extra_len
+
+
+def load_embeddings(path: str, zf: zipfile.ZipFile, header: Dict[str, Any]) -> np.ndarray:
+    """The [count, dim] float32 block, memory-mapped straight from the zip when stored uncompressed."""
+    count, dim = int(header["count"]), int(header["dim"])
+    if not count:
+        return np.zeros((0, dim), dtype="<f4")
+    info = zf.getinfo("embeddings.f32")
+    if info.file_size != count * dim * 4:
+        raise SnapshotError("embeddings.f32 does not match the header's count and dim")
+    if info.compress_type == zipfile.ZIP_STORED:
+        return np.memmap(path, dtype="<f4", mode="r", offset=_member_offset(path, info), shape=(count, dim))
+    return np.frombuffer(zf.read(info), dtype="<f4").reshape(count, dim)
+
+
+def _iter_batches(zf: zipfile.ZipFile, vectors: np.ndarray, batch_size: int):
+    with zf.open("chunks.jsonl") as f:
+        ids: List[str] = []
+        docs: List[str] = []
+        metadatas: List[Dict[str, Any]] = []
+        row = 0
+        for line in f:
+            item = json.loads(line)
+            ids.append(item["id"])
+            docs.append(item["text"])
+            metadatas.append(item["metadata"] or None)
+            if len(ids) == batch_size:
+                yield ids, docs, metadatas, vectors[row:row + len(ids)].tolist()
+                row += len(ids)
+                ids, docs, metadatas = [], [], []
+        if ids:
+            yield ids, docs, metadatas, vectors[row:row + len(ids)].tolist()
+            row += len(ids)
+    if row != len(vectors):
+        raise SnapshotError(f"chunks.jsonl has {row} rows but embeddings.f32 has {len(vectors)}")
+
+
+def import_snapshot(kb, path: str, verify: bool = True, batch_size: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Replace kb's chunks, embeddings, lexical index, manifest and HTML/selector
+    state with a snapshot's. Vectors are bulk-loaded as stored, so the encoder
+    never runs. The snapshot must come from the same embedder. With verify,
+    the loaded collection is re-read and must match the snapshot before it
+    replaces the current one; on a mismatch nothing is changed.
+    """
+    started = time.perf_counter()
+    batch_size = batch_size or _batch_size()
+    store = kb.store
+    try:
+        archive = zipfile.ZipFile(path)
+    except zipfile.BadZipFile as e:
+        raise SnapshotError(f"Not a knowledge base snapshot: {e}")
+    with archive as zf, metrics.span("snapshot_import"):
+        header = read_header(zf)
+        if header["embedder"] != store.embedder.id:
+            raise SnapshotError(
+                f"Snapshot was embedded with {header['embedder']!r} but this node uses {store.embedder.id!r}; "
+                "set EMBEDDING_BACKEND/EMBEDDING_MODEL to match or rebuild the knowledge base"
+            )
+        _verify_files(zf, header)
+        vectors = load_embeddings(path, zf, header)
+        # Checked on the staged collection, so a mismatch never replaces what is being served
+        check = (lambda new: _verify_index(new, store.embedder.id, header, vectors, batch_size)) if verify else None
+        store.replace_all(_iter_batches(zf, vectors, batch_size), check=check)
+
+        if "lexical.json" in header["files"]:
+            with zf.open("lexical.json") as src, open(f"{store.lexical.path}.tmp", "wb") as dst:
+                shutil.copyfileobj(src, dst, _BLOCK)
+            os.replace(f"{store.lexical.path}.tmp", store.lexical.path)
+            store.reload_lexical()
+        else:
+            store.lexical.clear()
+            with zf.open("chunks.jsonl") as f:
+                for line in f:
+                    item = json.loads(line)
+                    store.lexical.upsert([item["id"]], [item["text"]])
+            store.lexical.save()
+
+        saved = json.loads(zf.read("manifest.json"))
+        # Newer than anything served before, so cached responses are never reused
+        kb.manifest.documents = saved["documents"]
+        kb.manifest.kb_version = max(kb.manifest.kb_version + 1, int(saved.get("kb_version", 0)))
+        kb.manifest.save()
+        kb.response_cache.invalidate(kb.version)
+
+        html_entry = kb.manifest.get("html")
+        html_name = f"selectors/{html_entry['doc_hash']}.html" if html_entry else None
+        if html_name in header["files"]:
+            kb._set_html(zf.read(html_name).decode("utf-8"), html_entry["filename"], html_entry["doc_hash"])
+            index_name = f"selectors/{html_entry['doc_hash']}.json"
+            if index_name in header["files"]:
+                kb._set_selector_index(SelectorIndex(json.loads(zf.read(index_name)), content_hash=html_entry["doc_hash"]))
+        else:
+            kb._html_content = kb._html_filename = kb._html_hash = None
+            kb._selector_index = None
+        store.flush()
+        del vectors
+
+    return {
+        "chunks": int(header["count"]),
+        "embedder": header["embedder"],
+        "checksum": header["checksum"],
+        "kb_version": kb.version,
+        "verified": verify,
+        "elapsed_s": time.perf_counter() - started,
+    }
+
+
+def _verify_index(collection, embedder: str, header: Dict[str, Any], vectors: np.ndarray, batch_size: int):
+    """Re-read a loaded collection: rows must hash to the snapshot checksum and vectors match within float tolerance."""
+    checksum = _Checksum(embedder, int(header["dim"]))
+    row = 0
+    for cid, doc, meta, vec in _iter_rows(collection, batch_size):
+        if row >= len(vectors) or not np.allclose(vec, vectors[row], rtol=1e-5, atol=1e-6):
+            raise SnapshotError(f"Imported vector for {cid} does not match the snapshot")
+        checksum.add(cid, doc, meta)
+        row += 1
+    if row != int(header["count"]) or checksum.hexdigest() != header["checksum"]:
+        raise SnapshotError("Imported index does not match the snapshot checksum")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from .projects import DEFAULT_PROJECT, ProjectPool
+
+    parser = argparse.ArgumentParser(description="Export or import a knowledge base snapshot.")
+    parser.add_argument("command", choices=["export", "import", "checksum"])
+    parser.add_argument("path", nargs="?", help="snapshot zip (not needed for checksum)")
+    parser.add_argument("--project", default=DEFAULT_PROJECT)
+    parser.add_argument("--no-verify", action="store_true", help="skip re-reading the imported index")
+    args = parser.parse_args(argv)
+    if args.command != "checksum" and not args.path:
+        parser.error("path is required")
+
+    pool = ProjectPool()
+    try:
+        if args.command == "export":
+            report = pool.export_snapshot(args.project, args.path)
+        elif args.command == "import":
+            report = pool.import_snapshot(args.project, args.path, verify=not args.no_verify)
+        else:
+            with pool.lease(args.project) as kb:
+                report = index_checksum(kb)
+    except SnapshotError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        pool.close()
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
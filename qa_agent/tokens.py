@@ -0,0 +1,32 @@
+import math
+import re
+
+
+_PIECE_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def count_tokens(text: str) -> int:
+    """
+    Cheap, model-agnostic token estimate: one token per punctuation mark and
+    roughly one per four characters of each word (close to BPE tokenizers on
+    English prose and identifiers, without loading one).
+    """
+    total = 0
+    for piece in _PIECE_RE.findall(text):
+        total += max(1, math.ceil(len(piece) / 4)) if piece[0].isalnum() or piece[0] == "_" else 1
+    return total
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text at a whitespace boundary so that count_tokens(result) <= max_tokens."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    out = []
+    used = 0
+    for word in re.split(r"(\s+)", text):
+        cost = count_tokens(word)
+        if used + cost > max_tokens:
+            break
+        out.append(word)
+        used += cost
+    return "".join(out).rstrip()
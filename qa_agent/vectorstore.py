@@ -1,47 +1,249 @@
-from typing import List, Dict, Any
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 import os
 
-import chromadb
-from chromadb.utils import embedding_functions
+from . import metrics
+from .lexical_index import LexicalIndex
+from .embedders import EMBEDDING_MODEL
+from .resources import shared_chroma_client, shared_embedding_function
+
+
+def _clean_metadata(meta: Dict[str, Any]) -> Dict[str, Any]:
+    # Chroma only accepts scalar metadata values; flatten lists and drop the rest
+    out: Dict[str, Any] = {}
+    for k, v in meta.items():
+        if isinstance(v, (str, int, float, bool)):
+            out[k] = v
+        elif isinstance(v, (list, tuple)):
+            out[k] = ", ".join(str(x) for x in v)
+    return out
 
 
 class VectorStore:
-    def __init__(self, persist_dir: str = "data/chroma", collection_name: str = "knowledgebase"):
+    def __init__(
+        self,
+        persist_dir: str = "data/chroma",
+        collection_name: str = "knowledgebase",
+        cache_dir: Optional[str] = None,
+        state_dir: Optional[str] = None,
+    ):
         os.makedirs(persist_dir, exist_ok=True)
+        self.persist_dir = persist_dir
         # Sanitize name to meet Chroma index naming rules (lowercase alphanumerics, start with letter)
         safe_name = ''.join(ch for ch in collection_name.lower() if ch.isalnum())
         if not safe_name or not safe_name[0].isalpha():
             safe_name = f"kb{safe_name or 'default'}"
-        self.client = chromadb.PersistentClient(path=persist_dir)
-        self.collection = self.client.get_or_create_collection(
-            name=safe_name,
-            metadata={"hnsw:space": "cosine"},
-            embedding_function=embedding_functions.SentenceTransformerEmbeddingFunction(
-                model_name="sentence-transformers/all-MiniLM-L6-v2"
-            ),
+        self.collection_name = safe_name
+        # Model, embedding cache and client are process-wide; the model loads on first embed
+        self.embedding_function = shared_embedding_function(cache_dir)
+        self.embedding_cache = self.embedding_function.cache
+        self.embedder = self.embedding_function.base
+        self.client = shared_chroma_client(persist_dir)
+        # Set to {"from", "to", "chunks"} when opening switched the collection to a new embedder
+        self.reindexed: Optional[Dict[str, Any]] = None
+        self.collection = self._open_collection()
+        self._dim: Optional[int] = None
+        # BM25 index over the same chunks; loaded on first use
+        self.lexical = LexicalIndex(os.path.join(state_dir or persist_dir, f"{safe_name}.bm25.json"))
+
+    def _collection_metadata(self) -> Dict[str, Any]:
+        return {"hnsw:space": "cosine", "embedder": self.embedder.id}
+
+    def _open_collection(self):
+        collection = self.client.get_or_create_collection(
+            name=self.collection_name,
+            metadata=self._collection_metadata(),
+            embedding_function=self.embedding_function,
         )
+        # Collections that predate the embedder tag were built with the default model
+        stored = (collection.metadata or {}).get("embedder", EMBEDDING_MODEL)
+        if stored == self.embedder.id:
+            return collection
+        # Never mix vector spaces in one collection: re-embed everything with the new embedder
+        new, copied = self._rebuild(collection, keep_embeddings=False)
+        self.reindexed = {"from": stored, "to": self.embedder.id, "chunks": copied}
+        return new
 
-    def add_chunks(self, chunks: List[Dict[str, Any]]):
+    def _swap_in(self, fill: Callable[[Any], int]):
+        """
+        Fill a fresh collection with fill(new), which returns the rows written,
+        then swap it in under the same name.
+        """
+        tmp_name = f"{self.collection_name}reindex"
+        try:
+            self.client.delete_collection(tmp_name)
+        except Exception:
+            pass  # no leftover from an interrupted re-index
+        new = self.client.create_collection(
+            name=tmp_name,
+            metadata=self._collection_metadata(),
+            embedding_function=self.embedding_function,
+        )
+        try:
+            written = fill(new)
+        except BaseException:
+            # The old collection is untouched until the copy is complete
+            self.client.delete_collection(tmp_name)
+            raise
+        self.client.delete_collection(self.collection_name)
+        new.modify(name=self.collection_name)
+        return new, written
+
+    def _rebuild(self, old, keep_embeddings: bool, batch_size: int = 256):
+        """Copy every stored chunk into a fresh collection; stored embeddings are either kept or re-encoded."""
+        include = ["documents", "metadatas", "embeddings"] if keep_embeddings else ["documents", "metadatas"]
+
+        def fill(new) -> int:
+            copied = 0
+            while True:
+                res = old.get(include=include, limit=batch_size, offset=copied)
+                if not res["ids"]:
+                    return copied
+                with metrics.span("vector_write"):
+                    new.add(
+                        ids=res["ids"],
+                        documents=res["documents"],
+                        metadatas=res["metadatas"],
+                        embeddings=res["embeddings"] if keep_embeddings else None,
+                    )
+                copied += len(res["ids"])
+
+        return self._swap_in(fill)
+
+    def replace_all(
+        self,
+        batches: Iterable[Tuple[List[str], List[str], List[Dict[str, Any]], Any]],
+        check: Optional[Callable[[Any], None]] = None,
+    ) -> int:
+        """
+        Replace the collection with precomputed (ids, documents, metadatas,
+        embeddings) batches; nothing is encoded. check(new_collection) runs
+        before the swap and keeps the current collection if it raises. The
+        lexical index is left to the caller.
+        """
+        def fill(new) -> int:
+            written = 0
+            for ids, docs, metadatas, embeddings in batches:
+                with metrics.span("vector_write"):
+                    new.add(ids=ids, documents=docs, metadatas=metadatas, embeddings=embeddings)
+                written += len(ids)
+            if check is not None:
+                check(new)
+            return written
+
+        self.collection, written = self._swap_in(fill)
+        self._dim = None
+        return written
+
+    def reload_lexical(self):
+        """Drop the in-memory BM25 index so it is read again from its file."""
+        self.lexical = LexicalIndex(self.lexical.path)
+
+    def compact(self) -> int:
+        """
+        Rewrite the collection with its stored embeddings, dropping HNSW
+        entries left behind by deletes and updates. Nothing is re-encoded.
+        Queries running during the swap may fail, so compact idle stores.
+        """
+        self.collection, copied = self._rebuild(self.collection, keep_embeddings=True)
+        return copied
+
+    def drop(self):
+        """Delete the collection and its lexical index."""
+        self.client.delete_collection(self.collection_name)
+        self.lexical.clear()
+        if self.lexical.exists():
+            os.remove(self.lexical.path)
+
+    def vector_bytes(self) -> int:
+        """Rough in-memory size of the HNSW index: vectors plus level-0 links."""
+        count = self.collection.count()
+        if count and self._dim is None:
+            res = self.collection.get(limit=1, include=["embeddings"])
+            self._dim = len(res["embeddings"][0])
+        return count * ((self._dim or 0) * 4 + 128)
+
+    def _prepare(self, chunks: List[Dict[str, Any]]):
         ids = []
         docs = []
         metadatas = []
+        base = None
         for i, ch in enumerate(chunks):
-            ids.append(ch.get("id", f"chunk-{len(self.collection)-i}-{i}"))
+            if "id" not in ch and base is None:
+                base = self.collection.count()
+            ids.append(ch["id"] if "id" in ch else f"chunk-{base + i}")
             docs.append(ch["text"])
-            metadatas.append({
+            metadatas.append(_clean_metadata({
                 "source_document": ch.get("source_document", "unknown"),
                 "chunk_index": ch.get("chunk_index", i),
                 **(ch.get("metadata", {})),
-            })
+            }))
+        return ids, docs, metadatas
+
+    def add_chunks(self, chunks: List[Dict[str, Any]]):
+        ids, docs, metadatas = self._prepare(chunks)
         if ids:
-            self.collection.add(ids=ids, documents=docs, metadatas=metadatas)
+            with metrics.span("vector_write"):
+                self.collection.add(ids=ids, documents=docs, metadatas=metadatas)
+            self.lexical.upsert(ids, docs)
+            self.lexical.save()
+
+    def embed(self, texts: List[str]) -> List[Any]:
+        if not texts:
+            return []
+        with metrics.span("embed"):
+            return self.embedding_function(texts)
+
+    def upsert_chunks(self, chunks: List[Dict[str, Any]], embeddings: Optional[List[Any]] = None):
+        ids, docs, metadatas = self._prepare(chunks)
+        if ids:
+            with metrics.span("vector_write"):
+                self.collection.upsert(ids=ids, documents=docs, metadatas=metadatas, embeddings=embeddings)
+            self.lexical.upsert(ids, docs)
+
+    def delete_ids(self, ids: List[str]):
+        if ids:
+            self.collection.delete(ids=list(ids))
+            self.lexical.delete(ids)
+
+    def flush(self):
+        self.embedding_cache.flush()
+        self.lexical.save()
+
+    def get_chunks(self, ids: List[str]) -> List[Dict[str, Any]]:
+        if not ids:
+            return []
+        res = self.collection.get(ids=list(ids), include=["documents", "metadatas"])
+        by_id = {
+            cid: {"id": cid, "text": d, "metadata": m}
+            for cid, d, m in zip(res["ids"], res["documents"], res["metadatas"])
+        }
+        return [by_id[cid] for cid in ids if cid in by_id]
+
+    def lexical_query(self, query_text: str, top_k: int = 6) -> List[Dict[str, Any]]:
+        if not self.lexical.exists() and len(self.lexical) == 0 and self.collection.count():
+            # Collections built before the lexical index existed: backfill once
+            res = self.collection.get(include=["documents"])
+            self.lexical.upsert(res["ids"], res["documents"])
+            self.lexical.save()
+        with metrics.span("lexical_query"):
+            hits = self.lexical.search(query_text, top_k=top_k)
+        chunks = self.get_chunks([cid for cid, _ in hits])
+        scores = dict(hits)
+        for ch in chunks:
+            ch["score"] = scores[ch["id"]]
+        return chunks
 
-    def query(self, query_text: str, top_k: int = 6) -> List[Dict[str, Any]]:
-        res = self.collection.query(query_texts=[query_text], n_results=top_k)
+    def query(self, query_text: str, top_k: int = 6, query_embedding: Optional[Any] = None) -> List[Dict[str, Any]]:
+        with metrics.span("vector_query"):
+            if query_embedding is not None:
+                res = self.collection.query(query_embeddings=[query_embedding], n_results=top_k)
+            else:
+                res = self.collection.query(query_texts=[query_text], n_results=top_k)
         results = []
         if res and "documents" in res:
+            ids = res["ids"][0]
             docs = res["documents"][0]
             metas = res["metadatas"][0]
-            for d, m in zip(docs, metas):
-                results.append({"text": d, "metadata": m})
-        return results
\ No newline at end of file
+            for cid, d, m in zip(ids, docs, metas):
+                results.append({"id": cid, "text": d, "metadata": m})
+        return results
@@ -0,0 +1,7 @@
+from qa_agent.embedders import OnnxEmbedder, SentenceTransformerEmbedder
+
+
+def test_embedding_nothing_does_not_load_the_model(tmp_path):
+    for embedder in (SentenceTransformerEmbedder(), OnnxEmbedder(model_dir=str(tmp_path / "missing"))):
+        assert embedder.embed([]).shape[0] == 0
+        assert not embedder.loaded
@@ -0,0 +1,62 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+
+import pytest
+
+from qa_agent.llm import LLMProvider
+
+
+def _server(lines):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+            for obj in lines:
+                self.wfile.write(json.dumps(obj).encode() + b"\n")
+            # HTTP/1.0 without Content-Length: the body ends when the connection closes
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@pytest.fixture
+def provider():
+    servers = []
+
+    def make(lines, model):
+        server = _server(lines)
+        servers.append(server)
+        return LLMProvider(ollama_url=f"http://127.0.0.1:{server.server_port}", ollama_model=model, retries=0)
+
+    yield make
+    for server in servers:
+        server.shutdown()
+
+
+def test_complete_stream_is_returned(provider):
+    llm = provider([{"response": "| a ", "done": False}, {"response": "| b |", "done": False}, {"response": "", "done": True}], "complete")
+    assert "".join(llm.generate_stream("p")) == "| a | b |"
+    assert llm.generate("p") == "| a | b |"
+
+
+def test_stream_cut_off_after_tokens_raises(provider):
+    llm = provider([{"response": "| a ", "done": False}, {"response": "| b |", "done": False}], "truncated")
+    received = []
+    with pytest.raises(ConnectionError):
+        for tok in llm.generate_stream("p"):
+            received.append(tok)
+    assert received == ["| a ", "| b |"]
+    # Non-streaming callers get the template rather than the truncated text
+    assert llm.is_fallback(llm.generate("p"))
+
+
+def test_stream_failing_before_any_token_falls_back(provider):
+    llm = provider([{"error": "model not found"}], "missing")
+    assert llm.is_fallback("".join(llm.generate_stream("p")))
@@ -0,0 +1,76 @@
+import threading
+import time
+
+from qa_agent.llm_scheduler import BULK, INTERACTIVE, LLMScheduler
+
+
+def _wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def _blocking(gate, tokens):
+    def produce():
+        gate.wait()
+        yield from tokens
+    return produce
+
+
+def _tokens(*tokens):
+    def produce():
+        yield from tokens
+    return produce
+
+
+def _consume(scheduler, key, priority, produce, out, errors):
+    try:
+        out.append("".join(scheduler.stream(key, priority, produce)))
+    except Exception as e:
+        errors.append(e)
+
+
+def test_follower_promotes_queued_bulk_leader():
+    scheduler = LLMScheduler("m", max_concurrency=1)
+    gate = threading.Event()
+    out, errors = [], []
+    busy = threading.Thread(target=_consume, args=(scheduler, None, BULK, _blocking(gate, ["x"]), out, errors))
+    busy.start()
+    _wait_for(lambda: scheduler.active == 1)
+
+    leader = threading.Thread(target=_consume, args=(scheduler, "k", BULK, _blocking(gate, ["a", "b"]), out, errors))
+    leader.start()
+    _wait_for(lambda: scheduler.stats()["queued"][BULK] == 1)
+    follower = threading.Thread(target=_consume, args=(scheduler, "k", INTERACTIVE, _tokens("z"), out, errors))
+    follower.start()
+    _wait_for(lambda: scheduler.coalesced == 1)
+
+    assert scheduler.stats()["queued"] == {INTERACTIVE: 1, BULK: 0}
+    gate.set()
+    for t in (busy, leader, follower):
+        t.join(5)
+    assert not errors
+    assert sorted(out) == ["ab", "ab", "x"]
+
+
+def test_concurrent_coalesce_and_promote():
+    # The follower joins as soon as the flight is registered, racing the leader's enqueue
+    for _ in range(200):
+        scheduler = LLMScheduler("m", max_concurrency=1)
+        gate = threading.Event()
+        out, errors = [], []
+        busy = threading.Thread(target=_consume, args=(scheduler, None, BULK, _blocking(gate, ["x"]), out, errors))
+        busy.start()
+        _wait_for(lambda: scheduler.active == 1)
+        leader = threading.Thread(target=_consume, args=(scheduler, "k", BULK, _tokens("a"), out, errors))
+        leader.start()
+        _wait_for(lambda: "k" in scheduler._flights)
+        follower = threading.Thread(target=_consume, args=(scheduler, "k", INTERACTIVE, _tokens("z"), out, errors))
+        follower.start()
+        _wait_for(lambda: scheduler.coalesced == 1)
+        gate.set()
+        for t in (busy, leader, follower):
+            t.join(5)
+        assert not errors
+        assert sorted(out) == ["a", "a", "x"]
@@ -0,0 +1,18 @@
+from qa_agent.metrics import Registry
+
+
+def _samples(text):
+    return dict(line.rsplit(" ", 1) for line in text.splitlines() if line and not line.startswith("#"))
+
+
+def test_prometheus_values_keep_full_precision():
+    registry = Registry()
+    registry.inc("qa_requests_total", 1234567, route="/x")
+    registry.inc("qa_tokens_total", 0.1)
+    registry.inc("qa_tokens_total", 0.2)
+    registry.observe("qa_latency_seconds", 0.0000012)
+    samples = _samples(registry.render_prometheus())
+    assert samples['qa_requests_total{route="/x"}'] == "1234567"
+    assert float(samples["qa_tokens_total"]) == 0.1 + 0.2
+    assert float(samples["qa_latency_seconds_sum"]) == 0.0000012
+    assert samples["qa_latency_seconds_count"] == "1"
@@ -0,0 +1,91 @@
+import zlib
+
+import numpy as np
+import pytest
+
+from qa_agent.agent import _words, merge_test_plan, plan_features
+
+
+OUTLINE = [
+    {
+        "source_document": "product_specs.md",
+        "headings": [
+            "Product Specifications",
+            "Product Specifications > Discount Codes",
+            "Product Specifications > Shipping Costs",
+            "Product Specifications > Cart and Pricing",
+            "Product Specifications > Validation Rules",
+            "Product Specifications > Payment",
+        ],
+    },
+    {"source_document": "checkout.html", "headings": ["E-Shop Checkout", "Cart Summary", "User Details"]},
+    {"source_document": "ui_ux_guide.txt", "headings": []},
+]
+ALL_FEATURES = [
+    "Discount Codes", "Shipping Costs", "Cart and Pricing", "Validation Rules", "Payment",
+    "E-Shop Checkout", "Cart Summary", "User Details",
+]
+
+
+class _Store:
+    def embed(self, texts):
+        # Bag of words over hashed buckets: similar names share words
+        out = np.zeros((len(texts), 256), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in _words(text):
+                out[row, zlib.crc32(word.encode()) % 256] += 1.0
+        return out
+
+
+class _KB:
+    store = _Store()
+
+    def outline(self):
+        return OUTLINE
+
+
+def _planned(query, **kwargs):
+    return [f["feature"] for f in plan_features(query, _KB(), **kwargs)]
+
+
+@pytest.mark.parametrize("query", [
+    "all tests for checkout",
+    "test the whole checkout flow",
+    "all tests for the checkout page",
+    "generate test cases for the product specifications",
+])
+def test_broad_request_plans_every_feature(query):
+    assert _planned(query) == ALL_FEATURES
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("tests for discount codes", ["Discount Codes"]),
+    ("checkout payment tests", ["Payment"]),
+    ("payment and discount codes", ["Discount Codes", "Payment"]),
+    ("cart summary", ["Cart Summary", "Cart and Pricing"]),
+])
+def test_narrow_request_plans_only_named_features(query, expected):
+    assert _planned(query) == expected
+
+
+def test_max_features_applies_after_the_cutoff():
+    assert _planned("all tests for checkout", max_features=3) == ALL_FEATURES[:3]
+    assert _planned("payment and discount codes", max_features=1) == ["Discount Codes"]
+
+
+def test_merge_keeps_cases_without_scenario_or_expected_result():
+    results = [{
+        "feature": "Payment",
+        "sources": ["product_specs.md"],
+        "citations": [],
+        "cases": [
+            {"Test_Scenario": "Pay with PayPal", "Expected_Result": "Payment Successful!"},
+            {"Test_Scenario": "Pay with PayPal", "Expected_Result": "Payment Successful!"},
+            {"Test_Scenario": "", "Expected_Result": "", "Test_Data": "card 4111"},
+            {"Test_Data": "card 4000"},
+        ],
+    }]
+    plan = merge_test_plan("payment", results)
+    assert len(plan["test_cases"]) == 3
+    assert plan["duplicates_removed"] == 1
+    assert len({c["Test_ID"] for c in plan["test_cases"]}) == 3
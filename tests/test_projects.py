@@ -0,0 +1,32 @@
+import pytest
+
+from qa_agent.projects import ProjectPool
+from qa_agent.snapshot import SnapshotError
+
+
+@pytest.fixture
+def pool(tmp_path, monkeypatch):
+    monkeypatch.setenv("EMBEDDING_CACHE_DIR", str(tmp_path / "embedding_cache"))
+    pool = ProjectPool(persist_dir=str(tmp_path / "chroma"), projects_dir=str(tmp_path / "projects"))
+    yield pool
+    pool.close()
+
+
+def test_failed_import_into_new_project_leaves_nothing_behind(pool, tmp_path):
+    bogus = tmp_path / "bogus.zip"
+    bogus.write_bytes(b"not a zip")
+    with pytest.raises(SnapshotError):
+        pool.import_snapshot("teamc", str(bogus))
+    assert "teamc" not in pool.project_ids()
+    assert not pool.exists("teamc")
+    assert not (tmp_path / "projects" / "teamc").exists()
+
+
+def test_failed_import_keeps_existing_project(pool, tmp_path):
+    pool.get("teama")
+    bogus = tmp_path / "bogus.zip"
+    bogus.write_bytes(b"not a zip")
+    with pytest.raises(SnapshotError):
+        pool.import_snapshot("teama", str(bogus))
+    assert "teama" in pool.project_ids()
+    assert (tmp_path / "projects" / "teama").is_dir()
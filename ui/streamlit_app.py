@@ -1,28 +1,48 @@
 import os
 import json
-import io
 import streamlit as st
 
+from qa_agent import metrics, resources
 from qa_agent.knowledge_base import KnowledgeBase
 from qa_agent.llm import LLMProvider
-from qa_agent.agent import generate_test_cases
-from qa_agent.script_generator import generate_selenium_script
+from qa_agent.agent import iter_test_plan, plan_to_markdown, stream_test_cases
+from qa_agent.script_generator import build_scripts_zip, iter_selenium_scripts, scripts_report, stream_selenium_script
 
 
 st.set_page_config(page_title="Autonomous QA Agent", layout="wide")
 st.title("Autonomous QA Agent for Test Case and Script Generation")
 
+
+# Process-wide resources: every browser session shares one store, embedding model and HTTP pool
+@st.cache_resource(show_spinner=False)
+def shared_kb() -> KnowledgeBase:
+    return KnowledgeBase()
+
+
+@st.cache_resource(show_spinner=False)
+def shared_llm() -> LLMProvider:
+    return LLMProvider()
+
+
+@st.cache_resource(show_spinner=False)
+def start_warm_up():
+    # Loads the embedding model in the background while the first page renders
+    return resources.warm_up()
+
+
+start_warm_up()
+
 if "kb" not in st.session_state:
     # Lazy-init KB to avoid startup failures before dependencies are installed
     st.session_state.kb = None
 if "llm" not in st.session_state:
-    st.session_state.llm = LLMProvider()
+    st.session_state.llm = shared_llm()
 if "built" not in st.session_state:
     st.session_state.built = False
 if "last_tests" not in st.session_state:
     st.session_state.last_tests = ""
-if "html_text" not in st.session_state:
-    st.session_state.html_text = None
+if "last_test_cases" not in st.session_state:
+    st.session_state.last_test_cases = []
 
 
 with st.sidebar:
@@ -46,32 +66,46 @@ if st.button("Build Knowledge Base"):
     if use_example_docs:
         docs_dir = os.path.join(here, "docs")
         for name in ["product_specs.md", "ui_ux_guide.txt", "api_endpoints.json"]:
-            p = os.path.join(docs_dir, name)
-            with open(p, "rb") as f:
-                docs.append({"filename": name, "content": f.read()})
+            # Read from disk by the ingestion pipeline
+            docs.append({"filename": name, "path": os.path.join(docs_dir, name)})
     for f in uploaded_docs or []:
         docs.append({"filename": f.name, "content": f.getvalue()})
 
     html_doc = None
     if use_example_html and os.path.exists(default_html_path):
-        with open(default_html_path, "rb") as f:
-            html_doc = {"filename": "checkout.html", "content": f.read()}
+        html_doc = {"filename": "checkout.html", "path": default_html_path}
     elif uploaded_html is not None:
         html_doc = {"filename": uploaded_html.name, "content": uploaded_html.getvalue()}
 
     # Initialize KB on demand
     if st.session_state.kb is None:
-        st.session_state.kb = KnowledgeBase()
-    st.session_state.kb.build(docs, html_document=html_doc)
-    if html_doc:
-        # store visible text for script gen context
-        st.session_state.html_text = html_doc["content"].decode("utf-8", errors="ignore")
+        st.session_state.kb = shared_kb()
+    progress_bar = st.progress(0.0, text="Ingesting documents...")
+
+    def on_progress(p):
+        done = p["documents_done"] / max(1, p["documents_total"])
+        progress_bar.progress(
+            min(1.0, done),
+            text=f"{p['documents_done']}/{p['documents_total']} documents, "
+                 f"{p['chunks_written']} chunks embedded ({p['chunks_per_s']:.0f} chunks/s)",
+        )
+
+    stats = st.session_state.kb.build(docs, html_document=html_doc, progress=on_progress)
+    progress_bar.empty()
     st.session_state.built = True
-    st.success("Knowledge Base Built")
+    st.success(
+        f"Knowledge Base Built: {stats['added']} added, {stats['updated']} updated, "
+        f"{stats['deleted']} deleted, {stats['skipped']} unchanged chunks "
+        f"({stats['chunks_per_s']:.0f} chunks/s)"
+    )
 
 st.divider()
 st.subheader("Phase 2: Test Case Generation Agent")
 query = st.text_area("Agent prompt", value="Generate all positive and negative test cases for the discount code feature.")
+planner_mode = st.checkbox(
+    "Plan per feature (parallel)",
+    help="Split the request into one sub-query per documented feature, generate them concurrently and merge one JSON plan.",
+)
 
 if st.button("Generate Test Cases"):
     if not st.session_state.built:
@@ -79,10 +113,40 @@ if st.button("Generate Test Cases"):
     else:
         if st.session_state.kb is None:
             st.warning("Build the Knowledge Base first.")
-        else:
-            out = generate_test_cases(query, st.session_state.kb, st.session_state.llm)
-            st.session_state.last_tests = out
+        elif planner_mode:
+            status = st.empty()
+            done = []
+            plan = {}
+            for event in iter_test_plan(query, st.session_state.kb, st.session_state.llm):
+                if event["type"] == "feature":
+                    done.append(f"{event['feature']}: {event['cases']} cases ({event['status']}, {event['elapsed_s']:.1f}s)")
+                    status.markdown("  \n".join(done))
+                else:
+                    plan = event["plan"]
+            out = plan_to_markdown(plan)
+            st.caption(f"{len(plan['test_cases'])} test cases from {len(plan['features'])} features in {plan['elapsed_s']:.1f}s")
             st.markdown(out)
+            st.download_button("Download Test Plan (.json)", data=json.dumps(plan, indent=2), file_name="test_plan.json")
+            st.session_state.last_test_cases = plan["test_cases"]
+            st.session_state.last_tests = out
+        else:
+            # Render tokens as they arrive; the final event carries the parsed plan
+            placeholder = st.empty()
+            out = ""
+            try:
+                for event in stream_test_cases(query, st.session_state.kb, st.session_state.llm):
+                    if event["type"] == "token":
+                        out += event["text"]
+                        placeholder.markdown(out + "▌")
+                    else:
+                        out = event["data"]
+                        st.session_state.last_test_cases = event["test_cases"]
+            except Exception as e:
+                placeholder.markdown(out)
+                st.error(f"Generation failed after {len(out)} characters; the output above is incomplete: {e}")
+            else:
+                placeholder.markdown(out)
+                st.session_state.last_tests = out
 
 if st.session_state.last_tests:
     st.divider()
@@ -97,7 +161,60 @@ if st.session_state.last_tests:
             st.error("Please provide a valid JSON test case.")
             tc = None
         if tc is not None:
-            html_text = st.session_state.html_text or ((st.session_state.kb.get_html() if st.session_state.kb else "") or "")
-            code = generate_selenium_script(tc, html_text, st.session_state.kb, st.session_state.llm)
-            st.code(code, language="python")
-            st.download_button("Download Script", data=code, file_name=f"{tc.get('Test_ID','test')}.py")
\ No newline at end of file
+            # Selectors come from the KB's cached DOM index, not a raw HTML copy
+            html_text = (st.session_state.kb.get_html() if st.session_state.kb else "") or ""
+            placeholder = st.empty()
+            streamed = ""
+            result = {}
+            try:
+                for event in stream_selenium_script(tc, html_text, st.session_state.kb, st.session_state.llm):
+                    if event["type"] == "token":
+                        streamed += event["text"]
+                        placeholder.code(streamed, language="python")
+                    else:
+                        result = event
+            except Exception as e:
+                st.error(f"Script generation failed; the code above is incomplete: {e}")
+                st.stop()
+            code = result.get("code", "")
+            placeholder.code(code, language="python")
+            st.caption(f"Path: {result.get('path')} ({result.get('elapsed_s', 0.0) * 1000:.0f} ms)")
+            if result.get("steps_unresolved"):
+                st.caption("Steps sent to the LLM: " + "; ".join(result["steps_unresolved"]))
+            if result.get("steps_missing"):
+                st.warning("No code for these steps (left as TODOs): " + "; ".join(result["steps_missing"]))
+            st.download_button("Download Script", data=code, file_name=f"{tc.get('Test_ID','test')}.py")
+
+    if st.session_state.last_test_cases:
+        st.markdown(f"**Bulk generation** for all {len(st.session_state.last_test_cases)} parsed test cases")
+        concurrency = st.number_input("LLM concurrency", min_value=1, max_value=16, value=4)
+        if st.button("Generate Scripts for All Test Cases"):
+            cases = st.session_state.last_test_cases
+            html_text = (st.session_state.kb.get_html() if st.session_state.kb else "") or ""
+            bar = st.progress(0.0, text="Generating scripts...")
+            results = []
+            for r in iter_selenium_scripts(cases, html_text, st.session_state.kb, st.session_state.llm, concurrency=int(concurrency)):
+                results.append(r)
+                status = "ok" if r["ok"] else f"failed: {r['error']}"
+                bar.progress(len(results) / len(cases), text=f"{r['test_id']} {status} ({r['elapsed_s']:.1f}s)")
+            report = scripts_report(results)
+            st.success(f"{report['succeeded']}/{report['total']} scripts generated (paths: {report['paths']})")
+            st.dataframe(report["cases"])
+            st.download_button("Download All Scripts (.zip)", data=build_scripts_zip(results), file_name="selenium_scripts.zip")
+
+# Rendered last so it includes timings from this run
+with st.sidebar:
+    with st.expander("Debug: timings & metrics"):
+        snap = metrics.snapshot()
+        rates = {
+            "embedding cache": snap["embedding_cache_hit_rate"],
+            "response cache": snap["response_cache_hit_rate"],
+        }
+        st.markdown("  \n".join(f"{name} hit rate: {'n/a' if r is None else f'{r:.0%}'}" for name, r in rates.items()))
+        if snap["stages"]:
+            st.dataframe([{"stage": name, **vals} for name, vals in sorted(snap["stages"].items())])
+        if snap["llm_queue_wait"]:
+            st.caption("LLM queue wait (model/priority)")
+            st.dataframe([{"queue": name, **vals} for name, vals in sorted(snap["llm_queue_wait"].items())])
+        if snap["counters"]:
+            st.json(snap["counters"])